@@ -0,0 +1,118 @@
+"""
+Compare memory and decode throughput of `BlockHeader` records against the
+`getblockheader` dicts (parsed with `parse_getblockheader_t`) for a long
+header window, from RPC JSON and from raw 80 byte serializations.
+
+    PYTHONPATH=.. python3 block_header.py [--count n] [--rounds n]
+"""
+import os
+import gc
+import json
+import tracemalloc
+from time import perf_counter
+from argparse import ArgumentParser
+
+from btcrelay.bitcoin import double_sha256
+from btcrelay.apis.bitcoinrpc import parse_getblockheader_t
+from btcrelay.blockheader import HEADER_STRUCT, BlockHeader, decode_headers, submit_headers
+
+
+def rpc_results(count:int) -> tuple[list[str],bytes]:
+    """JSON `getblockheader` results for a chain of random headers, plus their serialization"""
+    results = []
+    raw = []
+    prev = bytes(32)
+    for height in range(count):
+        header = HEADER_STRUCT.pack(0x20000000, prev, os.urandom(32), 1600000000 + (height * 600),
+                                    0x17034219, height)
+        blockhash = double_sha256(header)
+        raw.append(header)
+        results.append(json.dumps({
+            'hash': blockhash[::-1].hex(), 'confirmations': count - height, 'height': height,
+            'version': 0x20000000, 'versionHex': '20000000', 'merkleroot': header[36:68][::-1].hex(),
+            'time': 1600000000 + (height * 600), 'mediantime': 1600000000 + (height * 600) - 3000,
+            'nonce': height, 'bits': '17034219', 'difficulty': 83148355189239.77,
+            'chainwork': f'{height:064x}', 'nTx': 3000, 'previousblockhash': prev[::-1].hex(),
+            'nextblockhash': '00' * 32}))
+        prev = blockhash
+    return results, b''.join(raw)
+
+
+def parse_dict(result:str) -> dict:
+    block = json.loads(result)
+    parse_getblockheader_t(block)
+    return block
+
+
+def unpack_dict(raw:bytes, count:int) -> list[dict]:
+    blocks = []
+    for i in range(count):
+        header = raw[i*80:(i+1)*80]
+        version, prevhash, merkleroot, time, bits, nonce = HEADER_STRUCT.unpack(header)
+        blocks.append({'version': version, 'previousblockhash': prevhash, 'merkleroot': merkleroot,
+                       'time': time, 'bits': bits, 'nonce': nonce, 'hash': double_sha256(header),
+                       'height': i, 'chainwork': 0})
+    return blocks
+
+
+def measure(build) -> int:
+    """Bytes allocated and still held by the result of `build`"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def best_of(rounds:int, fn) -> float:
+    best = None
+    for _ in range(rounds):
+        t0 = perf_counter()
+        fn()
+        elapsed = perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    assert best is not None
+    return best
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--count', type=int, default=2016 * 5, help='Headers in the window')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    results, raw = rpc_results(args.count)
+    n = args.count
+    records = decode_headers(raw, 0)
+    assert [_.hash for _ in records] == [parse_dict(_)['hash'] for _ in results]
+    assert BlockHeader.from_rpc(json.loads(results[-1])).as_tuple() == records[-1].as_tuple()
+
+    # Holding the window, as parsed from RPC JSON
+    dicts_json = measure(lambda: [parse_dict(_) for _ in results])
+    records_json = measure(lambda: [BlockHeader.from_rpc(json.loads(_)) for _ in results])
+    # Holding the window, as decoded from raw headers (e.g. the header store)
+    dicts_raw = measure(lambda: unpack_dict(raw, n))
+    records_raw = measure(lambda: decode_headers(raw, 0))
+    print(f'{n} headers held in memory:')
+    print(f'  from JSON  dict {dicts_json / n:7.0f} B/header  BlockHeader {records_json / n:5.0f} B/header '
+          f'({dicts_json / records_json:.1f}x smaller)')
+    print(f'  from bytes dict {dicts_raw / n:7.0f} B/header  BlockHeader {records_raw / n:5.0f} B/header '
+          f'({dicts_raw / records_raw:.1f}x smaller)')
+
+    t_dict_json = best_of(args.rounds, lambda: [parse_dict(_) for _ in results])
+    t_rec_json = best_of(args.rounds, lambda: [BlockHeader.from_rpc(json.loads(_)) for _ in results])
+    t_dict_raw = best_of(args.rounds, lambda: unpack_dict(raw, n))
+    t_rec_raw = best_of(args.rounds, lambda: decode_headers(raw, 0))
+    dicts = unpack_dict(raw, n)
+    t_dict_submit = best_of(args.rounds, lambda: submit_headers(dicts))
+    t_rec_submit = best_of(args.rounds, lambda: submit_headers(records))
+    print('Throughput (headers/s):')
+    print(f'  from JSON  dict {n / t_dict_json:10.0f}  BlockHeader {n / t_rec_json:10.0f}')
+    print(f'  from bytes dict {n / t_dict_raw:10.0f}  BlockHeader {n / t_rec_raw:10.0f}')
+    print(f'  submit arg dict {n / t_dict_submit:10.0f}  BlockHeader {n / t_rec_submit:10.0f}')
+
+
+if __name__ == '__main__':
+    main()
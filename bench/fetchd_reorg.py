@@ -0,0 +1,60 @@
+"""
+Simulate a relay which has fallen behind and/or is on a stale fork, then
+count the relay (Multicall3 eth_call) and Bitcoin RPC round trips needed to find the
+fork point: walking back one height at a time vs find_fork_height.
+
+    PYTHONPATH=.. python3 fetchd_reorg.py [--depth n] [--behind n]
+"""
+from os import urandom
+from argparse import ArgumentParser
+
+from btcrelay.fetchd import find_fork_height
+
+
+class Counter:
+    def __init__(self):
+        self.relay = 0
+        self.btc = 0
+
+
+def simulate(height:int, depth:int, behind:int, start:int):
+    """Returns relay & bitcoin hash chains, diverging `depth` blocks below the relay tip"""
+    btc = [urandom(32) for _ in range(height + 1)]
+    relay_tip = height - behind
+    relay = btc[:relay_tip + 1 - depth] + [urandom(32) for _ in range(depth)]
+    return relay[start:], btc, relay_tip
+
+
+def linear(relay_hashes, btc_hashes, tip:int, low:int) -> int:
+    # Previous fetchd behaviour, one relay call & one RPC per height
+    height = tip
+    while relay_hashes([height]) != btc_hashes([height]):
+        height -= 1
+    return height
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--height', type=int, default=100000)
+    parser.add_argument('--start', type=int, default=50000, help='Relay start height')
+    parser.add_argument('--depth', type=int, default=100, help='Reorg depth below relay tip')
+    parser.add_argument('--behind', type=int, default=0, help='Relay lag behind Bitcoin tip')
+    args = parser.parse_args()
+
+    relay, btc, tip = simulate(args.height, args.depth, args.behind, args.start)
+    expected = tip - args.depth
+    print(f'relay tip {tip}, reorg depth {args.depth}, fork point {expected}')
+
+    for name, fn in (('linear', linear), ('search', find_fork_height)):
+        c = Counter()
+        def relay_hashes(heights:list[int]) -> list[bytes]:
+            c.relay += 1
+            return [relay[_ - args.start] for _ in heights]
+        def btc_hashes(heights:list[int]) -> list[bytes]:
+            c.btc += 1
+            return [btc[_] for _ in heights]
+        result = fn(relay_hashes, btc_hashes, tip, args.start)
+        assert result == expected, (name, result, expected)
+        print(f'{name:>8}: {c.relay} relay calls, {c.btc} bitcoin round trips')
+
+main()
@@ -0,0 +1,128 @@
+"""
+Compare fetching a window of headers from a local stub bitcoind as verbose
+JSON (`getblockheader` batches, the previous path), as serialized headers
+(`getblockheader` verbose=false batches) and via REST `/rest/headers`.
+
+    PYTHONPATH=.. python3 header_fetch.py [--count n] [--rounds n]
+"""
+import os
+import re
+import json
+from time import perf_counter
+from threading import Thread
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from btcrelay.bitcoin import double_sha256
+from btcrelay.blockheader import HEADER_STRUCT
+from btcrelay.apis.bitcoinrpc import BitcoinJsonRpc
+from btcrelay.apis.poly import decode_raw_headers
+
+REST_RE = re.compile(r'/rest/headers/([0-9a-f]{64})\.bin\?count=(\d+)$')
+
+
+class Chain:
+    def __init__(self, count:int):
+        self.raw = []
+        self.by_hash = {}
+        prev = bytes(32)
+        for height in range(count):
+            header = HEADER_STRUCT.pack(0x20000000, prev, os.urandom(32), 1600000000 + (height * 600),
+                                        0x17034219, height)
+            prev = double_sha256(header)
+            self.by_hash[prev[::-1].hex()] = height
+            self.raw.append(header)
+
+    def verbose(self, height:int) -> dict:
+        header = self.raw[height]
+        version, prev, merkleroot, time, bits, nonce = HEADER_STRUCT.unpack(header)
+        return {'hash': double_sha256(header)[::-1].hex(), 'confirmations': len(self.raw) - height,
+                'height': height, 'version': version, 'versionHex': f'{version:08x}',
+                'merkleroot': merkleroot[::-1].hex(), 'time': time, 'mediantime': time - 3000,
+                'nonce': nonce, 'bits': f'{bits:08x}', 'difficulty': 83148355189239.77,
+                'chainwork': f'{height:064x}', 'nTx': 3000, 'previousblockhash': prev[::-1].hex()}
+
+
+def handler(chain:Chain):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def reply(self, request):
+            method, params = request['method'], request['params']
+            if method == 'getblockhash':
+                result = double_sha256(chain.raw[params[0]])[::-1].hex()
+            elif params[1]:
+                result = chain.verbose(chain.by_hash[params[0]])
+            else:
+                result = chain.raw[chain.by_hash[params[0]]].hex()
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': None, 'result': result}
+
+        def send(self, body:bytes):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if isinstance(request, list):
+                self.send(json.dumps([self.reply(_) for _ in request]).encode())
+            else:
+                self.send(json.dumps(self.reply(request)).encode())
+
+        def do_GET(self):
+            match = REST_RE.match(self.path)
+            height = chain.by_hash[match.group(1)]
+            self.send(b''.join(chain.raw[height:height + int(match.group(2))]))
+
+        def log_message(self, *args):
+            pass
+    return StubHandler
+
+
+def best_of(rounds:int, fn) -> float:
+    best = None
+    for _ in range(rounds):
+        t0 = perf_counter()
+        fn()
+        elapsed = perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    assert best is not None
+    return best
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000, help='Headers fetched')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    chain = Chain(args.count + 1)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler(chain))
+    Thread(target=server.serve_forever, daemon=True).start()
+    rpc = BitcoinJsonRpc(f'http://127.0.0.1:{server.server_address[1]}/')
+    heights = range(1, args.count + 1)
+
+    def verbose():
+        return rpc.getblockheaders(rpc.getblockhashes(heights))
+    def raw_batch():
+        return decode_raw_headers(rpc.getblockheadersraw(rpc.getblockhashes(heights)), 1, args.count)
+    def rest():
+        return decode_raw_headers(rpc.getheadersraw(1, args.count), 1, args.count)
+
+    assert [_['hash'] for _ in verbose()] == [_.hash for _ in raw_batch()] == [_.hash for _ in rest()]
+    assert rpc.rest_path
+    try:
+        t_verbose = best_of(args.rounds, verbose)
+        t_raw = best_of(args.rounds, raw_batch)
+        t_rest = best_of(args.rounds, rest)
+    finally:
+        server.shutdown()
+    print(f'{args.count} headers: verbose JSON {t_verbose * 1000:.1f} ms, '
+          f'verbose=false {t_raw * 1000:.1f} ms ({t_verbose / t_raw:.1f}x), '
+          f'REST {t_rest * 1000:.1f} ms ({t_verbose / t_rest:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Compare JSON-RPC calls per second using a new urllib opener per call (the
+previous behaviour) against the pooled keep-alive transport.
+
+    PYTHONPATH=.. python3 jsonrpc_pool.py [calls]
+"""
+import sys
+import json
+import urllib.request
+from time import perf_counter
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from btcrelay.apis.jsonrpc import jsonrpc
+from btcrelay.apis.httppool import connection_pool
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        body = json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'error': None,
+                           'result': 800000}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def urllib_jsonrpc(url:str, method:str, rid:int):
+    opener = urllib.request.build_opener(urllib.request.HTTPHandler())
+    opener.addheaders = [('Content-Type', 'application/json')]
+    data = json.dumps({'jsonrpc': '2.0', 'method': method, 'params': [], 'id': rid}).encode()
+    with opener.open(url, data=data) as handle:
+        return json.load(handle)['result']
+
+
+def measure(name:str, n:int, fn) -> float:
+    start = perf_counter()
+    for i in range(n):
+        fn(i)
+    elapsed = perf_counter() - start
+    print(f'{name:>10}: {n} calls in {elapsed:.3f}s, {n / elapsed:.1f} calls/s')
+    return n / elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    try:
+        before = measure('urllib', n, lambda i: urllib_jsonrpc(url, 'getblockcount', i))
+        after = measure('pooled', n, lambda i: jsonrpc(url, 'getblockcount'))
+        print(f'speedup: {after / before:.2f}x')
+    finally:
+        connection_pool(url).close()
+        server.shutdown()
+
+main()
@@ -0,0 +1,74 @@
+"""
+Time merkle root and branch construction over real-size blocks, comparing
+the previous list-of-hashes implementation with the contiguous buffer one,
+and one-pass branches for many transactions against a tree per transaction.
+
+    PYTHONPATH=.. python3 merkle_build.py [--txids n ...] [--branches n] [--rounds n]
+"""
+import os
+from time import perf_counter
+from argparse import ArgumentParser
+
+from btcrelay.bitcoin import double_sha256, merkle_build, merkle_branches
+
+
+def merkle_build_list(hashes:list[bytes]) -> bytes|None:
+    """The implementation before contiguous levels, one bytes object per node"""
+    while len(hashes) > 1:
+        size = len(hashes)
+        hashes = [double_sha256(hashes[i] + hashes[min(i + 1, size - 1)])
+                  for i in range(0, size, 2)]
+    if hashes: return hashes[0]
+    return None
+
+
+def merkle_branch_list(hashes:list[bytes], index:int) -> list[bytes]:
+    """Branch for one index, rebuilding the tree like a per-proof lookup would"""
+    branch = []
+    while len(hashes) > 1:
+        size = len(hashes)
+        branch.append(hashes[min(index ^ 1, size - 1)])
+        hashes = [double_sha256(hashes[i] + hashes[min(i + 1, size - 1)])
+                  for i in range(0, size, 2)]
+        index >>= 1
+    return branch
+
+
+def best_of(rounds:int, fn) -> float:
+    best = None
+    for _ in range(rounds):
+        t0 = perf_counter()
+        fn()
+        elapsed = perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    assert best is not None
+    return best
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--txids', type=int, nargs='+', default=[500, 2500, 4000],
+                        help='Transactions per block')
+    parser.add_argument('--branches', type=int, default=16, help='Branches built per block')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    for count in args.txids:
+        hashes = [os.urandom(32) for _ in range(count)]
+        indexes = list(range(0, count, max(1, count // args.branches)))[:args.branches]
+        root, branches = merkle_branches(hashes, indexes)
+        assert root == merkle_build(hashes) == merkle_build_list(hashes)
+        assert all(branches[_] == merkle_branch_list(hashes, _) for _ in indexes)
+
+        old = best_of(args.rounds, lambda: merkle_build_list(hashes))
+        new = best_of(args.rounds, lambda: merkle_build(hashes))
+        old_branches = best_of(max(1, args.rounds // 4),
+                               lambda: [merkle_branch_list(hashes, _) for _ in indexes])
+        new_branches = best_of(args.rounds, lambda: merkle_branches(hashes, indexes))
+        print(f'{count} txids: root {old * 1000:.2f} ms -> {new * 1000:.2f} ms ({old / new:.2f}x), '
+              f'{len(indexes)} branches {old_branches * 1000:.2f} ms -> {new_branches * 1000:.2f} ms '
+              f'({old_branches / new_branches:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Catch-up against a stub provider which allows `--limit` requests per second
+and replies HTTP 429 beyond it, as getblock.io & mempool.space do. Reports
+throughput and 429s with no configured limit (the rate is learned from the
+first 429) and with the provider's rate configured, plus how many identical
+concurrent calls were coalesced.
+
+    PYTHONPATH=.. python3 rate_limit.py [--calls n] [--threads n] [--limit n]
+"""
+import json
+import logging
+from time import monotonic, perf_counter, sleep
+from threading import Thread, Lock
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from btcrelay.constants import LOGGER
+from btcrelay.apis.jsonrpc import jsonrpc
+from btcrelay.apis.ratelimit import configure_rate_limit
+from btcrelay.metrics import COALESCED
+
+
+class Provider:
+    """Server side token bucket, 1 second of burst"""
+    def __init__(self, limit:float):
+        self.limit = limit
+        self.tokens = limit
+        self.updated = monotonic()
+        self.ok = 0
+        self.throttled = 0
+        self.lock = Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.limit, self.tokens + ((now - self.updated) * self.limit))
+            self.updated = now
+            if self.tokens < 1:
+                self.throttled += 1
+                return False
+            self.tokens -= 1
+            self.ok += 1
+            return True
+
+
+def handler(provider:Provider):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if request['method'] == 'slow':
+                sleep(0.2)
+            if provider.allow():
+                self.send_response(200)
+                body = json.dumps({'id': request['id'], 'result': request['params'], 'error': None}).encode()
+            else:
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                body = b'{"error": "rate limited"}'
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return StubHandler
+
+
+def catch_up(url:str, provider:Provider, calls:int, threads:int) -> tuple[float,int]:
+    provider.ok = provider.throttled = 0
+    t0 = perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda i: jsonrpc(url, 'getblockhash', [i]), range(calls)))
+    return perf_counter() - t0, provider.throttled
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200, help='Calls per run')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--limit', type=float, default=50, help='Provider requests per second')
+    args = parser.parse_args()
+    LOGGER.setLevel(logging.ERROR)
+
+    provider = Provider(args.limit)
+    servers = [ThreadingHTTPServer(('127.0.0.1', 0), handler(provider)) for _ in range(2)]
+    for server in servers:
+        Thread(target=server.serve_forever, daemon=True).start()
+    learned, configured = [f'http://127.0.0.1:{_.server_address[1]}/' for _ in servers]
+    configure_rate_limit(f'127.0.0.1:{servers[1].server_address[1]}', args.limit, args.limit)
+
+    try:
+        ideal = args.calls / args.limit
+        for name, url in (('learned', learned), ('configured', configured)):
+            sleep(1)
+            elapsed, throttled = catch_up(url, provider, args.calls, args.threads)
+            print(f'{name}: {args.calls} calls in {elapsed:.2f}s ({args.calls / elapsed:.1f}/s, '
+                  f'ideal {ideal:.2f}s), {throttled} x 429')
+
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(lambda _: jsonrpc(configured, 'slow', [0]), range(args.threads)))
+        print(f'{args.threads} identical concurrent calls, {COALESCED.value(api="jsonrpc"):g} coalesced')
+    finally:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
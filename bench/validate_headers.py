@@ -0,0 +1,61 @@
+"""
+Time local validation of a full 2016 block retarget window of headers, as
+fetchd does before each submit (hashes, linkage, PoW, retarget, median-time-past).
+
+    PYTHONPATH=.. python3 validate_headers.py [--count n] [--rounds n]
+"""
+from time import perf_counter
+from argparse import ArgumentParser
+
+from btcrelay.headerstore import HEADER_STRUCT
+from btcrelay.bitcoin import double_sha256
+from btcrelay.validate import validate_headers, bits_to_target, MEDIAN_TIME_SPAN
+
+# Regtest difficulty, so the headers can be mined quickly
+BITS = 0x207fffff
+
+
+def mine(count:int, start:int):
+    """Mine a hash chain of headers from `start`, with a retarget in the middle"""
+    target = bits_to_target(BITS)
+    headers = []
+    prev = bytes(32)
+    for height in range(start, start + count):
+        time = 1600000000 + (height * 600)
+        nonce = 0
+        while True:
+            raw = HEADER_STRUCT.pack(0x20000000, prev, bytes(32), time, BITS, nonce)
+            blockhash = double_sha256(raw)
+            if int.from_bytes(blockhash, 'little') <= target:
+                break
+            nonce += 1
+        headers.append({'height': height, 'hash': blockhash, 'previousblockhash': prev,
+                        'merkleroot': bytes(32), 'version': 0x20000000, 'time': time,
+                        'bits': BITS, 'nonce': nonce})
+        prev = blockhash
+    return headers
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--count', type=int, default=2016, help='Headers per window')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    start = (2016 * 400) - (args.count // 2) - MEDIAN_TIME_SPAN
+    headers = mine(args.count + MEDIAN_TIME_SPAN, start)
+    ancestors, window = headers[:MEDIAN_TIME_SPAN], headers[MEDIAN_TIME_SPAN:]
+
+    best = None
+    for _ in range(args.rounds):
+        t0 = perf_counter()
+        validate_headers(window, ancestors, is_testnet=False)
+        elapsed = perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f'{len(window)} headers in {best * 1000:.2f} ms '
+          f'({best * 1e6 / len(window):.2f} us/header, best of {args.rounds})')
+
+
+if __name__ == '__main__':
+    main()
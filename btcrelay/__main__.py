@@ -6,6 +6,8 @@ from .deploy import CmdDeploy
 from .fetchd import CmdFetchd
 from .test import CmdTest
 from .deposit import CmdDeposit
+from .depositwatchd import CmdDepositWatchd
+from .derivebulk import CmdDepositDeriveBulk
 
 def main() -> None:
     argv = sys.argv
@@ -16,6 +18,8 @@ def main() -> None:
     CmdFetchd.setup(subparsers.add_parser('fetchd', help='Run BTCRelay synchronizer / fetch daemon'))
     CmdTest.setup(subparsers.add_parser('test', help='Run tests'))
     CmdDeposit.setup(subparsers.add_parser('deposit', help='Make a BTC deposit'))
+    CmdDepositDeriveBulk.setup(subparsers.add_parser('deposit-derive-bulk', help='Pre-generate many deposit addresses'))
+    CmdDepositWatchd.setup(subparsers.add_parser('deposit-watchd', help='Submit many BTC deposits as they confirm'))
 
     args:Cmd = parser.parse_args(argv[1:])  # type: ignore
     if ('func' not in args) or (args.func is None):
@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from typing import Any, Optional, Iterable, cast
+
+from ..bitcoin import hex2revbytes, bytes2revhex
+from ..constants import DEFAULT_ASYNC_CONCURRENCY
+from .httppool import URL_T
+from .jsonrpc import JSONRPC_CALL_T
+from .asyncjsonrpc import AsyncJsonRpc
+from .bitcoinrpc import (
+    JSON_ENCODABLE,
+    BitcoinJsonRpc_getblock_t,
+    BitcoinJsonRpc_getchaintips_t,
+    parse_getblockheader_t,
+    parse_getblock_t
+)
+
+
+class AsyncBitcoinJsonRpc:
+    """
+    asyncio equivalent of `BitcoinJsonRpc`, results are parsed identically
+    """
+    endpoint_url: URL_T
+    rpc: AsyncJsonRpc
+
+    def __init__(self, endpoint_url:URL_T, concurrency:int=DEFAULT_ASYNC_CONCURRENCY):
+        self.endpoint_url = endpoint_url
+        self.rpc = AsyncJsonRpc(endpoint_url, concurrency)
+
+    async def __aenter__(self) -> 'AsyncBitcoinJsonRpc':
+        return self
+
+    async def __aexit__(self, *args:Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.rpc.close()
+
+    async def _request(self, method:str, params:Optional[list[JSON_ENCODABLE]]=None) -> Any:
+        return await self.rpc.request(method, params)
+
+    async def batch(self, calls:list[JSONRPC_CALL_T], return_errors:bool=False) -> list[Any]:
+        return await self.rpc.batch(calls, return_errors=return_errors)
+
+    async def getchaintips(self) -> list[BitcoinJsonRpc_getchaintips_t]:
+        tips:list[BitcoinJsonRpc_getchaintips_t] = await self._request('getchaintips')
+        for row in tips:
+            row['hash'] = hex2revbytes(row['hash'])
+        return tips
+
+    async def getblockcount(self) -> int:
+        return cast(int, await self._request('getblockcount'))
+
+    async def gettxout(self, txid:str|bytes, out_idx:int):
+        if isinstance(txid, bytes):
+            txid = bytes2revhex(txid)
+        return await self._request('gettxout', [txid, out_idx])
+
+    async def gettxoutproof(self, txids:list[str|bytes]):
+        hexids = [bytes2revhex(_) for _ in txids]
+        return await self._request('gettxoutproof', [cast(JSON_ENCODABLE, hexids)])
+
+    async def getblockhash(self, height:int) -> bytes:
+        return hex2revbytes(await self._request('getblockhash', [height]))
+
+    async def getblockhashes(self, heights:Iterable[int]) -> list[bytes]:
+        results = await self.batch([('getblockhash', [_]) for _ in heights])
+        return [hex2revbytes(_) for _ in results]
+
+    async def getblockheader(self, blockhash:str|bytes) -> BitcoinJsonRpc_getblock_t:
+        if isinstance(blockhash, bytes):
+            blockhash = bytes2revhex(blockhash)
+        verbosity = True
+        result = await self._request('getblockheader', [blockhash, verbosity])
+        parse_getblockheader_t(result)
+        return cast(BitcoinJsonRpc_getblock_t, result)
+
+    async def getblockheaders(self, blockhashes:Iterable[str|bytes]) -> list[BitcoinJsonRpc_getblock_t]:
+        verbosity = True
+        results = await self.batch([('getblockheader', [bytes2revhex(_), verbosity]) for _ in blockhashes])
+        for result in results:
+            parse_getblockheader_t(result)
+        return cast(list[BitcoinJsonRpc_getblock_t], results)
+
+    async def getblockheadersraw(self, blockhashes:Iterable[str|bytes]) -> bytes:
+        verbosity = False
+        results = await self.batch([('getblockheader', [bytes2revhex(_), verbosity]) for _ in blockhashes])
+        return bytes.fromhex(''.join(results))
+
+    async def getheadersraw(self, height:int, count:int) -> bytes:
+        """Serialized headers for `count` heights from `height`, JSON-RPC only"""
+        return await self.getblockheadersraw(await self.getblockhashes(range(height, height + count)))
+
+    async def getblock(self, blockhash:str|bytes, verbose=False) -> BitcoinJsonRpc_getblock_t:
+        if isinstance(blockhash, bytes):
+            blockhash = bytes2revhex(blockhash)
+        verbosity = 1  # includes tx hashes
+        if verbose:
+            verbosity = 2
+        result = await self._request('getblock', [blockhash, verbosity])
+        parse_getblock_t(result)
+        return cast(BitcoinJsonRpc_getblock_t, result)
@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import asyncio
+from typing import Optional, Any
+
+import aiohttp
+
+from ..constants import (
+    LOGGER,
+    DEFAULT_JSONRPC_BATCH_SIZE,
+    DEFAULT_ASYNC_CONCURRENCY,
+    DEFAULT_HTTP_IDLE_TIMEOUT,
+    DEFAULT_HTTP_TIMEOUT
+)
+from .httppool import URL_T, split_url
+from .ratelimit import REPLY_T, AsyncCoalescer, rate_limiter, send_throttled_async
+from .jsonrpc import (
+    COALESCED_METHODS,
+    JSONRPC_CALL_T,
+    jsonrpc_Request,
+    jsonrpc_request,
+    jsonrpc_http_error,
+    jsonrpc_result,
+    jsonrpc_batch_results,
+    jsonrpc_method_label
+)
+from ..metrics import RPC_SECONDS, RPC_ERRORS, endpoint_label
+
+
+class AsyncJsonRpc:
+    """
+    asyncio JSON-RPC client for a single endpoint. Keep-alive connections are
+    shared between all calls, and at most `concurrency` requests are in-flight
+    at once, within the endpoint's rate limit. Identical read-only requests
+    in-flight are only sent once. The aiohttp session is created lazily
+    inside the running loop.
+    """
+    endpoint_url: URL_T
+    concurrency: int
+    idle_timeout: float
+    _session: Optional[aiohttp.ClientSession]
+
+    def __init__(self, endpoint_url:URL_T, concurrency:int=DEFAULT_ASYNC_CONCURRENCY,
+                 idle_timeout:float=DEFAULT_HTTP_IDLE_TIMEOUT):
+        self.endpoint_url = endpoint_url
+        self.concurrency = concurrency
+        self.idle_timeout = idle_timeout
+        self._url, self._headers = split_url(endpoint_url)
+        self._headers['Content-Type'] = 'application/json'
+        self._session = None
+        self._coalescer = AsyncCoalescer('jsonrpc')
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                             keepalive_timeout=self.idle_timeout)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=DEFAULT_HTTP_TIMEOUT))
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _post(self, payload:jsonrpc_Request|list[jsonrpc_Request]) -> Any:
+        session = self._get_session()
+        labels = {'api': 'jsonrpc', 'endpoint': endpoint_label(self._url), 'method': jsonrpc_method_label(payload)}
+        data = json.dumps(payload).encode()
+
+        async def send() -> REPLY_T:
+            with RPC_SECONDS.time(**labels):
+                async with session.post(self._url, data=data, headers=self._headers) as response:
+                    return response.status, response.headers, await response.read()
+
+        try:
+            status, _, body = await send_throttled_async(rate_limiter(self._url), send)
+        except Exception:
+            RPC_ERRORS.inc(**labels)
+            raise
+        if status != 200:
+            RPC_ERRORS.inc(**labels)
+            raise jsonrpc_http_error(status, body)
+        return json.loads(body)
+
+    async def request(self, method:str, params:Optional[list[Any]]=None) -> Any:
+        request = jsonrpc_request(method, params)
+        LOGGER.debug(f"JSON-RPC {self._url} id={request['id']} {method} params:{params}")
+
+        async def send() -> Any:
+            return jsonrpc_result(await self._post(request))
+        if method not in COALESCED_METHODS:
+            return await send()
+        return await self._coalescer.run((method, json.dumps(request['params'])), send)
+
+    async def batch(self, calls:list[JSONRPC_CALL_T],
+                    batch_size:int=DEFAULT_JSONRPC_BATCH_SIZE,
+                    return_errors:bool=False) -> list[Any]:
+        """
+        Like `jsonrpc_batch`, but every chunk of `batch_size` calls is sent
+        concurrently rather than one after another.
+        """
+        async def send(offset:int) -> list[Any]:
+            requests = [jsonrpc_request(method, params)
+                        for method, params in calls[offset:offset+batch_size]]
+            LOGGER.debug(f"JSON-RPC {self._url} batch of {len(requests)} ids={requests[0]['id']}..{requests[-1]['id']}")
+            output = await self._post(requests)
+            return jsonrpc_batch_results(requests, output, return_errors)
+
+        chunks = await asyncio.gather(*[send(_) for _ in range(0, len(calls), batch_size)])
+        return [result for chunk in chunks for result in chunk]
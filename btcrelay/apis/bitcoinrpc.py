@@ -1,11 +1,16 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import struct
-from typing import Any, TypedDict, Optional, Literal, cast
+from typing import Any, TypedDict, Optional, Literal, Iterable, cast
 
-from .jsonrpc import jsonrpc
+from urllib.parse import urlsplit
+
+from .jsonrpc import jsonrpc, jsonrpc_batch, JSONRPC_CALL_T
+from .httppool import URL_T, HTTPConnectionPool, connection_pool, split_url
+from .ratelimit import REPLY_T, rate_limiter, send_throttled
 from ..bitcoin import double_sha256, merkle_build, hex2revbytes, bytes2revhex
-from ..constants import DEFAULT_BTC_RPC_URLS
+from ..metrics import RPC_SECONDS, RPC_ERRORS, endpoint_label
+from ..constants import LOGGER, DEFAULT_BTC_RPC_URLS, DEFAULT_REST_HEADERS_COUNT
 
 def regtest(method, *args):
     return jsonrpc(DEFAULT_BTC_RPC_URLS['btc-regtest'], method, args)
@@ -14,7 +19,7 @@ JSON_ENCODABLE_PRIMITIVE = str | int | bytes | None
 JSON_ENCODABLE = JSON_ENCODABLE_PRIMITIVE | dict[str|int,JSON_ENCODABLE_PRIMITIVE] | list[JSON_ENCODABLE_PRIMITIVE]
 
 class BitcoinJsonRpc_getblockheader_t(TypedDict):
-    bits: str
+    bits: int
     chainwork: int
     confirmations: str
     difficulty: float
@@ -58,7 +63,7 @@ def parse_getblockheader_t(result:dict[str,Any]) -> None:
     result['previousblockhash'] = hex2revbytes(result['previousblockhash'])
     result['merkleroot'] = hex2revbytes(result['merkleroot'])
     result['bits'] = int(result['bits'],16)
-    result['chainwork'] = int.from_bytes(hex2revbytes(result['chainwork']))
+    result['chainwork'] = int(result['chainwork'], 16)
     if result.get('nextblockhash',None) is not None:
         # XXX: not included when retrieved from getblock RPC?
         result['nextblockhash'] = hex2revbytes(result['nextblockhash'])
@@ -84,12 +89,38 @@ class BitcoinJsonRpc_getchaintips_t(TypedDict):
                     'conflicting']
 
 
+class BitcoinJsonRpc_waitfornewblock_t(TypedDict):
+    hash: bytes
+    height: int
+
+
+class BitcoinRestError(RuntimeError):
+    pass
+
+
+# `/rest/headers` URL forms, bitcoind 24+ then the older (deprecated) one
+REST_HEADERS_PATHS = ('/rest/headers/{hash}.bin?count={count}',
+                      '/rest/headers/{count}/{hash}.bin')
+
+
 class BitcoinJsonRpc:
-    def __init__(self, endpoint_url:str):
+    endpoint_url: URL_T
+    pool: HTTPConnectionPool
+    rest_path: Optional[str]
+
+    def __init__(self, endpoint_url:URL_T, pool_size:Optional[int]=None,
+                 idle_timeout:Optional[float]=None):
         self.endpoint_url = endpoint_url
+        self.pool = connection_pool(split_url(endpoint_url)[0], pool_size, idle_timeout)
+        # REST is only served from the root of a bitcoind (-rest), not by hosted RPC providers.
+        # None when unavailable, empty until the first request finds which URL form works
+        self.rest_path = None if urlsplit(split_url(endpoint_url)[0]).path.strip('/') else ''
 
     def _request(self, method:str, params:Optional[list[JSON_ENCODABLE]]=None) -> Any:
-        return jsonrpc(self.endpoint_url, method, params)
+        return jsonrpc(self.endpoint_url, method, params, self.pool)
+
+    def batch(self, calls:list[JSONRPC_CALL_T], return_errors:bool=False) -> list[Any]:
+        return jsonrpc_batch(self.endpoint_url, calls, self.pool, return_errors=return_errors)
 
     def getchaintips(self) -> list[BitcoinJsonRpc_getchaintips_t]:
         tips:list[BitcoinJsonRpc_getchaintips_t] = self._request('getchaintips')
@@ -103,11 +134,21 @@ class BitcoinJsonRpc:
     def getblockcount(self) -> int:
         return cast(int, self._request('getblockcount'))
 
+    def waitfornewblock(self, timeout_ms:int=0) -> BitcoinJsonRpc_waitfornewblock_t:
+        """Long-poll until the tip changes, or timeout_ms, returns the tip"""
+        result = self._request('waitfornewblock', [timeout_ms])
+        result['hash'] = hex2revbytes(result['hash'])
+        return cast(BitcoinJsonRpc_waitfornewblock_t, result)
+
     def gettxout(self, txid:str|bytes, out_idx:int):
         if isinstance(txid, bytes):
             txid = bytes2revhex(txid)
         return self._request('gettxout', [txid, out_idx])
 
+    def gettxouts(self, outpoints:Iterable[tuple[str|bytes,int]]) -> list[Optional[dict[str,Any]]]:
+        """`gettxout` for many (txid, vout) in a batch, None where unspent outputs aren't found"""
+        return self.batch([('gettxout', [bytes2revhex(txid), vout]) for txid, vout in outpoints])
+
     def gettxoutproof(self, txids:list[str|bytes]):
         txids = [bytes2revhex(_) for _ in txids]
         return self._request('gettxoutproof', [txids])
@@ -115,6 +156,10 @@ class BitcoinJsonRpc:
     def getblockhash(self, height:int) -> bytes:
         return hex2revbytes(self._request('getblockhash', [height]))
 
+    def getblockhashes(self, heights:Iterable[int]) -> list[bytes]:
+        results = self.batch([('getblockhash', [_]) for _ in heights])
+        return [hex2revbytes(_) for _ in results]
+
     def getrawtransaction(self, txid:str, blockhash:Optional[str]=None) -> bytes:
         return bytes.fromhex(self._request('getrawtransaction', [txid, False, blockhash]))
 
@@ -126,6 +171,78 @@ class BitcoinJsonRpc:
         parse_getblockheader_t(result)
         return cast(BitcoinJsonRpc_getblock_t, result)
 
+    def getblockheaders(self, blockhashes:Iterable[str|bytes]) -> list[BitcoinJsonRpc_getblock_t]:
+        verbosity = True
+        results = self.batch([('getblockheader', [bytes2revhex(_), verbosity]) for _ in blockhashes])
+        for result in results:
+            parse_getblockheader_t(result)
+        return cast(list[BitcoinJsonRpc_getblock_t], results)
+
+    def getblockheaderraw(self, blockhash:str|bytes) -> bytes:
+        """80 byte serialized header"""
+        verbosity = False
+        return bytes.fromhex(self._request('getblockheader', [bytes2revhex(blockhash), verbosity]))
+
+    def getblockheadersraw(self, blockhashes:Iterable[str|bytes]) -> bytes:
+        """Serialized headers, concatenated in the order of `blockhashes`"""
+        verbosity = False
+        results = self.batch([('getblockheader', [bytes2revhex(_), verbosity]) for _ in blockhashes])
+        return bytes.fromhex(''.join(results))
+
+    def rest_headers(self, blockhash:bytes, count:int=DEFAULT_REST_HEADERS_COUNT) -> bytes:
+        """
+        Up to `count` consecutive serialized headers starting at `blockhash`,
+        from bitcoind's REST interface in a single request. Fewer are returned
+        if the chain is shorter. Raises `BitcoinRestError` if REST is disabled.
+        """
+        url, headers = split_url(self.endpoint_url)
+        labels = {'api': 'rest', 'endpoint': endpoint_label(url), 'method': 'headers'}
+        paths = [self.rest_path] if self.rest_path else list(REST_HEADERS_PATHS)
+        for path in paths:
+            def send() -> REPLY_T:
+                with RPC_SECONDS.time(**labels):
+                    response = self.pool.request('GET', path.format(hash=bytes2revhex(blockhash), count=count),
+                                                 headers=headers)
+                return response.status, response.headers, response.body
+            try:
+                status, _, body = send_throttled(rate_limiter(url), send)
+            except Exception:
+                RPC_ERRORS.inc(**labels)
+                raise
+            if status == 200:
+                self.rest_path = path
+                return body
+            # 404 without -rest, older nodes reject the newer form with 400
+            if status not in (400, 404):
+                RPC_ERRORS.inc(**labels)
+                raise BitcoinRestError(status, body[:200])
+        RPC_ERRORS.inc(**labels)
+        raise BitcoinRestError(f'REST unavailable on {labels["endpoint"]}')
+
+    def getheadersraw(self, height:int, count:int) -> bytes:
+        """
+        Serialized headers for `count` heights from `height`, via REST where
+        the node allows it, otherwise a `getblockheader` verbose=false batch.
+        """
+        if self.rest_path is not None:
+            probing = not self.rest_path
+            try:
+                chunks = []
+                fetched = 0
+                while fetched < count:
+                    wanted = min(count - fetched, DEFAULT_REST_HEADERS_COUNT)
+                    data = self.rest_headers(self.getblockhash(height + fetched), wanted)
+                    chunks.append(data)
+                    fetched += len(data) // 80
+                    if len(data) < (wanted * 80):
+                        break
+                return b''.join(chunks)
+            except BitcoinRestError as ex:
+                if probing:
+                    LOGGER.info('Bitcoin REST interface not usable, using JSON-RPC for headers: %s', ex)
+                    self.rest_path = None
+        return self.getblockheadersraw(self.getblockhashes(range(height, height + count)))
+
     def getblock(self, blockhash:str|bytes, verbose=False) -> BitcoinJsonRpc_getblock_t:
         if isinstance(blockhash, bytes):
             blockhash = bytes2revhex(blockhash)
@@ -136,6 +253,12 @@ class BitcoinJsonRpc:
         parse_getblock_t(result)
         return cast(BitcoinJsonRpc_getblock_t, result)
 
-    def getblockraw(self, blockhash:str) -> str:
+    def getblockraw(self, blockhash:str|bytes) -> str:
+        if isinstance(blockhash, bytes):
+            blockhash = bytes2revhex(blockhash)
         verbosity = 0  # returns raw hex encoded block
         return cast(str, self._request('getblock', [blockhash, verbosity]))
+
+    def scantxoutset(self, scripts:Iterable[bytes]) -> dict[str,Any]:
+        """Unspent outputs paying any of the scripts, scans the whole UTXO set at once"""
+        return cast(dict[str,Any], self._request('scantxoutset', ['start', [f'raw({_.hex()})' for _ in scripts]]))
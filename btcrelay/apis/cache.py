@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import shelve
+from time import monotonic
+from threading import Lock
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from ..constants import (
+    LOGGER,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CACHE_CONFIRMATIONS,
+    DEFAULT_CACHE_TTL
+)
+from ..metrics import CACHE_HITS, CACHE_MISSES
+
+# Returned by `ResultCache.get` when there's no usable entry, results may be None
+MISSING = object()
+
+
+class CacheEntry:
+    __slots__ = ('value', 'height', 'expires')
+
+    def __init__(self, value:Any, height:Optional[int], expires:Optional[float]):
+        self.value = value
+        self.height = height
+        self.expires = expires
+
+
+class ResultCache:
+    """
+    Bounded LRU of Bitcoin RPC results, which understands confirmation depth.
+
+    Results for blocks with at least `confirmations` are immutable, so are
+    cached until evicted (and written to the optional on-disk shelf). Anything
+    nearer the tip, or whose height isn't known, expires after `ttl` seconds
+    and is dropped when the tip changes or a different hash is seen for a
+    height which was cached, either may be a reorg.
+    """
+    size: int
+    confirmations: int
+    ttl: float
+    tip_height: Optional[int]
+    hits: int
+    misses: int
+    _entries: OrderedDict[Hashable,CacheEntry]
+    _heights: dict[bytes,int]
+
+    def __init__(self, size:int=DEFAULT_CACHE_SIZE, confirmations:int=DEFAULT_CACHE_CONFIRMATIONS,
+                 ttl:float=DEFAULT_CACHE_TTL, path:Optional[str]=None):
+        self.size = size
+        self.confirmations = confirmations
+        self.ttl = ttl
+        self.tip_height = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._heights = {}
+        self._lock = Lock()
+        self._shelf: Optional[shelve.Shelf[Any]] = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._shelf = shelve.open(path)
+            LOGGER.debug('RPC cache %s has %d entries', path, len(self._shelf))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._shelf is not None:
+                self._shelf.close()
+                self._shelf = None
+
+    def _immutable(self, height:Optional[int]) -> bool:
+        if height is None or self.tip_height is None:
+            return False
+        return (self.tip_height - height + 1) >= self.confirmations
+
+    def get(self, method:str, key:Hashable) -> Any:
+        """Cached result, or `MISSING`"""
+        with self._lock:
+            entry = self._entries.get((method, key))
+            if entry is not None and entry.expires is not None and entry.expires < monotonic():
+                del self._entries[(method, key)]
+                entry = None
+            if entry is None and self._shelf is not None:
+                value = self._shelf.get(repr((method, key)), MISSING)
+                if value is not MISSING:
+                    entry = self._insert((method, key), CacheEntry(value, None, None))
+            if entry is None:
+                self.misses += 1
+                CACHE_MISSES.inc(method=method)
+                return MISSING
+            self._entries.move_to_end((method, key))
+            self.hits += 1
+        CACHE_HITS.inc(method=method)
+        return entry.value
+
+    def _insert(self, key:Hashable, entry:CacheEntry) -> CacheEntry:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def put(self, method:str, key:Hashable, value:Any, height:Optional[int]=None) -> None:
+        """Cache a result for data at `height`, if known"""
+        if self.size <= 0:
+            return
+        with self._lock:
+            if self._immutable(height):
+                self._insert((method, key), CacheEntry(value, height, None))
+                if self._shelf is not None:
+                    self._shelf[repr((method, key))] = value
+            else:
+                self._insert((method, key), CacheEntry(value, height, monotonic() + self.ttl))
+
+    def block(self, height:int, blockhash:bytes) -> None:
+        """Learn the hash at a height, a different hash than cached is a reorg"""
+        with self._lock:
+            cached = self._entries.get(('height2hash', height))
+            if cached is not None and cached.value != blockhash:
+                self._invalidate(height, True)
+            if len(self._heights) >= self.size:
+                self._heights.clear()
+            self._heights[blockhash] = height
+
+    def height_of(self, blockhash:bytes) -> Optional[int]:
+        return self._heights.get(blockhash)
+
+    def tip(self, height:int) -> None:
+        """
+        Track the tip, confirmation depth is relative to it. A new tip may
+        have replaced recent blocks, so tip-adjacent entries are dropped.
+        """
+        with self._lock:
+            if self.tip_height is not None and height != self.tip_height:
+                self._invalidate(min(height, self.tip_height) - self.confirmations, False)
+            self.tip_height = height
+
+    def invalidate(self, height:int) -> None:
+        """Reorg at `height`, drop everything cached for blocks at or above it"""
+        with self._lock:
+            self._invalidate(height, True)
+
+    def _invalidate(self, height:int, confirmed:bool) -> None:
+        """
+        Drop tip-adjacent entries at or above `height`, or of unknown height,
+        and if `confirmed` also those deeper entries which were at or above it
+        """
+        stale = [k for k, v in self._entries.items()
+                 if (v.expires is not None and (v.height is None or v.height >= height))
+                 or (confirmed and v.height is not None and v.height >= height)]
+        for key in stale:
+            entry = self._entries.pop(key)
+            if entry.expires is None and self._shelf is not None:
+                self._shelf.pop(repr(key), None)
+        if stale:
+            LOGGER.debug('RPC cache dropped %d entries from height %d', len(stale), height)
@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import math
+from time import monotonic
+from threading import Lock
+from collections import deque
+from typing import Optional
+
+from ..constants import (
+    LOGGER,
+    DEFAULT_HEALTH_EWMA,
+    DEFAULT_HEALTH_WINDOW,
+    DEFAULT_CIRCUIT_FAILURES,
+    DEFAULT_CIRCUIT_COOLDOWN,
+    DEFAULT_HEDGE_DELAY,
+    DEFAULT_HEDGE_MIN_DELAY
+)
+
+# Latency samples needed before the p95 is trusted over the default hedge delay
+HEALTH_MIN_SAMPLES = 20
+
+
+class EndpointHealth:
+    """
+    Health of a single endpoint: EWMA latency and error rate, recent latency
+    samples per method for the p95 hedging budget, and a circuit breaker.
+
+    After `failures` consecutive errors the circuit opens and the endpoint
+    is avoided for `cooldown` seconds, then one request is let through
+    (half-open); success closes the circuit, failure re-opens it.
+    """
+    name: str
+    latency: Optional[float]
+    error_rate: float
+    consecutive_failures: int
+    open_until: float
+    _samples: dict[str,deque[float]]
+
+    def __init__(self, name:str, failures:int=DEFAULT_CIRCUIT_FAILURES,
+                 cooldown:float=DEFAULT_CIRCUIT_COOLDOWN):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._samples = {}
+        self._lock = Lock()
+
+    def record(self, method:str, latency:float, ok:bool) -> None:
+        alpha = DEFAULT_HEALTH_EWMA
+        with self._lock:
+            self.error_rate = ((1 - alpha) * self.error_rate) + (alpha * (0 if ok else 1))
+            if not ok:
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.failures:
+                    if not self.is_open():
+                        LOGGER.warning('%s circuit open for %ds after %d failures',
+                                       self.name, self.cooldown, self.consecutive_failures)
+                    self.open_until = monotonic() + self.cooldown
+                return
+            if self.consecutive_failures >= self.failures:
+                LOGGER.info('%s circuit closed', self.name)
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+            self.latency = latency if self.latency is None else ((1 - alpha) * self.latency) + (alpha * latency)
+            samples = self._samples.get(method)
+            if samples is None:
+                samples = self._samples[method] = deque(maxlen=DEFAULT_HEALTH_WINDOW)
+            samples.append(latency)
+
+    def is_open(self) -> bool:
+        """Circuit is open, requests shouldn't be sent unless there's no alternative"""
+        return monotonic() < self.open_until
+
+    def p95(self, method:str) -> float:
+        """Time after which a hedged request is sent, from recent latencies of `method`"""
+        with self._lock:
+            samples = sorted(self._samples.get(method, ()))
+        if len(samples) < HEALTH_MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return max(DEFAULT_HEDGE_MIN_DELAY, samples[math.ceil(0.95 * len(samples)) - 1])
+
+    def score(self, weight:float) -> float:
+        """Higher is better: weight, discounted by latency and errors"""
+        latency = self.latency if self.latency is not None else DEFAULT_HEDGE_DELAY
+        return weight * (1 - self.error_rate) / max(latency, DEFAULT_HEDGE_MIN_DELAY / 10)
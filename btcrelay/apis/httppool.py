@@ -0,0 +1,182 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import http.client
+from time import monotonic
+from base64 import b64encode
+from urllib.parse import urlsplit
+from threading import Lock, BoundedSemaphore
+from typing import Optional
+
+from ..constants import (
+    LOGGER,
+    DEFAULT_HTTP_POOL_SIZE,
+    DEFAULT_HTTP_IDLE_TIMEOUT,
+    DEFAULT_HTTP_TIMEOUT
+)
+from ..metrics import RETRIES
+
+URLOPEN_DEBUGLEVEL=1
+
+URL_AUTH_T = tuple[str,str]
+URL_T = str | tuple[str,URL_AUTH_T]
+
+# Exceptions which indicate a kept-alive connection was closed by the server
+# while idle, the request is safe to retry once on a fresh connection.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class HTTPResponse:
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status:int, headers:http.client.HTTPMessage, body:bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class HTTPConnectionPool:
+    """
+    Pool of long-lived HTTP/1.1 keep-alive connections to a single endpoint
+
+    At most `maxsize` connections are checked out at any one time, callers
+    block until one is returned. Idle connections older than `idle_timeout`
+    seconds are discarded rather than reused.
+    """
+    scheme: str
+    host: str
+    port: Optional[int]
+    maxsize: int
+    idle_timeout: float
+    timeout: float
+    _idle: list[tuple[float,http.client.HTTPConnection]]
+
+    def __init__(self, scheme:str, host:str, port:Optional[int]=None,
+                 maxsize:int=DEFAULT_HTTP_POOL_SIZE,
+                 idle_timeout:float=DEFAULT_HTTP_IDLE_TIMEOUT,
+                 timeout:float=DEFAULT_HTTP_TIMEOUT):
+        if scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL scheme: {scheme}')
+        if maxsize < 1:
+            raise ValueError('Pool size must be positive')
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(maxsize)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        conn: http.client.HTTPConnection
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+            conn.set_debuglevel(URLOPEN_DEBUGLEVEL)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        LOGGER.debug('HTTP pool %s://%s new connection', self.scheme, self.host)
+        return conn
+
+    def _checkout(self) -> tuple[bool,http.client.HTTPConnection]:
+        """Returns (reused, connection), caller must hold a slot"""
+        now = monotonic()
+        with self._lock:
+            while self._idle:
+                last_used, conn = self._idle.pop()
+                if (now - last_used) < self.idle_timeout:
+                    return True, conn
+                conn.close()
+        return False, self._connect()
+
+    def _checkin(self, conn:http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.append((monotonic(), conn))
+
+    def close(self) -> None:
+        with self._lock:
+            for _, conn in self._idle:
+                conn.close()
+            self._idle.clear()
+
+    def request(self, method:str, path:str, body:Optional[bytes]=None,
+                headers:Optional[dict[str,str]]=None) -> HTTPResponse:
+        with self._slots:
+            reused, conn = self._checkout()
+            while True:
+                try:
+                    conn.request(method, path, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                    data = response.read()
+                except STALE_CONNECTION_ERRORS:
+                    conn.close()
+                    if not reused:
+                        raise
+                    # Server dropped an idle connection, retry once on a new one
+                    RETRIES.inc(kind='http_stale')
+                    reused, conn = False, self._connect()
+                    continue
+                except BaseException:
+                    conn.close()
+                    raise
+                break
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(conn)
+            return HTTPResponse(response.status, response.headers, data)
+
+
+POOLS: dict[tuple[str,str],HTTPConnectionPool] = {}
+POOLS_LOCK = Lock()
+
+
+def connection_pool(url:str, maxsize:Optional[int]=None,
+                    idle_timeout:Optional[float]=None) -> HTTPConnectionPool:
+    """
+    Retrieve the shared connection pool for the endpoint of a URL, one pool
+    is kept per scheme & host:port and created on first use.
+    """
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    with POOLS_LOCK:
+        pool = POOLS.get(key)
+        if pool is None:
+            pool = POOLS[key] = HTTPConnectionPool(
+                parts.scheme, parts.hostname or '', parts.port,
+                maxsize=maxsize or DEFAULT_HTTP_POOL_SIZE,
+                idle_timeout=idle_timeout or DEFAULT_HTTP_IDLE_TIMEOUT)
+        else:
+            if maxsize is not None and maxsize != pool.maxsize:
+                LOGGER.warning('HTTP pool %s already exists with size %d',
+                               parts.netloc, pool.maxsize)
+            if idle_timeout is not None:
+                pool.idle_timeout = idle_timeout
+    return pool
+
+
+def split_url(url:URL_T) -> tuple[str,dict[str,str]]:
+    """
+    Split a URL with optional (user,passwd) auth into the URL and the
+    headers needed to authenticate the request
+    """
+    headers: dict[str,str] = {}
+    if isinstance(url, (list,tuple)):
+        url, (auth_user, auth_passwd) = url
+        token = b64encode(f'{auth_user}:{auth_passwd}'.encode()).decode()
+        headers['Authorization'] = f'Basic {token}'
+    return url, headers
+
+
+def url_path(url:str) -> str:
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return path
@@ -1,19 +1,24 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import json
-import urllib.request
 from threading import Lock
 from typing import TypedDict, Optional, Any
 
-from ..constants import LOGGER
-
-URLOPEN_DEBUGLEVEL=1
+from ..constants import LOGGER, DEFAULT_JSONRPC_BATCH_SIZE
+from .httppool import URL_T, HTTPConnectionPool, connection_pool, split_url, url_path
+from .ratelimit import REPLY_T, Coalescer, rate_limiter, send_throttled
+from ..metrics import RPC_SECONDS, RPC_ERRORS, endpoint_label
 
 JSONRPC_REQUEST_ID: int = 1
 JSONRPC_REQUEST_LOCK = Lock()
 
-URL_AUTH_T = tuple[str,str]
-URL_T = str | tuple[str,URL_AUTH_T]
+# Identical calls in-flight from any thread are only sent once
+COALESCER = Coalescer('jsonrpc')
+
+# Only read-only methods are coalesced, two identical `generatetoaddress` must both run
+COALESCED_METHODS = frozenset(['getbestblockhash', 'getblock', 'getblockchaininfo', 'getblockcount',
+                               'getblockhash', 'getblockheader', 'getchaintips', 'getrawtransaction',
+                               'gettxout', 'gettxoutproof'])
 
 
 def _next_request_id() -> int:
@@ -28,50 +33,147 @@ class jsonrpc_Error(RuntimeError):
     pass
 
 
+class jsonrpc_Request(TypedDict):
+    jsonrpc: str
+    method: str
+    params: list[Any]
+    id: int
+
+
 class jsonrpc_Response(TypedDict):
     result: Optional[Any]
     error: Optional[Any]
     id: int
 
 
-def jsonrpc(url:URL_T, method:str, params:Optional[list[Any]]=None) -> Any:
-    request = {
+JSONRPC_CALL_T = tuple[str,Optional[list[Any]]]
+
+
+def jsonrpc_request(method:str, params:Optional[list[Any]]=None) -> jsonrpc_Request:
+    return {
         "jsonrpc": "2.0",
         "method": method,
-        "params": params or [],
+        "params": list(params or []),
         "id": _next_request_id()
     }
-    input = json.dumps(request).encode()
-
-    # Don't reveal JSON-RPC auth in debug messages
-    friendly_url = url[0] if isinstance(url, (list,tuple)) else url
-
-    LOGGER.debug(f"JSON-RPC {friendly_url} id={request['id']} {method} params:{params}")
 
-    handlers = []
-    if isinstance(url, (list,tuple)):
-        url, (auth_user, auth_passwd) = url
-        passman = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-        passman.add_password(None, url, auth_user, auth_passwd)
-        handlers.append(urllib.request.HTTPBasicAuthHandler(passman))
-
-    handlers.append(urllib.request.HTTPSHandler(debuglevel=URLOPEN_DEBUGLEVEL))
-    opener = urllib.request.build_opener(*handlers)
-    opener.addheaders = [('Content-Type', 'application/json')]
 
+def jsonrpc_http_error(status:int, body:bytes) -> jsonrpc_Error:
     # Return BTC RPC errors verbatim
-    error = None
     try:
-        with opener.open(url, data=input) as handle:
-            output: jsonrpc_Response = json.load(handle)
-    except urllib.error.HTTPError as ex:
-        error = json.loads(ex.read())
+        error = json.loads(body)
+    except ValueError:
+        error = {'status': status, 'body': body.decode('utf-8', 'replace')}
+    return jsonrpc_Error(error)
 
-    if error is not None:
-        raise jsonrpc_Error(error)
 
+def jsonrpc_result(output:jsonrpc_Response) -> Any:
     if output.get('error', None) is not None:
         raise jsonrpc_Error(output)
 
     assert 'result' in output
     return output['result']
+
+
+def jsonrpc_batch_results(requests:list[jsonrpc_Request], output:Any,
+                          return_errors:bool=False) -> list[Any]:
+    """
+    Match a batch reply to its requests by id, in the order of `requests`.
+    A failed item raises `jsonrpc_Error`, or when `return_errors` is set the
+    error is returned in place of that item's result.
+    """
+    if not isinstance(output, list):
+        # Servers reply with a single error object when the batch itself is rejected
+        raise jsonrpc_Error(output)
+
+    by_id: dict[int,jsonrpc_Response] = {_['id']: _ for _ in output}
+    results: list[Any] = []
+    for request in requests:
+        reply = by_id.get(request['id'])
+        if reply is None:
+            error = jsonrpc_Error({'id': request['id'], 'error': 'missing from batch response'})
+        elif reply.get('error', None) is not None:
+            error = jsonrpc_Error(reply)
+        else:
+            results.append(reply.get('result'))
+            continue
+        if not return_errors:
+            raise error
+        results.append(error)
+    return results
+
+
+def jsonrpc_method_label(payload:jsonrpc_Request|list[jsonrpc_Request]) -> str:
+    """Method name for metrics, batches of a single method are labelled as such"""
+    if isinstance(payload, list):
+        methods = {_['method'] for _ in payload}
+        return f'batch:{methods.pop()}' if len(methods) == 1 else 'batch'
+    return payload['method']
+
+
+def _post(url:URL_T, payload:jsonrpc_Request|list[jsonrpc_Request],
+          pool:Optional[HTTPConnectionPool]=None) -> Any:
+    url, headers = split_url(url)
+    headers['Content-Type'] = 'application/json'
+    labels = {'api': 'jsonrpc', 'endpoint': endpoint_label(url), 'method': jsonrpc_method_label(payload)}
+
+    # Connections are kept alive and shared between calls to the same endpoint
+    if pool is None:
+        pool = connection_pool(url)
+    body = json.dumps(payload).encode()
+
+    def send() -> REPLY_T:
+        with RPC_SECONDS.time(**labels):
+            response = pool.request('POST', url_path(url), body=body, headers=headers)
+        return response.status, response.headers, response.body
+
+    try:
+        status, _, data = send_throttled(rate_limiter(url), send)
+    except Exception:
+        RPC_ERRORS.inc(**labels)
+        raise
+
+    if status != 200:
+        RPC_ERRORS.inc(**labels)
+        raise jsonrpc_http_error(status, data)
+
+    return json.loads(data)
+
+
+def jsonrpc(url:URL_T, method:str, params:Optional[list[Any]]=None,
+            pool:Optional[HTTPConnectionPool]=None) -> Any:
+    request = jsonrpc_request(method, params)
+
+    # Don't reveal JSON-RPC auth in debug messages
+    friendly_url = url[0] if isinstance(url, (list,tuple)) else url
+
+    LOGGER.debug(f"JSON-RPC {friendly_url} id={request['id']} {method} params:{params}")
+
+    if method not in COALESCED_METHODS:
+        return jsonrpc_result(_post(url, request, pool))
+
+    # Keyed without the request id, which is unique to each call
+    key = (repr(url), method, json.dumps(request['params']))
+    return COALESCER.run(key, lambda: jsonrpc_result(_post(url, request, pool)))
+
+
+def jsonrpc_batch(url:URL_T, calls:list[JSONRPC_CALL_T],
+                  pool:Optional[HTTPConnectionPool]=None,
+                  batch_size:int=DEFAULT_JSONRPC_BATCH_SIZE,
+                  return_errors:bool=False) -> list[Any]:
+    """
+    Send many (method, params) calls as JSON-RPC 2.0 batches, at most
+    `batch_size` calls per HTTP request. Results are returned in the same
+    order as `calls`, see `jsonrpc_batch_results`.
+    """
+    friendly_url = url[0] if isinstance(url, (list,tuple)) else url
+    results: list[Any] = []
+    for offset in range(0, len(calls), batch_size):
+        requests = [jsonrpc_request(method, params)
+                    for method, params in calls[offset:offset+batch_size]]
+
+        LOGGER.debug(f"JSON-RPC {friendly_url} batch of {len(requests)} ids={requests[0]['id']}..{requests[-1]['id']}")
+
+        output = _post(url, requests, pool)
+        results += jsonrpc_batch_results(requests, output, return_errors)
+    return results
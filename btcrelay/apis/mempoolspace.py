@@ -1,10 +1,13 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import json
+from urllib.error import HTTPError
 from urllib.request import urlopen
 from typing import Any, TypedDict, Literal, Optional, cast
 
 from ..constants import BTC_CHAIN_T
+from ..metrics import RPC_SECONDS, RPC_ERRORS, endpoint_label
+from .ratelimit import REPLY_T, Coalescer, rate_limiter, send_throttled
 
 class MempoolSpace_UTXOStatus(TypedDict):
     confirmed: bool
@@ -54,10 +57,29 @@ class MempoolSpace_Transaction(TypedDict):
     status: MempoolSpace_UTXOStatus
 
 
+class MempoolSpace_Block(TypedDict):
+    id: str
+    height: int
+    version: int
+    timestamp: int
+    bits: int
+    nonce: int
+    difficulty: float
+    merkle_root: str
+    tx_count: int
+    size: int
+    weight: int
+    previousblockhash: str
+    mediantime: int
+
 class MempoolspaceError(RuntimeError):
     pass
 
 
+# Identical GETs in-flight from any thread are only sent once
+COALESCER = Coalescer('mempoolspace')
+
+
 class MempoolSpaceAPI:
     """
     See: https://mempool.space/docs/api/rest
@@ -77,6 +99,10 @@ class MempoolSpaceAPI:
         url += ['api']
         return '/'.join(url + [str(_) for _ in args])
 
+    def ws_url(self) -> str:
+        """Websocket endpoint, see: https://mempool.space/docs/api/websocket"""
+        return self._url('v1', 'ws').replace('https://', 'wss://', 1)
+
     def _request_json(self, *args:str|int) -> Any:
         return json.loads(self._request_bytes(*args))
 
@@ -85,10 +111,28 @@ class MempoolSpaceAPI:
 
     def _request_bytes(self, *args:str|int) -> bytes:
         url = self._url(*args)
-        with urlopen(url) as handle:
-            if handle.status != 200:
-                raise MempoolspaceError(url, handle.status)
-            return cast(bytes, handle.read())
+        return cast(bytes, COALESCER.run(url, lambda: self._get(url, str(args[0]))))
+
+    def _get(self, url:str, method:str) -> bytes:
+        labels = {'api': 'mempoolspace', 'endpoint': endpoint_label(url), 'method': method}
+
+        def send() -> REPLY_T:
+            with RPC_SECONDS.time(**labels):
+                try:
+                    with urlopen(url) as handle:
+                        return handle.status, handle.headers, handle.read()
+                except HTTPError as ex:
+                    # Throttled replies are retried, others raised below
+                    return ex.code, ex.headers, ex.read()
+
+        try:
+            status, headers, body = send_throttled(rate_limiter(url), send)
+            if status != 200:
+                raise HTTPError(url, status, body.decode('utf-8', 'replace'), headers, None)
+            return body
+        except Exception:
+            RPC_ERRORS.inc(**labels)
+            raise
 
     def address_utxos(self, address:str) -> list[MempoolSpace_UTXO]:
         return cast(list[MempoolSpace_UTXO], self._request_json('address', address, 'utxo'))
@@ -96,6 +140,15 @@ class MempoolSpaceAPI:
     def block_transactions(self, blockhash:str) -> list[MempoolSpace_Transaction]:
         return cast(list[MempoolSpace_Transaction], self._request_json('block', blockhash, 'txs'))
 
+    def block_raw(self, blockhash:str) -> bytes:
+        return self._request_bytes('block', blockhash, 'raw')
+
+    def block(self, blockhash:str) -> MempoolSpace_Block:
+        return cast(MempoolSpace_Block, self._request_json('block', blockhash))
+
+    def tip_height(self) -> int:
+        return int(self._request_str('blocks', 'tip', 'height'))
+
     def get_block_hash(self, height:int) -> str:
         return self._request_str('block-height', height)
 
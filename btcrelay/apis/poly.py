@@ -1,12 +1,46 @@
 # SPDX-License-Identifier: Apache-2.0
 
-from typing import Optional, TypedDict
+import struct
+from time import monotonic
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Optional, TypedDict, Iterable, cast
 
-from ..constants import BTC_CHAIN_T, DEFAULT_BTC_RPC_URLS
+from ..constants import (
+    LOGGER,
+    BTC_CHAIN_T,
+    DEFAULT_BTC_RPC_URLS,
+    DEFAULT_ASYNC_CONCURRENCY,
+    DEFAULT_MEMPOOLSPACE_WEIGHT
+)
+from ..bitcoin import (
+    double_sha256,
+    bytes2revhex,
+    hex2revbytes,
+    tx_strip_witness,
+    BtcTxProof,
+    MerkleTree,
+    MerkleTreeCache
+)
+from ..blockheader import BlockHeader, decode_headers
+from ..metrics import RETRIES, QUORUM_DISAGREEMENTS, endpoint_label
+from .health import EndpointHealth
+from .cache import ResultCache, MISSING
+from .httppool import URL_T, split_url
+from .jsonrpc import jsonrpc_Error
 from .bitcoinrpc import BitcoinJsonRpc, BitcoinJsonRpc_getblock_t
+from .asyncbitcoinrpc import AsyncBitcoinJsonRpc
 from .mempoolspace import MempoolSpaceAPI
 
 
+# Bitcoin Core error code while the node is starting up
+RPC_IN_WARMUP = -28
+
+# Large or many-item requests, a hedged duplicate would double their load
+UNHEDGED_METHODS = frozenset(['getblock', 'getblockraw', 'getheaders', 'getheadersraw', 'gettxouts',
+                              'heights2hashes', 'scantxoutset'])
+
+
 class PolyAPIError(RuntimeError):
     pass
 
@@ -17,48 +51,475 @@ class PolyAPI_BlockHeader(TypedDict):
     bits: int
 
 
+def btc_rpc_url(chain:BTC_CHAIN_T, custom_btc_rpc_url:Optional[str]) -> URL_T:
+    """Setup Bitcoin RPC node"""
+    if not custom_btc_rpc_url:
+        if chain in DEFAULT_BTC_RPC_URLS:
+            return DEFAULT_BTC_RPC_URLS[chain]
+        raise PolyAPIError(f'No Getblock.io JSON-RPC endpoint for chain: {chain}')
+    return custom_btc_rpc_url
+
+
+def btc_rpc_urls(chain:BTC_CHAIN_T, custom_btc_rpc_urls:Optional[str|list[str]]) -> list[tuple[URL_T,float]]:
+    """
+    Bitcoin RPC nodes with their weights, given as `url#weight`
+    (default weight 1), or the chain's default node
+    """
+    if isinstance(custom_btc_rpc_urls, str):
+        custom_btc_rpc_urls = [custom_btc_rpc_urls]
+    if not custom_btc_rpc_urls:
+        return [(btc_rpc_url(chain, None), 1.0)]
+    result: list[tuple[URL_T,float]] = []
+    for url in custom_btc_rpc_urls:
+        url, _, weight = url.partition('#')
+        result.append((url, float(weight or 1)))
+    return result
+
+
+def is_endpoint_fault(ex:Exception) -> bool:
+    """
+    Errors caused by the endpoint rather than the request, e.g. timeouts or
+    HTTP 5xx, which are worth retrying elsewhere. An RPC error reply (such as
+    an unknown block) would be the same from any backend.
+    """
+    if isinstance(ex, jsonrpc_Error):
+        reply = ex.args[0] if ex.args else None
+        error = reply.get('error') if isinstance(reply, dict) else None
+        if isinstance(error, dict) and 'code' in error:
+            return error['code'] == RPC_IN_WARMUP
+        return True
+    if isinstance(ex, HTTPError):
+        return ex.code == 429 or ex.code >= 500
+    return True
+
+
+def decode_raw_headers(data:bytes, height:int, count:int) -> list[BlockHeader]:
+    """Decode serialized headers from a provider, which must be the requested hash chain"""
+    headers = decode_headers(data, height)
+    if len(headers) != count:
+        raise PolyAPIError(f'Expected {count} headers from height {height}, got {len(headers)}')
+    for prev, header in zip(headers, headers[1:]):
+        if header.previousblockhash != prev.hash:
+            raise PolyAPIError(f'Headers not a hash chain at height {header.height}')
+    return headers
+
+
+class PolyBackend:
+    """
+    One Bitcoin data provider, with the subset of `PolyAPI` methods it
+    supports and the health of its endpoint
+    """
+    name: str
+    weight: float
+    health: EndpointHealth
+    supports: frozenset[str]
+
+    def __init__(self, name:str, weight:float):
+        self.name = name
+        self.weight = weight
+        self.health = EndpointHealth(name)
+
+    def call(self, method:str, *args:Any) -> Any:
+        started = monotonic()
+        try:
+            result = getattr(self, method)(*args)
+        except Exception as ex:
+            self.health.record(method, monotonic() - started, not is_endpoint_fault(ex))
+            raise
+        self.health.record(method, monotonic() - started, True)
+        return result
+
+
+class BitcoinRpcBackend(PolyBackend):
+    rpc: BitcoinJsonRpc
+    supports = frozenset(['gettxout', 'gettxouts', 'gettxoutproof', 'getrawtransaction', 'getblock', 'getblockraw',
+                          'getheader', 'getheaders', 'getheadersraw', 'height', 'height2hash', 'heights2hashes',
+                          'scantxoutset'])
+
+    def __init__(self, url:URL_T, weight:float=1.0):
+        super().__init__(endpoint_label(split_url(url)[0]), weight)
+        self.rpc = BitcoinJsonRpc(url)
+
+    def gettxout(self, txid:str|bytes, out_idx:int):
+        return self.rpc.gettxout(txid, out_idx)
+
+    def gettxouts(self, outpoints:list[tuple[bytes,int]]) -> list[Optional[dict[str,Any]]]:
+        return self.rpc.gettxouts(outpoints)
+
+    def gettxoutproof(self, txids:list[str|bytes]):
+        return self.rpc.gettxoutproof(txids)
+
+    def getrawtransaction(self, txid:bytes, blockhash:Optional[bytes]=None) -> bytes:
+        return self.rpc.getrawtransaction(bytes2revhex(txid), bytes2revhex(blockhash) if blockhash else None)
+
+    def getblock(self, blockhash:str|bytes, verbose=False):
+        return self.rpc.getblock(blockhash, verbose=verbose)
+
+    def getblockraw(self, blockhash:bytes) -> bytes:
+        return bytes.fromhex(self.rpc.getblockraw(blockhash))
+
+    def scantxoutset(self, scripts:list[bytes]) -> dict[str,Any]:
+        return self.rpc.scantxoutset(scripts)
+
+    def getheader(self, blockhash:str|bytes) -> BitcoinJsonRpc_getblock_t:
+        return self.rpc.getblockheader(blockhash)
+
+    def getheaders(self, blockhashes:Iterable[str|bytes]) -> list[BitcoinJsonRpc_getblock_t]:
+        return self.rpc.getblockheaders(blockhashes)
+
+    def getheadersraw(self, height:int, count:int) -> bytes:
+        return self.rpc.getheadersraw(height, count)
+
+    def height(self) -> int:
+        return self.rpc.getblockcount()
+
+    def height2hash(self, height:int) -> bytes:
+        return self.rpc.getblockhash(height)
+
+    def heights2hashes(self, heights:Iterable[int]) -> list[bytes]:
+        return self.rpc.getblockhashes(heights)
+
+
+class MempoolSpaceBackend(PolyBackend):
+    """
+    Single header & height lookups via mempool.space REST. Bulk methods
+    would take one request per item from a rate-limited public API, so they
+    aren't supported. It doesn't provide chainwork, so headers from here have
+    a chainwork of 0.
+    """
+    api: MempoolSpaceAPI
+    supports = frozenset(['getblockraw', 'getheader', 'height', 'height2hash'])
+
+    def __init__(self, api:MempoolSpaceAPI, weight:float=DEFAULT_MEMPOOLSPACE_WEIGHT):
+        super().__init__('mempool.space', weight)
+        self.api = api
+
+    def getblockraw(self, blockhash:bytes) -> bytes:
+        return self.api.block_raw(bytes2revhex(blockhash))
+
+    def getheader(self, blockhash:str|bytes) -> BitcoinJsonRpc_getblock_t:
+        if isinstance(blockhash, bytes):
+            blockhash = bytes2revhex(blockhash)
+        block = self.api.block(blockhash)
+        header = cast(BitcoinJsonRpc_getblock_t, {
+            'hash': hex2revbytes(block['id']),
+            'height': block['height'],
+            'version': block['version'],
+            'previousblockhash': hex2revbytes(block['previousblockhash']),
+            'merkleroot': hex2revbytes(block['merkle_root']),
+            'time': block['timestamp'],
+            'mediantime': block['mediantime'],
+            'bits': block['bits'],
+            'nonce': block['nonce'],
+            'difficulty': block['difficulty'],
+            'nTx': block['tx_count'],
+            'chainwork': 0,
+        })
+        # Don't trust the provider, the fields must hash to the block hash
+        raw = struct.pack('<I32s32sIII', header['version'], header['previousblockhash'],
+                          header['merkleroot'], header['time'], header['bits'], header['nonce'])
+        if double_sha256(raw) != header['hash']:
+            raise PolyAPIError(f'mempool.space header does not match hash {blockhash}')
+        return header
+
+    def height(self) -> int:
+        return self.api.tip_height()
+
+    def height2hash(self, height:int) -> bytes:
+        return hex2revbytes(self.api.get_block_hash(height))
+
+
 class PolyAPI:
     """
     Use multiple underlying APIs to retrieve the info necessary for multiple
     bitcoin compatible chains. Some providers don't support mainnet, some only
     support Bitcoin or Doge etc. or don't support all methods (like getblock.io)
+
+    Each call is routed to the healthiest backend which supports it, ranked
+    by weight, EWMA latency and error rate. If it hasn't answered within its
+    p95 latency for that method a hedged duplicate is sent to the next one,
+    and the first answer wins; losing requests which haven't started are
+    cancelled. Bulk methods aren't hedged. Failing backends are skipped by a
+    circuit breaker, and errors fail over to the remaining backends.
     """
     _chain:BTC_CHAIN_T
     _mempoolspace:Optional[MempoolSpaceAPI]
     _bitcoinrpc:BitcoinJsonRpc
+    backends:list[PolyBackend]
+    quorum:int
+    cache:ResultCache
 
-    def __init__(self, chain:BTC_CHAIN_T, custom_btc_rpc_url:Optional[str]):
+    def __init__(self, chain:BTC_CHAIN_T, custom_btc_rpc_url:Optional[str|list[str]],
+                 quorum:int=0, cache:Optional[ResultCache]=None):
         self._chain = chain
+        self.quorum = quorum
+        self.cache = cache if cache is not None else ResultCache()
+        rpc_backends = [BitcoinRpcBackend(url, weight)
+                        for url, weight in btc_rpc_urls(chain, custom_btc_rpc_url)]
+        self.backends = list(rpc_backends)
 
         # Mempool.space only supports Bitcoin mainnet & testnet
+        self._mempoolspace = None
         if chain in ('btc-mainnet', 'btc-testnet'):
             self._mempoolspace = MempoolSpaceAPI(chain)
+            self.backends.append(MempoolSpaceBackend(self._mempoolspace))
 
-        # Setup Bitcoin RPC node
-        if not custom_btc_rpc_url:
-            if chain in DEFAULT_BTC_RPC_URLS:
-                btc_rpc_url = DEFAULT_BTC_RPC_URLS[chain]
-            else:
-                raise PolyAPIError(f'No Getblock.io JSON-RPC endpoint for chain: {chain}')
-        else:
-            btc_rpc_url = custom_btc_rpc_url
+        # Methods only a JSON-RPC node provides use the first one, e.g. waitfornewblock
+        self._bitcoinrpc = rpc_backends[0].rpc
+
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(self.backends),
+                                            thread_name_prefix='poly')
+        self._merkletrees = MerkleTreeCache(self._fetch_merkletree)
+
+    def _candidates(self, method:str) -> list[PolyBackend]:
+        backends = [_ for _ in self.backends if method in _.supports]
+        backends.sort(key=lambda _: _.health.score(_.weight), reverse=True)
+        # Open circuits are only tried as a last resort
+        return [_ for _ in backends if not _.health.is_open()] + \
+               [_ for _ in backends if _.health.is_open()]
+
+    def _call(self, method:str, *args:Any) -> Any:
+        candidates = self._candidates(method)
+        if not candidates:
+            raise PolyAPIError(f'No backend supports {method} for {self._chain}')
+        if len(candidates) == 1:
+            return candidates[0].call(method, *args)
 
-        self._bitcoinrpc = BitcoinJsonRpc(btc_rpc_url)
+        pending: dict[Future,PolyBackend] = {}
+        last: Optional[Exception] = None
+        def launch() -> PolyBackend:
+            backend = candidates.pop(0)
+            pending[self._executor.submit(backend.call, method, *args)] = backend
+            return backend
+
+        hedge = method not in UNHEDGED_METHODS
+        latest = launch()
+        try:
+            while pending:
+                delay = latest.health.p95(method) if hedge and candidates else None
+                done, _ = wait(pending, delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    LOGGER.debug('%s slow to answer %s, hedging', latest.name, method)
+                    RETRIES.inc(kind='hedge')
+                    latest = launch()
+                    continue
+                for future in done:
+                    backend = pending.pop(future)
+                    try:
+                        return future.result()
+                    except Exception as ex:
+                        if not is_endpoint_fault(ex):
+                            raise
+                        LOGGER.warning('%s failed %s: %s', backend.name, method, ex)
+                        last = ex
+                if not pending and candidates:
+                    RETRIES.inc(kind='failover')
+                    latest = launch()
+        finally:
+            # Losing hedged requests which are still queued aren't sent
+            for future in pending:
+                future.cancel()
+        assert last is not None
+        raise last
+
+    def quorum_hash(self, height:int, blockhash:bytes) -> bool:
+        """
+        Ask every backend for the block hash at `height`, and their tip, all
+        concurrently. True if at least `quorum` of them agree with `blockhash`,
+        any disagreement is logged.
+        """
+        backends = [_ for _ in self.backends if 'height2hash' in _.supports]
+        if self.quorum > len(backends):
+            raise PolyAPIError(f'Quorum of {self.quorum} needs more than {len(backends)} backends')
+        hashes = {_.name: self._executor.submit(_.call, 'height2hash', height) for _ in backends}
+        tips = {_.name: self._executor.submit(_.call, 'height') for _ in backends}
+
+        agree: list[str] = []
+        disagree: list[str] = []
+        for name, future in hashes.items():
+            try:
+                theirs = future.result()
+            except Exception as ex:
+                # Behind or unavailable, neither agrees nor disagrees
+                tip = tips[name].exception() or tips[name].result()
+                LOGGER.warning('Quorum: %s has no hash at %d (tip %s): %s', name, height, tip, ex)
+                continue
+            if theirs == blockhash:
+                agree.append(name)
+            else:
+                disagree.append(name)
+                LOGGER.warning('Quorum: %s has %s at height %d, not %s (tip %s)',
+                               name, bytes2revhex(theirs), height, bytes2revhex(blockhash),
+                               tips[name].exception() or tips[name].result())
+        if disagree or len(agree) < self.quorum:
+            QUORUM_DISAGREEMENTS.inc(chain=self._chain)
+        LOGGER.debug('Quorum: %d/%d agree on %d %s (need %d)',
+                     len(agree), len(backends), height, bytes2revhex(blockhash), self.quorum)
+        return len(agree) >= self.quorum
 
     def gettxout(self, txid:str|bytes, out_idx:int):
-        return self._bitcoinrpc.gettxout(txid, out_idx)
+        return self._call('gettxout', txid, out_idx)
+
+    def gettxouts(self, outpoints:list[tuple[bytes,int]]) -> list[Optional[dict[str,Any]]]:
+        """Unspent outputs for many (txid, vout), in one batch, not cached as they get spent"""
+        if not outpoints:
+            return []
+        return cast(list[Optional[dict[str,Any]]], self._call('gettxouts', outpoints))
 
     def gettxoutproof(self, txids:list[str|bytes]):
-        return self._bitcoinrpc.gettxoutproof(txids)
+        return self._call('gettxoutproof', txids)
+
+    def getrawtransaction(self, txid:bytes, blockhash:Optional[bytes]=None) -> bytes:
+        cached = self.cache.get('getrawtransaction', txid)
+        if cached is not MISSING:
+            return cast(bytes, cached)
+        result = cast(bytes, self._call('getrawtransaction', txid, blockhash))
+        height = self.cache.height_of(blockhash) if blockhash is not None else None
+        self.cache.put('getrawtransaction', txid, result, height)
+        return result
 
     def getblock(self, blockhash:str|bytes, verbose=False):
-        return self._bitcoinrpc.getblock(blockhash, verbose=verbose)
+        blockhash = hex2revbytes(blockhash)
+        cached = self.cache.get('getblock', (blockhash, verbose))
+        if cached is not MISSING:
+            return cached
+        result = self._call('getblock', blockhash, verbose)
+        self.cache.block(result['height'], blockhash)
+        self.cache.put('getblock', (blockhash, verbose), result, result['height'])
+        return result
+
+    def getblockraw(self, blockhash:bytes) -> bytes:
+        """Serialized block, with witnesses, not cached as blocks are large"""
+        raw = cast(bytes, self._call('getblockraw', blockhash))
+        if double_sha256(raw[:80]) != blockhash:
+            raise PolyAPIError(f'Block does not match hash {bytes2revhex(blockhash)}')
+        return raw
+
+    def scantxoutset(self, scripts:list[bytes]) -> dict[str,Any]:
+        """Unspent outputs paying any of `scripts`, a scan of the whole UTXO set"""
+        return cast(dict[str,Any], self._call('scantxoutset', scripts))
+
+    def _fetch_merkletree(self, blockhash:bytes) -> tuple[bytes,list[bytes]]:
+        block = cast(BitcoinJsonRpc_getblock_t, self.getblock(blockhash))
+        header = struct.pack('<I32s32sIII', block['version'], block['previousblockhash'],
+                             block['merkleroot'], block['time'], block['bits'], block['nonce'])
+        return header, block['tx']
+
+    def merkletree(self, blockhash:bytes) -> MerkleTree:
+        """Transaction merkle tree of a block, cached, one `getblock` per block"""
+        return self._merkletrees.get(blockhash)
+
+    def txproofs(self, blockhash:bytes, txids:list[bytes], raw:bool=True) -> list[BtcTxProof]:
+        """
+        Inclusion proofs for transactions in the same block, optionally with
+        their hash-serialized raw transactions for the contracts to parse
+        """
+        proofs = self.merkletree(blockhash).proofs(txids)
+        if raw:
+            for txid, proof in zip(txids, proofs):
+                proof['rawTx'] = tx_strip_witness(self.getrawtransaction(txid, blockhash))
+        return proofs
 
     def getheader(self, blockhash:str|bytes) -> BitcoinJsonRpc_getblock_t:
-        return self._bitcoinrpc.getblockheader(blockhash)
+        return self.getheaders([blockhash])[0]
+
+    def getheaders(self, blockhashes:Iterable[str|bytes]) -> list[BitcoinJsonRpc_getblock_t]:
+        hashes = [hex2revbytes(_) for _ in blockhashes]
+        found = {_: self.cache.get('getheader', _) for _ in hashes}
+        missing = [h for h, header in found.items() if header is MISSING]
+        if missing:
+            if len(missing) == 1:
+                headers = [cast(BitcoinJsonRpc_getblock_t, self._call('getheader', missing[0]))]
+            else:
+                headers = cast(list[BitcoinJsonRpc_getblock_t], self._call('getheaders', missing))
+            for blockhash, header in zip(missing, headers):
+                self.cache.block(header['height'], blockhash)
+                self.cache.put('getheader', blockhash, header, header['height'])
+                found[blockhash] = header
+        return [cast(BitcoinJsonRpc_getblock_t, found[_]) for _ in hashes]
+
+    def getrawheaders(self, height:int, count:int) -> list[BlockHeader]:
+        """
+        `count` headers from `height`, fetched serialized (a single request
+        with bitcoind REST) and decoded in bulk. They have no chainwork, fetchd
+        accumulates it from the header below them.
+        """
+        headers = decode_raw_headers(cast(bytes, self._call('getheadersraw', height, count)), height, count)
+        for header in headers:
+            self.cache.block(header.height, header.hash)
+            self.cache.put('height2hash', header.height, header.hash, header.height)
+        return headers
 
     def height(self) -> int:
-        return self._bitcoinrpc.getblockcount()
+        height = cast(int, self._call('height'))
+        self.cache.tip(height)
+        return height
 
     def height2hash(self, height:int) -> bytes:
-        return self._bitcoinrpc.getblockhash(height)
+        return self.heights2hashes([height])[0]
+
+    def heights2hashes(self, heights:Iterable[int]) -> list[bytes]:
+        heights = list(heights)
+        found = {_: self.cache.get('height2hash', _) for _ in heights}
+        missing = [h for h, blockhash in found.items() if blockhash is MISSING]
+        if missing:
+            if len(missing) == 1:
+                hashes = [cast(bytes, self._call('height2hash', missing[0]))]
+            else:
+                hashes = cast(list[bytes], self._call('heights2hashes', missing))
+            for height, blockhash in zip(missing, hashes):
+                self.cache.block(height, blockhash)
+                self.cache.put('height2hash', height, blockhash, height)
+                found[height] = blockhash
+        return [cast(bytes, found[_]) for _ in heights]
+
+
+class AsyncPolyAPI:
+    """
+    asyncio variant of `PolyAPI`, returns the same typed results.
+    Only uses the highest weighted Bitcoin RPC node.
+    """
+    _chain:BTC_CHAIN_T
+    _bitcoinrpc:AsyncBitcoinJsonRpc
+
+    def __init__(self, chain:BTC_CHAIN_T, custom_btc_rpc_url:Optional[str|list[str]],
+                 concurrency:int=DEFAULT_ASYNC_CONCURRENCY):
+        self._chain = chain
+        url, _ = max(btc_rpc_urls(chain, custom_btc_rpc_url), key=lambda _: _[1])
+        self._bitcoinrpc = AsyncBitcoinJsonRpc(url, concurrency)
+
+    async def __aenter__(self) -> 'AsyncPolyAPI':
+        return self
+
+    async def __aexit__(self, *args:Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self._bitcoinrpc.close()
+
+    async def gettxout(self, txid:str|bytes, out_idx:int):
+        return await self._bitcoinrpc.gettxout(txid, out_idx)
+
+    async def gettxoutproof(self, txids:list[str|bytes]):
+        return await self._bitcoinrpc.gettxoutproof(txids)
+
+    async def getblock(self, blockhash:str|bytes, verbose=False):
+        return await self._bitcoinrpc.getblock(blockhash, verbose=verbose)
+
+    async def getheader(self, blockhash:str|bytes) -> BitcoinJsonRpc_getblock_t:
+        return await self._bitcoinrpc.getblockheader(blockhash)
+
+    async def getheaders(self, blockhashes:Iterable[str|bytes]) -> list[BitcoinJsonRpc_getblock_t]:
+        return await self._bitcoinrpc.getblockheaders(blockhashes)
+
+    async def getrawheaders(self, height:int, count:int) -> list[BlockHeader]:
+        return decode_raw_headers(await self._bitcoinrpc.getheadersraw(height, count), height, count)
+
+    async def height(self) -> int:
+        return await self._bitcoinrpc.getblockcount()
+
+    async def height2hash(self, height:int) -> bytes:
+        return await self._bitcoinrpc.getblockhash(height)
+
+    async def heights2hashes(self, heights:Iterable[int]) -> list[bytes]:
+        return await self._bitcoinrpc.getblockhashes(heights)
@@ -0,0 +1,317 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+import copy
+import random
+import asyncio
+from time import monotonic
+from threading import Lock
+from collections import deque
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from ..constants import (
+    LOGGER,
+    DEFAULT_RATE_LIMITS,
+    DEFAULT_RATELIMIT_RETRIES,
+    DEFAULT_BACKOFF_BASE,
+    DEFAULT_BACKOFF_MAX
+)
+from ..metrics import THROTTLED, COALESCED, RATELIMIT_SECONDS
+
+# HTTP statuses which mean 'slow down', with or without a Retry-After header
+THROTTLE_STATUSES = (429, 503)
+
+# Requests per second a throttled endpoint is never slowed below
+MIN_RATE = 0.1
+
+# Recent request times kept for unlimited endpoints, to estimate the rate when throttled
+RATE_WINDOW_SIZE = 1024
+
+# HTTP status, headers (anything with `.get`) and body of a reply
+REPLY_T = tuple[int,Any,bytes]
+
+
+class TokenBucket:
+    """
+    Token bucket for one endpoint, allowing `burst` requests at once and
+    `rate` per second sustained. A `rate` of None is unlimited until the
+    endpoint first throttles, then it's limited to half the rate which was
+    being sent.
+
+    Callers reserve a token and wait until it's due, so concurrent callers
+    queue up in order rather than spinning. A throttled reply pauses the
+    whole endpoint until its Retry-After, and halves the rate; successes
+    afterwards recover a twentieth of it per second (AIMD), so catch-up
+    settles at the maximum rate the provider sustains.
+    """
+    name: str
+    rate: Optional[float]
+    burst: float
+    current: Optional[float]
+    _tokens: float
+    _updated: float
+    _paused_until: float
+    _recovered: float
+    _epoch: int
+    _sent: deque[float]
+
+    def __init__(self, name:str, rate:Optional[float]=None, burst:Optional[float]=None):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else (rate or 1.0))
+        self.current = rate
+        self._tokens = self.burst
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._recovered = 0.0
+        self._epoch = 0
+        self._sent = deque(maxlen=RATE_WINDOW_SIZE)
+        self._lock = Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returns seconds to wait before using it"""
+        with self._lock:
+            now = monotonic()
+            if self.current is None:
+                self._sent.append(now)
+                return max(0.0, self._paused_until - now)
+            # Tokens don't accrue while paused, `_updated` is the end of the pause
+            self._tokens = min(self.burst, self._tokens + (max(0.0, now - self._updated) * self.current))
+            self._updated = max(now, self._updated)
+            self._tokens -= 1
+            if self._tokens < 0:
+                return (self._updated - now) + (-self._tokens / self.current)
+            return max(0.0, self._paused_until - now)
+
+    def acquire(self) -> None:
+        # Reservations made before the endpoint throttled are void, take another
+        while True:
+            epoch = self._epoch
+            wait = self.reserve()
+            if wait > 0:
+                RATELIMIT_SECONDS.observe(wait, endpoint=self.name)
+                time.sleep(wait)
+            if epoch == self._epoch:
+                return
+
+    async def acquire_async(self) -> None:
+        while True:
+            epoch = self._epoch
+            wait = self.reserve()
+            if wait > 0:
+                RATELIMIT_SECONDS.observe(wait, endpoint=self.name)
+                await asyncio.sleep(wait)
+            if epoch == self._epoch:
+                return
+
+    def throttled(self, delay:float) -> None:
+        """The endpoint replied 429/503, nothing is sent to it for `delay` seconds"""
+        THROTTLED.inc(endpoint=self.name)
+        with self._lock:
+            now = monotonic()
+            # Requests already in-flight when the first 429 arrived only extend the pause
+            if now >= self._paused_until:
+                if self.current is None:
+                    # Unlimited endpoint, its limit is somewhere below what was sent in the last second
+                    sent = sum(1 for _ in self._sent if _ > now - 1)
+                    self.rate = float(max(1, sent))
+                    self.burst = max(1.0, self.rate / 2)
+                    self.current = self.rate
+                    self._sent.clear()
+                self.current = max(self.current / 2, MIN_RATE)
+            self._paused_until = max(self._paused_until, now + delay)
+            self._recovered = self._paused_until
+            # Callers already queued reserve again, starting after the pause
+            self._tokens = 0.0
+            self._updated = self._paused_until
+            self._epoch += 1
+        LOGGER.warning('%s throttled, pausing %.1fs then %.2f req/s', self.name, delay, self.current)
+
+    def succeeded(self) -> None:
+        """Recover towards the configured rate, by a twentieth of it per second"""
+        if self.rate is None or self.current is None or self.current >= self.rate:
+            return
+        with self._lock:
+            now = monotonic()
+            if now - self._recovered >= 1:
+                self.current = min(self.rate, self.current + (self.rate / 20))
+                self._recovered = now
+
+
+LIMITERS: dict[str,TokenBucket] = {}
+LIMITERS_LOCK = Lock()
+RATE_LIMITS: dict[str,tuple[float,float]] = dict(DEFAULT_RATE_LIMITS)
+
+
+def configure_rate_limit(host:str, rate:float, burst:Optional[float]=None) -> None:
+    """Set requests per second & burst for a provider host, before it's first used"""
+    RATE_LIMITS[host] = (rate, burst if burst is not None else rate)
+    with LIMITERS_LOCK:
+        for name in list(LIMITERS):
+            if name == host or name.startswith(f'{host}:'):
+                del LIMITERS[name]
+
+
+def parse_rate_limit(value:str) -> tuple[str,float,Optional[float]]:
+    """Parse a `host=rate[/burst]` option"""
+    host, sep, limit = value.partition('=')
+    if not sep or not host:
+        raise ValueError(f'Rate limit must be host=rate[/burst]: {value}')
+    rate, _, burst = limit.partition('/')
+    return host, float(rate), float(burst) if burst else None
+
+
+def rate_limiter(url:str) -> TokenBucket:
+    """
+    Shared token bucket for the endpoint of a URL, one per host:port, with
+    the rate configured for its host (or a parent domain of it)
+    """
+    parts = urlsplit(url)
+    name = parts.netloc.rpartition('@')[2]
+    with LIMITERS_LOCK:
+        bucket = LIMITERS.get(name)
+        if bucket is None:
+            host = parts.hostname or ''
+            limit = next((RATE_LIMITS[_] for _ in (name, host) if _ in RATE_LIMITS), None)
+            if limit is None:
+                limit = next((v for k, v in RATE_LIMITS.items() if host.endswith(f'.{k}')), None)
+            bucket = LIMITERS[name] = TokenBucket(name, *(limit or (None, None)))
+    return bucket
+
+
+def retry_after(headers:Any) -> Optional[float]:
+    """Seconds from a Retry-After header, given as seconds or an HTTP date"""
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt:int, headers:Any=None,
+                  base:float=DEFAULT_BACKOFF_BASE, cap:float=DEFAULT_BACKOFF_MAX) -> float:
+    """
+    Seconds before retry `attempt` (from 0): the server's Retry-After if
+    given, otherwise exponential backoff with full jitter
+    """
+    delay = retry_after(headers)
+    if delay is not None:
+        return min(delay, cap)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def is_throttled(status:int, headers:Any=None) -> bool:
+    """429, or a 503 which says when to come back"""
+    return status == 429 or (status in THROTTLE_STATUSES and retry_after(headers) is not None)
+
+
+def send_throttled(bucket:TokenBucket, send:Callable[[],REPLY_T],
+                   retries:int=DEFAULT_RATELIMIT_RETRIES) -> REPLY_T:
+    """
+    Call `send` when the bucket allows, retrying throttled replies up to
+    `retries` times. The last reply is returned, throttled or not.
+    """
+    attempt = 0
+    while True:
+        bucket.acquire()
+        reply = send()
+        if not is_throttled(reply[0], reply[1]):
+            bucket.succeeded()
+            return reply
+        if attempt >= retries:
+            return reply
+        bucket.throttled(backoff_delay(attempt, reply[1]))
+        attempt += 1
+
+
+async def send_throttled_async(bucket:TokenBucket, send:Callable[[],Awaitable[REPLY_T]],
+                               retries:int=DEFAULT_RATELIMIT_RETRIES) -> REPLY_T:
+    """Like `send_throttled`, for asyncio"""
+    attempt = 0
+    while True:
+        await bucket.acquire_async()
+        reply = await send()
+        if not is_throttled(reply[0], reply[1]):
+            bucket.succeeded()
+            return reply
+        if attempt >= retries:
+            return reply
+        bucket.throttled(backoff_delay(attempt, reply[1]))
+        attempt += 1
+
+
+class Coalescer:
+    """
+    Identical requests made while one is already in-flight wait for its
+    result instead of being sent again. Waiters get a deep copy, as callers
+    may parse results in place.
+    """
+    api: str
+    _inflight: dict[Hashable,Future[Any]]
+
+    def __init__(self, api:str):
+        self.api = api
+        self._inflight = {}
+        self._lock = Lock()
+
+    def run(self, key:Hashable, fn:Callable[[],Any]) -> Any:
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if future is None:
+                future = self._inflight[key] = Future()
+        if not owner:
+            COALESCED.inc(api=self.api)
+            return copy.deepcopy(future.result())
+        try:
+            result = fn()
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+class AsyncCoalescer:
+    """`Coalescer` for coroutines on a single event loop"""
+    api: str
+    _inflight: dict[Hashable,asyncio.Future[Any]]
+
+    def __init__(self, api:str):
+        self.api = api
+        self._inflight = {}
+
+    async def run(self, key:Hashable, fn:Callable[[],Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            COALESCED.inc(api=self.api)
+            return copy.deepcopy(await asyncio.shield(future))
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as ex:
+            future.set_exception(ex)
+            # Retrieved here so it isn't logged as never retrieved when nobody waited
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
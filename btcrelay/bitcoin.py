@@ -1,6 +1,10 @@
 # SPDX-License-Identifier: Apache-2.0
 
+import struct
 import hashlib
+from threading import Lock
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, Optional, TypedDict
 
 def sha256(s:bytes) -> bytes:
     return hashlib.sha256(s).digest()
@@ -10,14 +14,341 @@ def double_sha256(s:bytes) -> bytes:
     return sha256(sha256(s))
 
 
+# Pairs of 32 byte hashes in a contiguous merkle tree level
+MERKLE_PAIR = struct.Struct('64s')
+
+
+def merkle_level(level:bytes) -> bytes:
+    """
+    Hash a level of the merkle tree, given as one contiguous buffer of 32 byte
+    hashes, into the level above. An odd hash out is paired with itself.
+    """
+    if len(level) & 32:
+        level += level[-32:]
+    sha = hashlib.sha256
+    return b''.join([sha(sha(pair).digest()).digest() for (pair,) in MERKLE_PAIR.iter_unpack(level)])
+
+
 def merkle_build(hashes:list[bytes]) -> bytes|None:
-    while len(hashes) > 1:
-        size = len(hashes)
-        hashes = [double_sha256(hashes[i] + hashes[min(i + 1, size - 1)])
-                  for i in range(0, size, 2)]
-    if hashes:
-        return hashes[0]
-    return None
+    level = b''.join(hashes)
+    while len(level) > 32:
+        level = merkle_level(level)
+    return level or None
+
+
+def merkle_branches(hashes:list[bytes], indexes:Iterable[int]) -> tuple[bytes|None,dict[int,list[bytes]]]:
+    """
+    Build the merkle root and, in the same pass, the branch for each of
+    `indexes`: the sibling hashes from the leaf level up to below the root.
+    """
+    count = len(hashes)
+    positions = {}
+    for index in indexes:
+        if not 0 <= index < count:
+            raise IndexError(f'merkle index {index} out of range for {count} hashes')
+        positions[index] = index
+    branches: dict[int,list[bytes]] = {_: [] for _ in positions}
+    level = b''.join(hashes)
+    while len(level) > 32:
+        count = len(level) // 32
+        for index, position in positions.items():
+            sibling = min(position ^ 1, count - 1)
+            branches[index].append(level[sibling*32:(sibling+1)*32])
+            positions[index] = position >> 1
+        level = merkle_level(level)
+    return level or None, branches
+
+
+# Block trees kept by `MerkleTreeCache`, enough for the deposits of a few recent blocks
+MERKLE_TREE_CACHE_SIZE = 16
+
+
+class MerkleProofError(ValueError):
+    pass
+
+
+class BtcTxProof(TypedDict):
+    """
+    Mirrors `BtcTxProof` in interfaces/BtcTxProof.sol. `txId` and each 32 byte
+    sibling in `txMerkleProof` are in RPC (reversed) byte order, the contract
+    reverses them. `rawTx` is hash-serialized (no witness), empty if unknown.
+    """
+    blockHeader: bytes
+    txId: bytes
+    txIndex: int
+    txMerkleProof: bytes
+    rawTx: bytes
+
+
+def btc_tx_proof_args(proof:BtcTxProof) -> tuple[bytes,bytes,int,bytes,bytes]:
+    """Proof as the tuple passed to contract functions"""
+    return (proof['blockHeader'], proof['txId'], proof['txIndex'],
+            proof['txMerkleProof'], proof['rawTx'])
+
+
+def merkle_branch_root(txid:bytes, index:int, branch:Iterable[bytes]) -> bytes:
+    """Mirrors `BtcProofUtils.getTxMerkleRoot`, all hashes in internal byte order"""
+    node = txid
+    for sibling in branch:
+        node = double_sha256(sibling + node if index & 1 else node + sibling)
+        index >>= 1
+    return node
+
+
+def _varint(data:bytes, offset:int) -> tuple[int,int]:
+    pivot = data[offset]
+    if pivot < 0xfd:
+        return pivot, offset + 1
+    size = {0xfd: 2, 0xfe: 4, 0xff: 8}[pivot]
+    return int.from_bytes(data[offset+1:offset+1+size], 'little'), offset + 1 + size
+
+
+def _parse_tx(data:bytes, start:int=0) -> tuple[int,bytes,list[tuple[int,bytes]]]:
+    """
+    Parse the transaction at `start`, with or without witness. Returns the
+    offset after it, its hash-serialization and (value, scriptPubKey) of
+    each output.
+    """
+    segwit = len(data) >= start + 6 and data[start+4] == 0 and data[start+5] != 0
+    offset = start + (6 if segwit else 4)
+    inputs, offset = _varint(data, offset)
+    for _ in range(inputs):
+        size, offset = _varint(data, offset + 36)
+        offset += size + 4
+    count, offset = _varint(data, offset)
+    outputs = []
+    for _ in range(count):
+        value = int.from_bytes(data[offset:offset+8], 'little')
+        size, offset = _varint(data, offset + 8)
+        outputs.append((value, data[offset:offset+size]))
+        offset += size
+    if not segwit:
+        return offset + 4, data[start:offset+4], outputs
+    body_end = offset
+    for _ in range(inputs):
+        items, offset = _varint(data, offset)
+        for _ in range(items):
+            size, offset = _varint(data, offset)
+            offset += size
+    stripped = data[start:start+4] + data[start+6:body_end] + data[offset:offset+4]
+    return offset + 4, stripped, outputs
+
+
+def tx_outputs(raw:bytes) -> list[tuple[int,bytes]]:
+    """(value in satoshis, scriptPubKey) of each output of a raw transaction, with or without witness"""
+    return _parse_tx(raw)[2]
+
+
+def block_transactions(raw:bytes) -> Iterator[tuple[bytes,list[tuple[int,bytes]]]]:
+    """Txid (internal byte order) and outputs of each transaction in a raw block"""
+    count, offset = _varint(raw, 80)
+    for _ in range(count):
+        offset, stripped, outputs = _parse_tx(raw, offset)
+        yield double_sha256(stripped), outputs
+
+
+def p2pkh_script(pubkeyhash:bytes) -> bytes:
+    """scriptPubKey paying a 20 byte public key hash, the only kind deposits accept"""
+    return b'\x76\xa9\x14' + pubkeyhash + b'\x88\xac'
+
+
+def tx_strip_witness(raw:bytes) -> bytes:
+    """Hash-serialized transaction, as the txid commits to and the contracts parse"""
+    if len(raw) < 6 or raw[4] != 0 or raw[5] == 0:
+        return raw
+    return _parse_tx(raw)[1]
+
+
+class MerkleTree:
+    """
+    Every level of a block's transaction merkle tree, so the branch for any
+    transaction is a slice per level rather than re-hashing the block.
+    Hashes are in internal byte order.
+    """
+    header: bytes
+    levels: list[bytes]
+    _index: Optional[dict[bytes,int]]
+
+    def __init__(self, txids:list[bytes], header:bytes=b''):
+        self.header = header
+        level = b''.join(txids)
+        self.levels = [level]
+        while len(level) > 32:
+            level = merkle_level(level)
+            self.levels.append(level)
+        self._index = None
+
+    @property
+    def root(self) -> bytes|None:
+        return self.levels[-1] or None
+
+    def __len__(self) -> int:
+        return len(self.levels[0]) // 32
+
+    def txids(self) -> Iterator[bytes]:
+        """Transaction ids of the block, in order"""
+        leaves = self.levels[0]
+        return (leaves[i:i+32] for i in range(0, len(leaves), 32))
+
+    def index(self, txid:bytes) -> int:
+        if self._index is None:
+            leaves = self.levels[0]
+            self._index = {leaves[i:i+32]: i // 32 for i in range(0, len(leaves), 32)}
+        if txid not in self._index:
+            raise MerkleProofError(f'Transaction {bytes2revhex(txid)} not in block')
+        return self._index[txid]
+
+    def branch(self, index:int) -> list[bytes]:
+        if not 0 <= index < len(self):
+            raise IndexError(f'merkle index {index} out of range for {len(self)} transactions')
+        branch = []
+        for level in self.levels[:-1]:
+            sibling = min(index ^ 1, (len(level) // 32) - 1)
+            branch.append(level[sibling*32:(sibling+1)*32])
+            index >>= 1
+        return branch
+
+    def proof(self, txid:bytes, rawTx:bytes=b'') -> BtcTxProof:
+        index = self.index(txid)
+        return {'blockHeader': self.header,
+                'txId': txid[::-1],
+                'txIndex': index,
+                'txMerkleProof': b''.join(_[::-1] for _ in self.branch(index)),
+                'rawTx': rawTx}
+
+    def proofs(self, txids:Iterable[bytes]) -> list[BtcTxProof]:
+        return [self.proof(_) for _ in txids]
+
+
+class MerkleTreeCache:
+    """
+    Recently used block merkle trees, `fetch` returns the 80 byte header and
+    txids of a block hash and is called once per block, so proofs for many
+    deposits in the same block cost a single block lookup.
+    """
+    fetch: Callable[[bytes],tuple[bytes,list[bytes]]]
+    size: int
+    _trees: OrderedDict[bytes,MerkleTree]
+
+    def __init__(self, fetch:Callable[[bytes],tuple[bytes,list[bytes]]], size:int=MERKLE_TREE_CACHE_SIZE):
+        self.fetch = fetch
+        self.size = size
+        self._trees = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, blockhash:bytes) -> MerkleTree:
+        with self._lock:
+            tree = self._trees.get(blockhash)
+            if tree is not None:
+                self._trees.move_to_end(blockhash)
+                return tree
+        header, txids = self.fetch(blockhash)
+        if double_sha256(header) != blockhash:
+            raise MerkleProofError(f'Header does not match block {bytes2revhex(blockhash)}')
+        tree = MerkleTree(txids, header)
+        if tree.root != header[36:68]:
+            raise MerkleProofError(f'Transactions do not match merkle root of block {bytes2revhex(blockhash)}')
+        with self._lock:
+            self._trees[blockhash] = tree
+            while len(self._trees) > self.size:
+                self._trees.popitem(last=False)
+        return tree
+
+
+def parse_txoutproof(proof:str|bytes) -> list[BtcTxProof]:
+    """
+    Parse the partial merkle tree returned by `gettxoutproof`, into a proof
+    for each transaction it matches. `rawTx` is left empty.
+    """
+    data = bytes.fromhex(proof) if isinstance(proof, str) else proof
+    if len(data) < 84:
+        raise MerkleProofError('Truncated txoutproof')
+    header = data[:80]
+    total = int.from_bytes(data[80:84], 'little')
+    count, offset = _varint(data, 84)
+    hashes = [data[offset+(i*32):offset+((i+1)*32)] for i in range(count)]
+    offset += count * 32
+    if offset >= len(data):
+        raise MerkleProofError('Truncated txoutproof')
+    size, offset = _varint(data, offset)
+    flags = data[offset:offset+size]
+    if len(flags) != size or not total:
+        raise MerkleProofError('Truncated txoutproof')
+
+    height = 0
+    while ((total + (1 << height) - 1) >> height) > 1:
+        height += 1
+    def width(h:int) -> int:
+        return (total + (1 << h) - 1) >> h
+
+    # Depth first, as CPartialMerkleTree::TraverseAndExtract
+    nodes: dict[tuple[int,int],bytes] = {}
+    matches: list[int] = []
+    used = [0, 0]  # bits, hashes
+    def traverse(h:int, pos:int) -> bytes:
+        if used[0] >= len(flags) * 8:
+            raise MerkleProofError('Overflowed txoutproof flag bits')
+        flag = (flags[used[0] >> 3] >> (used[0] & 7)) & 1
+        used[0] += 1
+        if h == 0 or not flag:
+            if used[1] >= len(hashes):
+                raise MerkleProofError('Overflowed txoutproof hashes')
+            node = hashes[used[1]]
+            used[1] += 1
+            if h == 0 and flag:
+                matches.append(pos)
+        else:
+            left = traverse(h - 1, pos * 2)
+            right = left
+            if (pos * 2) + 1 < width(h - 1):
+                right = traverse(h - 1, (pos * 2) + 1)
+                if right == left:
+                    raise MerkleProofError('Duplicate txoutproof branch (CVE-2012-2459)')
+            node = double_sha256(left + right)
+        nodes[(h, pos)] = node
+        return node
+
+    root = traverse(height, 0)
+    if used[1] != len(hashes) or (used[0] + 7) // 8 != len(flags):
+        raise MerkleProofError('Unused txoutproof data')
+    if root != header[36:68]:
+        raise MerkleProofError('Tx merkle root mismatch')
+
+    proofs: list[BtcTxProof] = []
+    for index in matches:
+        branch = []
+        pos = index
+        for h in range(height):
+            sibling = min(pos ^ 1, width(h) - 1)
+            branch.append(nodes[(h, sibling)])
+            pos >>= 1
+        proofs.append({'blockHeader': header,
+                       'txId': nodes[(0, index)][::-1],
+                       'txIndex': index,
+                       'txMerkleProof': b''.join(_[::-1] for _ in branch),
+                       'rawTx': b''})
+    return proofs
+
+
+def verify_tx_proof(proof:BtcTxProof, blockhash:Optional[bytes]=None) -> None:
+    """
+    Local equivalent of `BtcProofUtils._getVerifiedTxOutput`, without parsing
+    the transaction outputs, raises `MerkleProofError` with the contract's
+    revert reason. `blockhash` is in internal byte order.
+    """
+    header = proof['blockHeader']
+    if len(header) != 80:
+        raise MerkleProofError('Block header must be 80 bytes')
+    if blockhash is not None and double_sha256(header) != blockhash:
+        raise MerkleProofError('Block hash mismatch')
+    siblings = proof['txMerkleProof']
+    if len(siblings) % 32:
+        raise MerkleProofError('Tx merkle proof must be 32 byte hashes')
+    branch = [siblings[i:i+32][::-1] for i in range(0, len(siblings), 32)]
+    if merkle_branch_root(proof['txId'][::-1], proof['txIndex'], branch) != header[36:68]:
+        raise MerkleProofError('Tx merkle root mismatch')
+    if proof['rawTx'] and double_sha256(proof['rawTx']) != proof['txId'][::-1]:
+        raise MerkleProofError('Tx ID mismatch')
 
 
 def hex2revbytes(x:bytes|str) -> bytes:
@@ -0,0 +1,132 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import struct
+from hashlib import sha256
+from typing import Any, Iterator, Optional, Sequence, Union
+
+from .apis.bitcoinrpc import BitcoinJsonRpc_getblock_t
+from .bitcoin import hex2revbytes
+
+HEADER_STRUCT = struct.Struct('<I32s32sIII')
+HEADER_SIZE = HEADER_STRUCT.size
+
+# `AbstractRelay.BlockHeader`: previousblockhash, merkleroot, version, time, bits, nonce
+SUBMIT_HEADER_T = tuple[bytes,bytes,int,int,int,int]
+
+
+class BlockHeader:
+    """
+    Compact block header record, a fraction of the size of the dict returned
+    by `getblockheader`. Hashes are in internal byte order, `height` is -1 and
+    `chainwork` is 0 where unknown.
+
+    Supports `header['field']` reads, so it can be used wherever the
+    `BitcoinJsonRpc_getblock_t` fields of a header are.
+    """
+    __slots__ = ('version', 'previousblockhash', 'merkleroot', 'time', 'bits', 'nonce',
+                 'hash', 'height', 'chainwork')
+    version: int
+    previousblockhash: bytes
+    merkleroot: bytes
+    time: int
+    bits: int
+    nonce: int
+    hash: bytes
+    height: int
+    chainwork: int
+
+    def __init__(self, version:int, previousblockhash:bytes, merkleroot:bytes, time:int,
+                 bits:int, nonce:int, hash:Optional[bytes]=None, height:int=-1, chainwork:int=0):
+        self.version = version
+        self.previousblockhash = previousblockhash
+        self.merkleroot = merkleroot
+        self.time = time
+        self.bits = bits
+        self.nonce = nonce
+        if hash is None:
+            hash = sha256(sha256(self.serialize()).digest()).digest()
+        self.hash = hash
+        self.height = height
+        self.chainwork = chainwork
+
+    @classmethod
+    def from_bytes(cls, raw:bytes|memoryview, height:int=-1, chainwork:int=0) -> 'BlockHeader':
+        """From the 80 byte serialization, the hash is computed from it"""
+        version, prevhash, merkleroot, time, bits, nonce = HEADER_STRUCT.unpack(raw)
+        return cls(version, prevhash, merkleroot, time, bits, nonce,
+                   sha256(sha256(raw).digest()).digest(), height, chainwork)
+
+    @classmethod
+    def from_rpc(cls, result:dict[str,Any]) -> 'BlockHeader':
+        """From an unparsed `getblockheader` or `getblock` JSON result, which isn't modified"""
+        return cls(result['version'],
+                   hex2revbytes(result.get('previousblockhash', '00' * 32)),
+                   hex2revbytes(result['merkleroot']),
+                   result['time'],
+                   int(result['bits'], 16),
+                   result['nonce'],
+                   hex2revbytes(result['hash']),
+                   result['height'],
+                   int(result['chainwork'], 16) if 'chainwork' in result else 0)
+
+    @classmethod
+    def from_dict(cls, block:BitcoinJsonRpc_getblock_t) -> 'BlockHeader':
+        """From a header already parsed by `parse_getblockheader_t`"""
+        return cls(block['version'], block['previousblockhash'], block['merkleroot'],
+                   block['time'], block['bits'], block['nonce'], block['hash'],
+                   block['height'], block.get('chainwork', 0))
+
+    def serialize(self) -> bytes:
+        return HEADER_STRUCT.pack(self.version, self.previousblockhash, self.merkleroot,
+                                  self.time, self.bits, self.nonce)
+
+    def as_tuple(self) -> SUBMIT_HEADER_T:
+        """Argument form of `AbstractRelay.BlockHeader`, references the same hash bytes"""
+        return (self.previousblockhash, self.merkleroot, self.version,
+                self.time, self.bits, self.nonce)
+
+    def __getitem__(self, key:str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key:str, default:Any=None) -> Any:
+        return getattr(self, key, default)
+
+    def __eq__(self, other:object) -> bool:
+        if not isinstance(other, BlockHeader):
+            return NotImplemented
+        return self.hash == other.hash and self.height == other.height
+
+    def __repr__(self) -> str:
+        return f'BlockHeader(height={self.height}, hash={self.hash[::-1].hex()})'
+
+
+# Anything with the fields of a header, the RPC dict or the compact record
+HEADER_T = Union[BitcoinJsonRpc_getblock_t, BlockHeader]
+
+
+def iter_headers(data:bytes|memoryview, height:int=-1) -> Iterator[BlockHeader]:
+    """
+    Decode consecutive 80 byte headers from one buffer, each is hashed from
+    a memoryview slice rather than a copy. Heights count up from `height`.
+    """
+    view = memoryview(data)
+    if len(view) % HEADER_SIZE:
+        raise ValueError(f'Header buffer of {len(view)} bytes is not a multiple of {HEADER_SIZE}')
+    for i, (version, prevhash, merkleroot, time, bits, nonce) in enumerate(HEADER_STRUCT.iter_unpack(view)):
+        raw = view[i*HEADER_SIZE:(i+1)*HEADER_SIZE]
+        yield BlockHeader(version, prevhash, merkleroot, time, bits, nonce,
+                          sha256(sha256(raw).digest()).digest(), height + i if height >= 0 else -1)
+
+
+def decode_headers(data:bytes|memoryview, height:int=-1) -> list[BlockHeader]:
+    return list(iter_headers(data, height))
+
+
+def submit_headers(headers:Sequence[HEADER_T]) -> list[SUBMIT_HEADER_T]:
+    """Headers as the `BlockHeader[]` argument of `AbstractRelay.submit`"""
+    return [_.as_tuple() if isinstance(_, BlockHeader) else
+            (_['previousblockhash'], _['merkleroot'], _['version'], _['time'], _['bits'], _['nonce'])
+            for _ in headers]
@@ -14,16 +14,23 @@ from .contracts import sapphire_chain_name, DeployedContractInfoManager
 from .constants import (
     CHAIN_CHOICES, DEFAULT_WALLET, SAPPHIRE_CHAIN_T,
     SAPPHIRE_CHOICES, LOGGER_LEVELS, DEFAULT_SAPPHIRE_RPC_URLS,
-    LOGGER_LEVEL_NAMES_T, LOGGER, BTC_CHAIN_T, __LINE__
+    LOGGER_LEVEL_NAMES_T, LOGGER, BTC_CHAIN_T, DEFAULT_CACHE_SIZE,
+    DEFAULT_RATE_LIMITS, __LINE__
 )
 from .apis.poly import PolyAPI
+from .apis.cache import ResultCache
+from .apis.ratelimit import configure_rate_limit, parse_rate_limit
+from .metrics import web3_metrics_middleware
 
 class Cmd(Namespace):
     loglevel: LOGGER_LEVEL_NAMES_T
     func: Callable[['Cmd'],int]
     web3: Web3
     key: LocalAccount
-    btc_rpc_url: Optional[str]
+    btc_rpc_url: Optional[list[str]]
+    cache_size: int
+    cache_file: Optional[str]
+    rate_limit: Optional[list[tuple[str,float,Optional[float]]]]
     chain: BTC_CHAIN_T
     sapphire: SAPPHIRE_CHAIN_T
     sapphire_rpc: str
@@ -43,7 +50,11 @@ class Cmd(Namespace):
         args.is_testnet = 'mainnet' not in args.chain
         bitcoinutils_setup(args.chain.removeprefix('btc-'))
 
-        args.poly = PolyAPI(args.chain, args.btc_rpc_url)
+        for host, rate, burst in args.rate_limit or []:
+            configure_rate_limit(host, rate, burst)
+
+        args.poly = PolyAPI(args.chain, args.btc_rpc_url,
+                            cache=ResultCache(args.cache_size, path=args.cache_file))
 
         args.dcim = DeployedContractInfoManager(args.chain, args.sapphire)
 
@@ -55,6 +66,7 @@ class Cmd(Namespace):
         # Setup ETH API, attach signer
         key = args.key
         w3.middleware_onion.add(construct_sign_and_send_raw_middleware(key))
+        w3.middleware_onion.add(web3_metrics_middleware(args.sapphire_rpc), 'metrics')
         w3.eth.default_account = key.address
 
         # Check ETH API works
@@ -82,8 +94,15 @@ class Cmd(Namespace):
         parser.add_argument('-k', '--key', metavar='0x...',
                             help='32 byte hex secret key for Web3 (env: BTCRELAY_WALLET)',
                             type=Account.from_key, default=DEFAULT_WALLET)
-        parser.add_argument('--btc-rpc-url', metavar='url', type=str,
-                            help='Bitcoin JSON-RPC endpoint (env: BTCRELAY_BTCRPC)')
+        parser.add_argument('--btc-rpc-url', metavar='url[#weight]', type=str, action='append',
+                            help='Bitcoin JSON-RPC endpoint (env: BTCRELAY_BTCRPC), may be repeated for failover')
+        parser.add_argument('--cache-size', metavar='n', type=int, default=DEFAULT_CACHE_SIZE,
+                            help='Bitcoin RPC results kept in memory, 0 disables (default: %(default)s)')
+        parser.add_argument('--cache-file', metavar='path',
+                            help='Also keep confirmed Bitcoin RPC results on disk')
+        parser.add_argument('--rate-limit', metavar='host=rate[/burst]', type=parse_rate_limit, action='append',
+                            help='Requests per second to a Bitcoin provider, may be repeated (default: %s)' % (
+                                ', '.join(f'{k}={r:g}/{b:g}' for k, (r, b) in DEFAULT_RATE_LIMITS.items())))
         parser.add_argument('--chain', choices=CHAIN_CHOICES, required=True)
         parser.add_argument('--sapphire', choices=SAPPHIRE_CHOICES, required=True)
         parser.add_argument('--sapphire-rpc', metavar='url',
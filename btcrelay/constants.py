@@ -84,6 +84,112 @@ DEFAULT_BATCH_COUNT=5
 
 DEFAULT_SLEEP_TIME=60
 
+# Keep-alive HTTP connections kept per endpoint, and seconds before idle ones are dropped
+DEFAULT_HTTP_POOL_SIZE=4
+DEFAULT_HTTP_IDLE_TIMEOUT=30
+DEFAULT_HTTP_TIMEOUT=60
+
+# Maximum number of calls per JSON-RPC batch request
+DEFAULT_JSONRPC_BATCH_SIZE=500
+
+# Most headers returned by one bitcoind REST `/rest/headers` request
+DEFAULT_REST_HEADERS_COUNT=2000
+
+# Maximum number of in-flight requests per endpoint for asyncio clients
+DEFAULT_ASYNC_CONCURRENCY=8
+
+# Local header store directory, one file per --chain
+DEFAULT_DATA_DIR=os.getenv('BTCRELAY_DATADIR', os.path.join(os.path.expanduser('~'), '.btcrelay'))
+
+# Number of heights compared per round trip when looking for a reorg
+DEFAULT_REORG_WINDOW=16
+
+# Relay block hashes read below the tip in each Multicall3 poll
+DEFAULT_RELAY_WINDOW=32
+
+# Pipelined submission, maximum in-flight transactions
+DEFAULT_MAX_INFLIGHT=1
+
+# Seconds before an unconfirmed submit is rebroadcast, and between receipt polls
+DEFAULT_SUBMIT_TIMEOUT=60
+DEFAULT_SUBMIT_POLL_TIME=1
+
+# Prior for the submit gas model, refined from receipts & estimates
+DEFAULT_SUBMIT_GAS_BASE=100000
+DEFAULT_SUBMIT_GAS_PER_HEADER=80000
+DEFAULT_SUBMIT_GAS_PER_RETARGET=25000
+
+# Gas limit margin for submits which can't be estimated (built on in-flight ones)
+DEFAULT_SUBMIT_GAS_MARGIN=1.25
+
+# Adaptive batches fill this fraction of the block gas limit
+DEFAULT_GAS_TARGET=0.5
+
+# Assumed Sapphire block interval when it can't be measured, in seconds
+DEFAULT_SAPPHIRE_BLOCK_TIME=6
+
+# Bitcoin difficulty retarget period, in blocks
+BTC_RETARGET_PERIOD=2016
+
+# Seconds a waitfornewblock long-poll waits, and before failed notification sources reconnect
+DEFAULT_WAITFORNEWBLOCK_TIMEOUT=30
+DEFAULT_NOTIFY_RECONNECT_TIME=5
+
+# Seconds between rewrites of the --metrics-file
+DEFAULT_METRICS_INTERVAL=15
+
+# Bitcoin backend health: EWMA smoothing, latency samples kept per method,
+# consecutive failures before the circuit opens and seconds until it's retried
+DEFAULT_HEALTH_EWMA=0.2
+DEFAULT_HEALTH_WINDOW=100
+DEFAULT_CIRCUIT_FAILURES=3
+DEFAULT_CIRCUIT_COOLDOWN=30
+
+# Seconds before a hedged request is sent to the next backend, until the p95 is known
+DEFAULT_HEDGE_DELAY=2.0
+DEFAULT_HEDGE_MIN_DELAY=0.05
+
+# Weight of mempool.space relative to Bitcoin JSON-RPC backends (default weight 1)
+DEFAULT_MEMPOOLSPACE_WEIGHT=0.5
+
+# Bitcoin RPC results cached: entries kept, confirmations after which data is
+# cached indefinitely (coinbase maturity, testnets reorg deeper than mainnet),
+# and seconds tip-adjacent data is cached for
+DEFAULT_CACHE_SIZE=50000
+DEFAULT_CACHE_CONFIRMATIONS=100
+DEFAULT_CACHE_TTL=30
+
+# Requests per second & burst for public providers, by host (subdomains match too).
+# Unlisted hosts, such as a local node, aren't limited until they reply HTTP 429.
+DEFAULT_RATE_LIMITS: dict[str,tuple[float,float]] = {
+    'go.getblock.io': (20, 20),
+    'mempool.space': (4, 8),
+}
+
+# Retries of a throttled (HTTP 429) request, and its exponential backoff in seconds
+# when the reply has no Retry-After
+DEFAULT_RATELIMIT_RETRIES=5
+DEFAULT_BACKOFF_BASE=0.5
+DEFAULT_BACKOFF_MAX=30
+
+# Deposit addresses derived per Multicall3 eth_call, and eth_calls in-flight by `deposit-derive-bulk`
+DEFAULT_DERIVE_BATCH=100
+DEFAULT_DERIVE_CONCURRENCY=4
+
+# `deposit-watchd`: depositDerived attempts before a deposit is given up on,
+# block hashes fetched per round trip while scanning for deposits, and most
+# deposits sent in one Multicall3 aggregate3 transaction
+DEFAULT_DEPOSIT_ATTEMPTS=3
+DEFAULT_DEPOSIT_SCAN_BATCH=100
+DEFAULT_DEPOSIT_BATCH=20
+
+# Prior for the depositDerived gas model: per transaction, and per deposit in it
+DEFAULT_DEPOSIT_GAS_BASE=60000
+DEFAULT_DEPOSIT_GAS_PER_DEPOSIT=350000
+
+# Number of prefetched batches queued for submission by `fetchd --async`
+DEFAULT_ASYNC_PIPELINE_DEPTH=2
+
 LOGGER_LEVEL_NAMES_T = Literal['d', 'debug', 'i', 'info', 'w', 'warn', 'warning', 'e', 'error']
 
 LOGGER_LEVELS: dict[LOGGER_LEVEL_NAMES_T,int] = {
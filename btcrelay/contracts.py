@@ -1,6 +1,7 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import json
+from decimal import Decimal
 from importlib import resources
 from importlib.abc import Traversable
 from typing_extensions import assert_never
@@ -21,6 +22,11 @@ ABI_DIR = resources.files(__package__ + '.abi')
 DEPLOYMENTS_DIR = resources.files(__package__ + '.deployments')
 
 
+def fee_ether(gas:int, gas_price:int) -> int|Decimal:
+    """Transaction fee in ether, as reported for deploys & submits"""
+    return Web3.from_wei(gas * gas_price, 'ether')
+
+
 def sapphire_chain_name(chain_id:int) -> str:
     return 'sapphire-' + SAPPHIRE_CHAINS_BY_CHAINID.get(chain_id, 'unknown')
 
@@ -126,8 +132,15 @@ class DeployedContractInfoManager:
             bytecode = self._data[name]['bytecode']
         return w3.eth.contract(abi=abi, bytecode=bytecode)
 
+    def is_deployed(self, name:CONTRACT_NAME_T) -> bool:
+        return name in self._data
+
     def contract_instance(self, name:CONTRACT_NAME_T, w3: Web3, address:Optional[ChecksumAddress]=None) -> Contract:
         if address is None:
             address = self._data[name]['expected_address']
-        abi = self._data[name]['abi']
+        if 'abi' in self._data.get(name, {}):
+            abi = self._data[name]['abi']
+        else:
+            # Third-party deployments (e.g. Multicall3) only record the address
+            abi = json.loads(ABI_DIR.joinpath(f'{name}.abi').read_text())
         return w3.eth.contract(address, abi=abi)
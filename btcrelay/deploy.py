@@ -3,16 +3,18 @@
 from time import time, sleep
 from typing import Optional
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from web3 import Web3
-from web3.types import TxParams
+from hexbytes import HexBytes
+from web3.types import Nonce, TxParams, TxReceipt
 from web3._utils.empty import Empty
 from web3.utils.address import get_create_address
 
 from .cmd import Cmd
 from .bitcoin import bytes2revhex
 from .constants import CONTRACT_NAME_T, DEFAULT_GAS_PRICE, LOGGER, __LINE__, ContractName
-from .contracts import DeployedInfo, ContractInfo
+from .contracts import DeployedInfo, ContractInfo, fee_ether
 
 
 class CmdDeploy(Cmd):
@@ -21,6 +23,7 @@ class CmdDeploy(Cmd):
     gasprice: Optional[int]
     components: list[ContractName]
     retry: int
+    pipeline: bool
 
     @classmethod
     def setup(cls, parser: ArgumentParser) -> None:
@@ -32,6 +35,8 @@ class CmdDeploy(Cmd):
         parser.add_argument('-g', '--gasprice', metavar='wei', type=int,
                             default=DEFAULT_GAS_PRICE,
                             help='Specify custom gasPrice in wei for deploy tx (default: 100 gwei)')
+        parser.add_argument('--pipeline', action='store_true',
+                            help='Send every deploy transaction at once with pre-assigned nonces, then wait for all receipts')
         parser.add_argument('components', nargs='*', type=ContractName,
                             help='Which on-chain components to deploy (default: all)')
 
@@ -213,7 +218,9 @@ class CmdDeploy(Cmd):
             LOGGER.info('No contracts to deploy!')
             return 0
 
-        max_fees_formatted = Web3.from_wei(sum([_['max_fee'] for _ in deploy_todo.values()]), 'ether')
+        # Contracts deployed elsewhere only have an expected address
+        to_send = {k: v for k, v in deploy_todo.items() if 'tx' in v}
+        max_fees_formatted = Web3.from_wei(sum([_['max_fee'] for _ in to_send.values()]), 'ether')
         if not self.yes:
             try:
                 ok = input('Max deploy fees total %s, continue? [Y/n] ' % (max_fees_formatted,))
@@ -224,7 +231,10 @@ class CmdDeploy(Cmd):
         else:
             LOGGER.debug('Cumulative maximum deploy fee: %s', max_fees_formatted)
 
-        for contract_name, v in deploy_todo.items():
+        if self.pipeline:
+            return self._deploy_pipelined(to_send, contract_info)
+
+        for contract_name, v in to_send.items():
             # Support retries, for whatever reason
             while True:
                 time_start = time()
@@ -233,7 +243,6 @@ class CmdDeploy(Cmd):
                             contract_name, tx_id.hex(),
                             (len(v['tx']['data']) - 2) / 2 / 1024.0)
                 receipt = self.web3.eth.wait_for_transaction_receipt(tx_id)
-                time_end = time()
 
                 if receipt['status'] != 1:
                     # When transaction fails, show receipt and ask to continue?
@@ -249,28 +258,79 @@ class CmdDeploy(Cmd):
                         sleep(sleep_time)
                 break
 
-            if receipt['contractAddress'] != v['expected_address']:
-                LOGGER.error('%s contract address mismatch, expected:%s actual:%s',
-                             contract_name, v['expected_address'], receipt['contractAddress'])
+            if not self._deployed(contract_name, v, tx_id, time_start, receipt, contract_info):
                 return __LINE__()
 
-            di: DeployedInfo = {
-                'tx_id': tx_id.hex(),
-                'time_start': time_start,    # Keep track of how long the deploy transaction takes to be mined
-                'time_end': time_end,
-                'receipt': receipt,
-                'effective_gas_price': receipt.get('effectiveGasPrice', DEFAULT_GAS_PRICE)
-            }
-            v['deployed'] = di
-            self.dcim.update(contract_name, v)
-            contract_info[contract_name] = v
+        return 0
 
-            # Log details about deploy transaction
-            LOGGER.info('%s block:%d gas:%d cost:%s waited:%.02fs',
-                        contract_name,
-                        receipt['blockNumber'],
-                        receipt['gasUsed'],
-                        Web3.from_wei(receipt['gasUsed'] * di['effective_gas_price'], 'ether'),
-                        round(di['time_end'] - di['time_start'],2))
+    def _deploy_pipelined(self, to_send:dict[CONTRACT_NAME_T,ContractInfo],
+                          contract_info:dict[CONTRACT_NAME_T,ContractInfo]) -> int:
+        """
+        Broadcast every deploy transaction back-to-back, each with the nonce
+        its expected address was computed from, so they're all mined in
+        about one block. Receipts are awaited concurrently and each contract
+        is persisted as soon as it confirms.
+        """
+        sent: dict[CONTRACT_NAME_T,tuple[HexBytes,float]] = {}
+        for contract_name, v in to_send.items():
+            tx: TxParams = {**v['tx'], 'nonce': Nonce(v['account_nonce'])}
+            try:
+                sent[contract_name] = (self.web3.eth.send_transaction(tx), time())
+            except Exception as ex:
+                # Later nonces can't be mined after a gap, stop sending but wait for those already sent
+                LOGGER.error('%s send failed: %s', contract_name, ex)
+                break
+            LOGGER.info('%s tx:%s nonce:%d size:%.2fkb',
+                        contract_name, sent[contract_name][0].hex(), v['account_nonce'],
+                        (len(v['tx']['data']) - 2) / 2 / 1024.0)
 
-        return 0
+        ok = len(sent) == len(to_send)
+        with ThreadPoolExecutor(max(1, len(sent))) as pool:
+            futures = {pool.submit(self.web3.eth.wait_for_transaction_receipt, tx_id): name
+                       for name, (tx_id, _) in sent.items()}
+            for future in as_completed(futures):
+                contract_name = futures[future]
+                tx_id, time_start = sent[contract_name]
+                try:
+                    receipt: TxReceipt = future.result()
+                except Exception as ex:
+                    LOGGER.error('%s receipt not found: %s', contract_name, ex)
+                    ok = False
+                    continue
+                if receipt['status'] != 1:
+                    LOGGER.error('%s error while deploying!', contract_name)
+                    print(receipt)
+                    ok = False
+                    continue
+                if not self._deployed(contract_name, to_send[contract_name], tx_id, time_start, receipt, contract_info):
+                    ok = False
+        return 0 if ok else __LINE__()
+
+    def _deployed(self, contract_name:CONTRACT_NAME_T, v:ContractInfo, tx_id:HexBytes, time_start:float,
+                  receipt:TxReceipt, contract_info:dict[CONTRACT_NAME_T,ContractInfo]) -> bool:
+        """Persist a confirmed deployment, False if it isn't at the expected address"""
+        time_end = time()
+        if receipt['contractAddress'] != v['expected_address']:
+            LOGGER.error('%s contract address mismatch, expected:%s actual:%s',
+                         contract_name, v['expected_address'], receipt['contractAddress'])
+            return False
+
+        di: DeployedInfo = {
+            'tx_id': tx_id.hex(),
+            'time_start': time_start,    # Keep track of how long the deploy transaction takes to be mined
+            'time_end': time_end,
+            'receipt': receipt,
+            'effective_gas_price': receipt.get('effectiveGasPrice', DEFAULT_GAS_PRICE)
+        }
+        v['deployed'] = di
+        self.dcim.update(contract_name, v)
+        contract_info[contract_name] = v
+
+        # Log details about deploy transaction
+        LOGGER.info('%s block:%d gas:%d cost:%s waited:%.02fs',
+                    contract_name,
+                    receipt['blockNumber'],
+                    receipt['gasUsed'],
+                    fee_ether(receipt['gasUsed'], di['effective_gas_price']),
+                    round(di['time_end'] - di['time_start'],2))
+        return True
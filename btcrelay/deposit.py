@@ -3,11 +3,76 @@
 from os import urandom
 from time import sleep
 from argparse import ArgumentParser
+from typing import Optional, Protocol, Sequence
 
 from bitcoinutils.keys import P2pkhAddress
+from web3.contract.contract import Contract
 
 from .cmd import Cmd
-from .constants import LOGGER, __LINE__
+from .bitcoin import (
+    double_sha256,
+    bytes2revhex,
+    hex2revbytes,
+    parse_txoutproof,
+    tx_strip_witness,
+    verify_tx_proof,
+    MerkleProofError
+)
+from .multicall import Multicall
+from .constants import LOGGER, DEFAULT_DERIVE_BATCH, __LINE__
+
+# pubkeyAddress, keypairId, epoch, minConfirmations
+DERIVED_T = tuple[bytes,bytes,int,int]
+
+
+class DeriveRequest(Protocol):
+    owner: str
+    seed: bytes
+    epoch: Optional[int]
+
+
+def current_epoch(d:Contract, owner:str) -> int:
+    """Current derive epoch, from the `derive` view so the deriving key isn't rotated"""
+    return int(d.functions.derive(owner, bytes(32)).call()[2])
+
+
+def derive_many(d:Contract, multicall:Optional[Multicall], requests:Sequence[DeriveRequest],
+                batch:int=DEFAULT_DERIVE_BATCH) -> list[Optional[DERIVED_T]]:
+    """
+    Deposit addresses for many (owner, seed, epoch), `batch` per Multicall3
+    eth_call. None for those which failed to derive.
+
+    Requests without an epoch use the current one, read once up front. Every
+    createDerived* call rotates the deriving key when it is old, so within one
+    simulated Multicall3 eth_call the first call would move later ones to an
+    epoch whose secret is discarded when the simulation ends.
+    """
+    epoch: Optional[int] = None
+    if any(_.epoch is None for _ in requests):
+        epoch = current_epoch(d, requests[0].owner)
+    epochs = [epoch if _.epoch is None else _.epoch for _ in requests]
+    fns = [d.functions.createDerived(request.owner, request_epoch, request.seed)
+           for request, request_epoch in zip(requests, epochs)]
+    results: list[Optional[DERIVED_T]] = []
+    for offset in range(0, len(fns), batch):
+        chunk = fns[offset:offset+batch]
+        if multicall is not None:
+            outputs = multicall.call(chunk)
+        else:
+            outputs = []
+            for fn in chunk:
+                try:
+                    outputs.append(fn.call())
+                except Exception as ex:
+                    LOGGER.warning('Derive failed: %s', ex)
+                    outputs.append(None)
+        for request_epoch, output in zip(epochs[offset:offset+batch], outputs):
+            if output is None:
+                results.append(None)
+            else:
+                assert request_epoch is not None
+                results.append((output[0], output[1], request_epoch, int(output[2])))
+    return results
 
 
 class CmdDeposit(Cmd):
@@ -102,8 +167,17 @@ class CmdDeposit(Cmd):
                 print()
                 return
         print()
-        proof = self.poly.gettxoutproof([txid])
-        print('Proof', proof)
+        txoutproof = self.poly.gettxoutproof([txid])
+        try:
+            proof, = parse_txoutproof(txoutproof)
+            proof['rawTx'] = tx_strip_witness(self.poly.getrawtransaction(hex2revbytes(txid)))
+            verify_tx_proof(proof)
+        except (ValueError, MerkleProofError) as ex:
+            print('Error! Invalid proof:', ex)
+            return __LINE__()
+        print('   Block:', bytes2revhex(double_sha256(proof['blockHeader'])))
+        print('   Index:', proof['txIndex'])
+        print('   Proof:', proof['txMerkleProof'].hex())
 
         # TODO: wait for transaction to be confirmed
 
@@ -0,0 +1,685 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import sys
+import json
+from time import sleep
+from queue import Queue, Empty
+from threading import Thread, Event
+from argparse import ArgumentParser
+from typing import Any, NotRequired, Optional, TextIO, TypedDict
+
+from web3.types import TxReceipt
+from web3.contract.contract import Contract
+
+from .cmd import Cmd
+from .apis.poly import PolyAPI
+from .bitcoin import (
+    bytes2revhex,
+    hex2revbytes,
+    btc_tx_proof_args,
+    merkle_build,
+    p2pkh_script,
+    tx_outputs,
+    block_transactions,
+    verify_tx_proof,
+    MerkleProofError
+)
+from .deposit import derive_many
+from .multicall import Multicall, multicall_instance
+from .relaystate import RelayStateReader
+from .submitter import PipelinedSubmitter, PendingTx
+from .gasmodel import GasModel
+from .notify import BlockNotifications, notifier_from_spec
+from .metrics import serve_metrics, dump_metrics, DEPOSITS, DEPOSITS_PENDING, DEPOSIT_GAS, DEPOSIT_GAS_SAVED
+from .constants import (
+    LOGGER,
+    DEFAULT_SLEEP_TIME,
+    DEFAULT_DATA_DIR,
+    DEFAULT_REORG_WINDOW,
+    DEFAULT_MAX_INFLIGHT,
+    DEFAULT_SUBMIT_POLL_TIME,
+    DEFAULT_DEPOSIT_ATTEMPTS,
+    DEFAULT_DEPOSIT_SCAN_BATCH,
+    DEFAULT_DEPOSIT_BATCH,
+    DEFAULT_DEPOSIT_GAS_BASE,
+    DEFAULT_DEPOSIT_GAS_PER_DEPOSIT,
+    __LINE__
+)
+
+OUTPOINT_T = tuple[bytes,int]
+
+
+class DepositRecord(TypedDict):
+    """
+    One line of a `--deposits` file. `epoch` is printed by `deposit` when the
+    address is created, without it the current derive epoch is assumed.
+    Without `txid` & `vout` the first output paying the deposit address is
+    used.
+    """
+    owner: str
+    seed: str
+    txid: NotRequired[str]
+    vout: NotRequired[int]
+    epoch: NotRequired[int]
+
+
+class PendingDeposit:
+    """A deposit being tracked, from its record until `depositDerived` confirms"""
+    __slots__ = ('owner', 'seed', 'txid', 'vout', 'by_address', 'epoch', 'keypairId', 'pubkeyhash',
+                 'minConfirmations', 'height', 'blockhash', 'attempts')
+    owner: str
+    seed: bytes
+    txid: Optional[bytes]
+    vout: Optional[int]
+    by_address: bool
+    epoch: Optional[int]
+    keypairId: Optional[bytes]
+    pubkeyhash: Optional[bytes]
+    minConfirmations: int
+    height: Optional[int]
+    blockhash: Optional[bytes]
+    attempts: int
+
+    def __init__(self, owner:str, seed:bytes, txid:Optional[bytes]=None, vout:Optional[int]=None,
+                 epoch:Optional[int]=None):
+        if len(seed) != 32:
+            raise ValueError('seed wrong length! Must be 32 bytes')
+        if (txid is None) != (vout is None):
+            raise ValueError('txid and vout must be given together')
+        self.owner = owner
+        self.seed = seed
+        self.txid = txid
+        self.vout = vout
+        # Matched by the script paying its address, the outpoint is found when scanning
+        self.by_address = txid is None
+        self.epoch = epoch
+        self.keypairId = None
+        self.pubkeyhash = None
+        self.minConfirmations = 0
+        self.height = None
+        self.blockhash = None
+        self.attempts = 0
+
+    @classmethod
+    def from_record(cls, record:DepositRecord) -> 'PendingDeposit':
+        txid = record.get('txid')
+        vout = record.get('vout')
+        return cls(record['owner'], bytes.fromhex(record['seed'].removeprefix('0x')),
+                   hex2revbytes(txid) if txid is not None else None,
+                   int(vout) if vout is not None else None, record.get('epoch'))
+
+    @property
+    def outpoint(self) -> Optional[OUTPOINT_T]:
+        if self.txid is None or self.vout is None:
+            return None
+        return (self.txid, self.vout)
+
+    @property
+    def script(self) -> bytes:
+        assert self.pubkeyhash is not None
+        return p2pkh_script(self.pubkeyhash)
+
+    def __repr__(self) -> str:
+        if self.txid is None:
+            return f'to {self.pubkeyhash.hex() if self.pubkeyhash else self.seed.hex()}'
+        return f'{bytes2revhex(self.txid)}:{self.vout}'
+
+
+class DepositJournal:
+    """
+    Append-only JSON lines file of deposits which are finished with, either
+    deposited or failed, so a restarted watcher doesn't submit them again.
+    Keyed by outpoint and keypair, a keypair only takes one deposit.
+    """
+    path: str
+    done: dict[OUTPOINT_T|bytes,str]
+
+    def __init__(self, path:str):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as handle:
+                for line in handle:
+                    if line.strip():
+                        row = json.loads(line)
+                        if row.get('txid') is not None:
+                            self.done[(hex2revbytes(row['txid']), row['vout'])] = row['status']
+                        if row.get('keypairId') is not None:
+                            self.done[bytes.fromhex(row['keypairId'])] = row['status']
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._handle = open(path, 'a')
+
+    def is_done(self, deposit:PendingDeposit) -> bool:
+        return deposit.outpoint in self.done or deposit.keypairId in self.done
+
+    def record(self, deposit:PendingDeposit, status:str, **extra:Any) -> None:
+        outpoint = deposit.outpoint
+        if outpoint is not None:
+            self.done[outpoint] = status
+        if deposit.keypairId is not None:
+            self.done[deposit.keypairId] = status
+        DEPOSITS.inc(status=status)
+        row = {'txid': bytes2revhex(deposit.txid) if deposit.txid else None, 'vout': deposit.vout,
+               'owner': deposit.owner, 'keypairId': deposit.keypairId.hex() if deposit.keypairId else None,
+               'status': status, **extra}
+        self._handle.write(json.dumps(row) + '\n')
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+
+
+def read_records(paths:list[str], queue:Queue, follow:bool, stop:Event, loaded:Event) -> None:
+    """
+    Queue deposit records from JSON lines files, or stdin for `-`. With
+    `follow` files are tailed for new records, like `tail -f`. `loaded` is
+    set once every file has been read to its end at least once.
+    """
+    handles: list[TextIO] = [sys.stdin if _ == '-' else open(_) for _ in paths]
+    unread = set(handles)
+    while handles and not stop.is_set():
+        idle = True
+        for handle in list(handles):
+            line = handle.readline()
+            if not line:
+                unread.discard(handle)
+                if not unread:
+                    loaded.set()
+                if handle is sys.stdin or not follow:
+                    handles.remove(handle)
+                continue
+            idle = False
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                queue.put(PendingDeposit.from_record(json.loads(line)))
+            except (ValueError, KeyError, TypeError) as ex:
+                LOGGER.error('Invalid deposit record %r: %s', line, ex)
+        if idle and handles:
+            stop.wait(1)
+    loaded.set()
+
+
+class DepositWatcher:
+    """
+    Tracks many deposits at once. New deposits are derived in bulk through
+    Multicall3 and looked up with one `gettxout` batch. Those not yet mined
+    are indexed by txid, or by the P2PKH script paying their address, and
+    found by scanning each new block once: O(transactions) or O(outputs) per
+    block however many deposits are pending. Addresses already paid before
+    the watcher started are found by one `scantxoutset`, see `scan_utxos`.
+
+    Located deposits are submitted with `depositDerived` once the relay has
+    `minConfirmations` on top of their block, and has the same block at
+    that height. Proofs for deposits in the same block share its merkle
+    tree, and with Multicall3 ready deposits are sent up to `batch_size`
+    per `aggregate3` transaction. A reorg puts deposits whose block is no
+    longer in the chain back to waiting.
+    """
+    poly: PolyAPI
+    deposit: Contract
+    multicall: Optional[Multicall]
+    reader: RelayStateReader
+    submitter: PipelinedSubmitter
+    journal: DepositJournal
+    waiting: dict[bytes,list[PendingDeposit]]
+    scripts: dict[bytes,PendingDeposit]
+    located: dict[bytes,list[PendingDeposit]]
+    inflight: dict[PendingTx,list[PendingDeposit]]
+    batch_size: int
+    single_gas: Optional[float]
+    tracked: set[bytes]
+    scan_height: Optional[int]
+    scan_hash: Optional[bytes]
+    rescan_height: Optional[int]
+
+    def __init__(self, poly:PolyAPI, deposit:Contract, multicall:Optional[Multicall],
+                 reader:RelayStateReader, submitter:PipelinedSubmitter, journal:DepositJournal,
+                 batch_size:int=DEFAULT_DEPOSIT_BATCH):
+        self.poly = poly
+        self.deposit = deposit
+        self.multicall = multicall
+        self.reader = reader
+        self.submitter = submitter
+        self.journal = journal
+        self.waiting = {}
+        self.scripts = {}
+        self.located = {}
+        self.inflight = {}
+        self.batch_size = batch_size
+        self.single_gas = None
+        self.tracked = set()
+        self.scan_height = None
+        self.scan_hash = None
+        # Lowest height the next scan must start from, for deposits mined below it
+        self.rescan_height = None
+
+    def pending(self) -> int:
+        return len(self.tracked)
+
+    def _finish(self, deposit:PendingDeposit, status:str, **extra:Any) -> None:
+        self.tracked.discard(deposit.keypairId)
+        self.journal.record(deposit, status, **extra)
+
+    def _fail(self, deposit:PendingDeposit, reason:str) -> None:
+        LOGGER.error('Deposit %s failed: %s', deposit, reason)
+        self._finish(deposit, 'failed', reason=reason)
+
+    def _wait_for(self, deposit:PendingDeposit) -> None:
+        deposit.height = deposit.blockhash = None
+        if deposit.by_address:
+            deposit.txid = deposit.vout = None
+            self.scripts[deposit.script] = deposit
+        else:
+            assert deposit.txid is not None
+            self.waiting.setdefault(deposit.txid, []).append(deposit)
+
+    def _locate(self, deposit:PendingDeposit, height:int, blockhash:bytes) -> None:
+        deposit.height = height
+        deposit.blockhash = blockhash
+        self.located.setdefault(blockhash, []).append(deposit)
+        LOGGER.info('Deposit %s found in block %d', deposit, height)
+
+    def scan_utxos(self) -> None:
+        """
+        Locate deposits to addresses which were paid before they were being
+        watched. This is a scan of the whole UTXO set, so it's done once
+        after the initial deposit records are read, and not every provider
+        allows it; then only payments in new blocks are found.
+        """
+        deposits = [_ for _ in self.scripts.values() if _.by_address]
+        if not deposits:
+            return
+        try:
+            result = self.poly.scantxoutset([_.script for _ in deposits])
+        except Exception as ex:
+            LOGGER.warning('Unable to scan UTXO set for %d deposit addresses, only new blocks will be watched: %s',
+                           len(deposits), ex)
+            return
+        found: dict[bytes,tuple[bytes,int,int]] = {}
+        for utxo in sorted(result.get('unspents', []), key=lambda _: _['height']):
+            found.setdefault(bytes.fromhex(utxo['scriptPubKey']),
+                             (hex2revbytes(utxo['txid']), utxo['vout'], utxo['height']))
+        heights = sorted({height for _, _, height in found.values()})
+        hashes = dict(zip(heights, self.poly.heights2hashes(heights)))
+        for script, (txid, vout, height) in found.items():
+            deposit = self.scripts.pop(script, None)
+            if deposit is not None:
+                deposit.txid, deposit.vout = txid, vout
+                self._locate(deposit, height, hashes[height])
+        LOGGER.info('Found %d of %d deposit addresses already paid', len(found), len(deposits))
+
+    def add(self, deposits:list[PendingDeposit]) -> None:
+        """Start tracking deposits, those already mined are located immediately"""
+        new = [_ for _ in deposits if not self.journal.is_done(_)]
+        if not new:
+            return
+
+        # Everything is read before anything is tracked, so a failed round trip can be retried
+        derived = derive_many(self.deposit, self.multicall, new)
+        failed: list[tuple[PendingDeposit,str]] = []
+        unique: dict[bytes,PendingDeposit] = {}
+        for deposit, result in zip(new, derived):
+            if result is None:
+                failed.append((deposit, 'derive'))
+                continue
+            deposit.pubkeyhash, deposit.keypairId, deposit.epoch, deposit.minConfirmations = result
+            if deposit.keypairId not in self.tracked and not self.journal.is_done(deposit):
+                unique.setdefault(deposit.keypairId, deposit)
+        new = list(unique.values())
+        by_txid = [_ for _ in new if not _.by_address]
+        tip = self.poly.height()
+        tip_hash = self.poly.height2hash(tip)
+        txouts = self.poly.gettxouts([o for o in (_.outpoint for _ in by_txid) if o is not None])
+
+        found: list[tuple[PendingDeposit,int]] = []
+        waiting: list[PendingDeposit] = [_ for _ in new if _.by_address]
+        rescan: list[int] = []
+        for deposit, txout in zip(by_txid, txouts):
+            # Unspent outputs which are already mined, others wait for their block
+            if txout is None or not txout['confirmations']:
+                waiting.append(deposit)
+            elif hex2revbytes(txout['bestblock']) != tip_hash:
+                # The tip moved during the lookup, its block is re-scanned from about where it was mined
+                waiting.append(deposit)
+                rescan.append(tip - txout['confirmations'] + 1)
+            elif deposit.script != bytes.fromhex(txout['scriptPubKey']['hex']):
+                failed.append((deposit, 'WRONG_RECIPIENT'))
+            else:
+                found.append((deposit, tip - txout['confirmations'] + 1))
+        heights = sorted({h for _, h in found})
+        hashes = dict(zip(heights, self.poly.heights2hashes(heights)))
+
+        self.tracked.update(unique)
+        for deposit, reason in failed:
+            self._fail(deposit, reason)
+        for deposit in waiting:
+            self._wait_for(deposit)
+        for deposit, height in found:
+            self._locate(deposit, height, hashes[height])
+        if rescan:
+            height = max(0, min(rescan) - DEFAULT_REORG_WINDOW)
+            self.rescan_height = height if self.rescan_height is None else min(self.rescan_height, height)
+        LOGGER.info('Tracking %d new deposits, %d already mined', len(new), len(found))
+        DEPOSITS_PENDING.set(self.pending())
+
+    def _scan_txids(self, height:int, blockhash:bytes) -> None:
+        """Only txids are needed, from the block's merkle tree"""
+        tree = self.poly.merkletree(blockhash)
+        waiting = self.waiting
+        for txid in [_ for _ in tree.txids() if _ in waiting]:
+            outputs = tx_outputs(self.poly.getrawtransaction(txid, blockhash))
+            self._match_txid(height, blockhash, txid, outputs)
+
+    def _match_txid(self, height:int, blockhash:bytes, txid:bytes, outputs:list[tuple[int,bytes]]) -> None:
+        for deposit in self.waiting.pop(txid):
+            assert deposit.vout is not None
+            if deposit.vout >= len(outputs) or deposit.script != outputs[deposit.vout][1]:
+                self._fail(deposit, 'WRONG_RECIPIENT')
+            else:
+                self._locate(deposit, height, blockhash)
+
+    def _scan_outputs(self, height:int, blockhash:bytes) -> None:
+        """Every output of the block, from the raw block, against the script index"""
+        raw = self.poly.getblockraw(blockhash)
+        transactions = list(block_transactions(raw))
+        if merkle_build([txid for txid, _ in transactions]) != raw[36:68]:
+            raise MerkleProofError(f'Block {bytes2revhex(blockhash)} transactions do not match merkle root')
+        waiting, scripts = self.waiting, self.scripts
+        for txid, outputs in transactions:
+            if txid in waiting:
+                self._match_txid(height, blockhash, txid, outputs)
+            for vout, (_, script) in enumerate(outputs):
+                deposit = scripts.pop(script, None)
+                if deposit is not None:
+                    deposit.txid, deposit.vout = txid, vout
+                    self._locate(deposit, height, blockhash)
+
+    def _unlocate(self, blockhashes:set[bytes]) -> None:
+        """Blocks which are no longer in the chain, their deposits wait to be mined again"""
+        for blockhash in blockhashes:
+            for deposit in self.located.pop(blockhash, []):
+                LOGGER.warning('Deposit %s block %s was reorganized out', deposit, bytes2revhex(blockhash))
+                self._wait_for(deposit)
+
+    def scan(self) -> int:
+        """Scan blocks since the last scan for waiting deposits, returns the tip height"""
+        tip = self.poly.height()
+
+        # Reorg: re-scan recent blocks, and check the blocks of located deposits
+        if self.scan_height is not None and self.poly.height2hash(self.scan_height) != self.scan_hash:
+            LOGGER.info('Chain reorganized below height %d, re-scanning', self.scan_height)
+            self.scan_height -= DEFAULT_REORG_WINDOW
+        located = [(_[0].height, h) for h, _ in self.located.items() if _[0].height is not None]
+        if located:
+            heights = sorted({height for height, _ in located})
+            current = dict(zip(heights, self.poly.heights2hashes(heights)))
+            self._unlocate({h for height, h in located if current[height] != h})
+
+        start = tip if self.scan_height is None else self.scan_height + 1
+        if self.rescan_height is not None:
+            start = min(start, self.rescan_height)
+        for offset in range(start, tip + 1, DEFAULT_DEPOSIT_SCAN_BATCH):
+            heights = list(range(offset, min(tip, offset + DEFAULT_DEPOSIT_SCAN_BATCH - 1) + 1))
+            hashes = self.poly.heights2hashes(heights)
+            # Nothing to look for, blocks don't need fetching
+            for height, blockhash in zip(heights, hashes):
+                if self.scripts:
+                    self._scan_outputs(height, blockhash)
+                elif self.waiting:
+                    self._scan_txids(height, blockhash)
+            self.scan_height, self.scan_hash = heights[-1], hashes[-1]
+        self.rescan_height = None
+        return tip
+
+    def submit(self) -> None:
+        """Submit deposits which the relay has confirmed, one proof per deposit"""
+        if self.submitter.failed:
+            # Later transactions revert too, drain them before sending more
+            self.receipts(self.submitter.wait_all())
+        if not self.located:
+            return
+        state = self.reader.read()
+        ready = [(blockhash, deposits) for blockhash, deposits in self.located.items()
+                 if deposits[0].height is not None
+                 and (state.height + 1) >= (deposits[0].height + max(_.minConfirmations for _ in deposits))]
+        if not ready:
+            return
+        heights = [deposits[0].height for _, deposits in ready]
+        missing = [h for h in heights if h is not None and h not in state.hashes]
+        if missing:
+            state.hashes.update(zip(missing, self.reader.hashes(missing)))
+
+        calls: list[tuple[PendingDeposit,Any]] = []
+        taken: list[PendingDeposit] = []
+        try:
+            for blockhash, deposits in ready:
+                height = deposits[0].height
+                assert height is not None
+                if state.hashes.get(height) != blockhash:
+                    LOGGER.debug('Relay has a different block at height %d, waiting', height)
+                    continue
+                # Located deposits know their outpoint
+                proofs = self.poly.txproofs(blockhash, [_.txid for _ in deposits if _.txid is not None])
+                del self.located[blockhash]
+                taken += deposits
+                for deposit, proof in zip(deposits, proofs):
+                    try:
+                        verify_tx_proof(proof, blockhash)
+                    except MerkleProofError as ex:
+                        self._fail(deposit, str(ex))
+                        continue
+                    calls.append((deposit, self.deposit.functions.depositDerived(
+                        deposit.owner, deposit.epoch, deposit.seed, height,
+                        btc_tx_proof_args(proof), deposit.vout, deposit.keypairId)))
+
+            # Deposits from a batch which reverted are retried on their own
+            batching = self.multicall is not None and self.batch_size > 1
+            batched = [_ for _ in calls if batching and not _[0].attempts]
+            for deposit, fn in calls:
+                if not batching or deposit.attempts:
+                    self._send([deposit], fn)
+            for offset in range(0, len(batched), self.batch_size):
+                self._send_batch(batched[offset:offset+self.batch_size])
+        except Exception:
+            self._restore(taken)
+            raise
+
+    def _send_batch(self, calls:list[tuple[PendingDeposit,Any]]) -> None:
+        """
+        One `aggregate3` transaction for many deposits. It's simulated first
+        and deposits which would fail are sent on their own, the transaction
+        doesn't allow failures so its receipt is the status of every deposit.
+        """
+        assert self.multicall is not None
+        if len(calls) > 1:
+            simulated = self.multicall.call([fn for _, fn in calls])
+            for (deposit, fn), result in zip(calls, simulated):
+                if result is None:
+                    LOGGER.debug('Deposit %s fails in simulation, sending alone', deposit)
+                    self._send([deposit], fn)
+            calls = [call for call, result in zip(calls, simulated) if result is not None]
+        if len(calls) <= 1:
+            for deposit, fn in calls:
+                self._send([deposit], fn)
+            return
+        if self.single_gas is None:
+            # Baseline for the gas saved, until single deposits have been mined
+            try:
+                self.single_gas = float(calls[0][1].estimate_gas())
+            except Exception as ex:
+                LOGGER.debug('Unable to estimate single deposit gas: %s', ex)
+        self._send([_ for _, _fn in calls], self.multicall.aggregate3([fn for _, fn in calls]))
+
+    def _send(self, deposits:list[PendingDeposit], fn:Any) -> None:
+        self.receipts(self.submitter.wait_slot())
+        for deposit in deposits:
+            deposit.attempts += 1
+        try:
+            pending = self.submitter.send(fn, len(deposits))
+        except Exception as ex:
+            # Reverts in gas estimation, e.g. the relay reorganized or it was already deposited
+            LOGGER.warning('Deposit %s not sent: %s', ', '.join(map(repr, deposits)), ex)
+            pending = None
+        if pending is None:
+            for deposit in deposits:
+                self._retry(deposit)
+            return
+        self.inflight[pending] = deposits
+
+    def _restore(self, deposits:list[PendingDeposit]) -> None:
+        """
+        After an error part way through submitting, deposits which weren't
+        sent, finished or located again go back to being located
+        """
+        inflight = {id(_) for sent in self.inflight.values() for _ in sent}
+        for deposit in deposits:
+            assert deposit.blockhash is not None
+            located = self.located.get(deposit.blockhash, [])
+            if id(deposit) in inflight or deposit.keypairId not in self.tracked \
+                    or any(_ is deposit for _ in located):
+                continue
+            self.located.setdefault(deposit.blockhash, []).append(deposit)
+
+    def _retry(self, deposit:PendingDeposit) -> None:
+        if deposit.attempts >= DEFAULT_DEPOSIT_ATTEMPTS:
+            self._fail(deposit, 'attempts')
+        else:
+            assert deposit.height is not None and deposit.blockhash is not None
+            self._locate(deposit, deposit.height, deposit.blockhash)
+
+    def receipts(self, done:list[tuple[PendingTx,TxReceipt]]) -> None:
+        for pending, receipt in done:
+            deposits = self.inflight.pop(pending)
+            txid = receipt['transactionHash'].hex()
+            if receipt['status'] != 1:
+                LOGGER.warning('Deposit %s reverted, tx %s', ', '.join(map(repr, deposits)), txid)
+                for deposit in deposits:
+                    self._retry(deposit)
+                continue
+            gas = receipt['gasUsed'] / len(deposits)
+            if len(deposits) == 1:
+                DEPOSIT_GAS.observe(gas, mode='single')
+                self.single_gas = gas if self.single_gas is None else (self.single_gas * 0.8) + (gas * 0.2)
+                LOGGER.info('Deposited %s, gas %d tx %s', deposits[0], receipt['gasUsed'], txid)
+            else:
+                DEPOSIT_GAS.observe(gas, mode='batch')
+                if self.single_gas is not None:
+                    DEPOSIT_GAS_SAVED.inc(max(0.0, self.single_gas - gas) * len(deposits))
+                    LOGGER.info('Deposited %d in one batch, gas %d (%d per deposit, %d saved per deposit vs one-by-one) tx %s',
+                                len(deposits), receipt['gasUsed'], gas, self.single_gas - gas, txid)
+                else:
+                    LOGGER.info('Deposited %d in one batch, gas %d (%d per deposit) tx %s',
+                                len(deposits), receipt['gasUsed'], gas, txid)
+            for deposit in deposits:
+                self._finish(deposit, 'deposited', tx=txid, height=deposit.height)
+        if done:
+            DEPOSITS_PENDING.set(self.pending())
+
+
+class CmdDepositWatchd(Cmd):
+    deposits: list[str]
+    follow: bool
+    state_file: Optional[str]
+    max_inflight: int
+    batch: int
+    notify: Optional[list[str]]
+    metrics_port: Optional[int]
+    metrics_file: Optional[str]
+
+    @classmethod
+    def setup(cls, parser:ArgumentParser) -> None:
+        super().setup(parser)
+        parser.add_argument('--deposits', metavar='path', action='append', required=True,
+                            help='JSON lines of {"owner", "seed", "txid", "vout", "epoch"}, - for stdin, may be repeated. '
+                                 'Without txid & vout the deposit address is watched for a payment')
+        parser.add_argument('--follow', action='store_true',
+                            help='Keep reading deposits appended to the files')
+        parser.add_argument('--state-file', metavar='path',
+                            help='Journal of finished deposits (default: $BTCRELAY_DATADIR/<chain>.deposits)')
+        parser.add_argument('-n', '--max-inflight', metavar='n', type=int,
+                            default=DEFAULT_MAX_INFLIGHT,
+                            help='Maximum number of deposit transactions in-flight')
+        parser.add_argument('--batch', metavar='n', type=int, default=DEFAULT_DEPOSIT_BATCH,
+                            help='Deposits per Multicall3 aggregate3 transaction, 1 sends them one-by-one (default: %(default)s)')
+        parser.add_argument('--notify', metavar='source', action='append',
+                            help='Wake on new blocks from zmq:tcp://host:port, rpc, ws[:url] or poll[:seconds], '
+                                 'may be repeated. Polls every %d seconds otherwise' % DEFAULT_SLEEP_TIME)
+        parser.add_argument('--metrics-port', metavar='port', type=int,
+                            help='Serve Prometheus metrics over HTTP on this port')
+        parser.add_argument('--metrics-file', metavar='path',
+                            help='Periodically write Prometheus metrics to this file')
+
+    def __call__(self) -> int:
+        sleep_time = 5 if self.chain == 'btc-regtest' else DEFAULT_SLEEP_TIME
+        if not self.dcim.is_deployed('BTCDeposit'):
+            LOGGER.error('BTCDeposit is not deployed on %s', self.sapphire)
+            return __LINE__()
+        relay = self.dcim.contract_instance(self.dcim.relay_name(), self.web3)
+        multicall = multicall_instance(self.dcim, self.web3)
+        watcher = DepositWatcher(
+            self.poly,
+            self.dcim.contract_instance('BTCDeposit', self.web3),
+            multicall,
+            RelayStateReader(relay, multicall),
+            PipelinedSubmitter(self.web3, self.key.address, self.max_inflight,
+                               gas_model=GasModel(DEFAULT_DEPOSIT_GAS_BASE, DEFAULT_DEPOSIT_GAS_PER_DEPOSIT, 0)),
+            DepositJournal(self.state_file or os.path.join(DEFAULT_DATA_DIR, f'{self.chain}.deposits')),
+            self.batch)
+
+        stop = Event()
+        loaded = Event()
+        queue: Queue[PendingDeposit] = Queue()
+        reader = Thread(target=read_records, args=(self.deposits, queue, self.follow, stop, loaded),
+                        name='deposit-records', daemon=True)
+        reader.start()
+
+        notifications = BlockNotifications([notifier_from_spec(_, self.chain, self.poly)
+                                            for _ in self.notify or []])
+        notifications.start()
+        if self.metrics_port is not None:
+            serve_metrics(self.metrics_port)
+        if self.metrics_file:
+            dump_metrics(self.metrics_file)
+
+        utxos_scanned = False
+        try:
+            while True:
+                # Deposits read before this drain are all queued once the files are loaded
+                ready = loaded.is_set()
+                new: list[PendingDeposit] = []
+                try:
+                    while True:
+                        new.append(queue.get_nowait())
+                except Empty:
+                    pass
+                try:
+                    if new:
+                        watcher.add(new)
+                    if ready and not utxos_scanned:
+                        watcher.scan_utxos()
+                        utxos_scanned = True
+                    watcher.scan()
+                    watcher.submit()
+                    watcher.receipts(watcher.submitter.poll())
+                except Exception as ex:
+                    LOGGER.exception('Deposit watcher error, retrying', exc_info=ex)
+                    for deposit in new:
+                        if deposit.keypairId not in watcher.tracked:
+                            queue.put(deposit)
+                    sleep(sleep_time)
+                    continue
+
+                if not reader.is_alive() and queue.empty() and not watcher.pending():
+                    LOGGER.info('All deposits finished')
+                    break
+                if watcher.inflight:
+                    sleep(DEFAULT_SUBMIT_POLL_TIME)
+                elif notifications.wait(sleep_time if queue.empty() else 0):
+                    LOGGER.debug('Woken by block notification: %s', notifications.summary())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            notifications.stop()
+        return 0
@@ -0,0 +1,227 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import csv
+import json
+import random
+from os import urandom
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Literal, Optional, TextIO, TypedDict
+
+from bitcoinutils.keys import P2pkhAddress
+from web3.contract.contract import Contract
+
+from .cmd import Cmd
+from .deposit import derive_many, DERIVED_T
+from .multicall import Multicall, multicall_instance
+from .constants import LOGGER, DEFAULT_DERIVE_BATCH, DEFAULT_DERIVE_CONCURRENCY, __LINE__
+
+FORMAT_T = Literal['csv', 'jsonl']
+
+
+class DerivedAddress(TypedDict):
+    """One output record, the JSON lines form is also a `deposit-watchd --deposits` record"""
+    owner: str
+    seed: str
+    keypairId: str
+    epoch: int
+    address: str
+
+
+FIELDS = list(DerivedAddress.__annotations__)
+
+
+class DeriveSeed:
+    __slots__ = ('owner', 'seed', 'epoch')
+    owner: str
+    seed: bytes
+    epoch: Optional[int]
+
+    def __init__(self, owner:str, seed:bytes):
+        self.owner = owner
+        self.seed = seed
+        # Current epoch, read once per batch by derive_many
+        self.epoch = None
+
+
+class DerivedWriter:
+    """
+    Append-only output file of derived addresses. Every batch is flushed
+    and fsync'd before the next is written, and a record cut short by a
+    crash is truncated on open, so the file only ever holds whole records.
+    """
+    path: str
+    format: FORMAT_T
+    seeds: set[str]
+    _handle: TextIO
+
+    def __init__(self, path:str, format:FORMAT_T):
+        self.path = path
+        self.format = format
+        self.seeds = set()
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self._truncate_partial()
+            with open(path, newline='') as handle:
+                rows = csv.DictReader(handle) if format == 'csv' else (json.loads(_) for _ in handle if _.strip())
+                self.seeds.update(_['seed'] for _ in rows)
+        # Seeds are secrets, only the owner may read them
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._handle = open(fd, 'a', newline='')
+        self._csv = csv.DictWriter(self._handle, FIELDS) if format == 'csv' else None
+        if self._csv is not None and not exists:
+            self._csv.writeheader()
+            self._sync()
+
+    def _truncate_partial(self) -> None:
+        with open(self.path, 'rb+') as handle:
+            data = handle.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                LOGGER.warning('Truncating partial record at end of %s', self.path)
+                handle.truncate(end)
+
+    def _sync(self) -> None:
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+
+    @property
+    def count(self) -> int:
+        return len(self.seeds)
+
+    def write(self, rows:list[DerivedAddress]) -> None:
+        for row in rows:
+            if self._csv is not None:
+                self._csv.writerow(row)
+            else:
+                self._handle.write(json.dumps(row) + '\n')
+            self.seeds.add(row['seed'])
+        self._sync()
+
+    def close(self) -> None:
+        self._handle.close()
+
+
+def verify_sample(d:Contract, batch:list[DeriveSeed], results:list[Optional[DERIVED_T]]) -> None:
+    """
+    Re-derive one random result of a batch with its own eth_call, so a batch
+    whose sub-calls saw different deriving keys is never written out
+    """
+    derived = [(request, result) for request, result in zip(batch, results) if result is not None]
+    if not derived:
+        return
+    request, result = random.choice(derived)
+    expected = d.functions.createDerived(request.owner, result[2], request.seed).call()
+    if (expected[0], expected[1]) != (result[0], result[1]):
+        raise RuntimeError(f'Derived address mismatch for seed {request.seed.hex()} in epoch {result[2]}, '
+                           f'batch:{result[1].hex()} single:{expected[1].hex()}')
+
+
+def derive_batch(d:Contract, multicall:Optional[Multicall], batch:list[DeriveSeed]) -> list[Optional[DerivedAddress]]:
+    """Derive one batch in a single Multicall3 eth_call, None for failures"""
+    results = derive_many(d, multicall, batch, len(batch))
+    verify_sample(d, batch, results)
+    return [None if result is None else {
+        'owner': request.owner,
+        'seed': request.seed.hex(),
+        'keypairId': result[1].hex(),
+        'epoch': result[2],
+        'address': P2pkhAddress.from_hash160(result[0].hex()).to_string(),
+    } for request, result in zip(batch, results)]
+
+
+class CmdDepositDeriveBulk(Cmd):
+    owner: Optional[str]
+    count: Optional[int]
+    seeds: Optional[str]
+    output: str
+    format: Optional[FORMAT_T]
+    batch: int
+    concurrency: int
+
+    @classmethod
+    def setup(cls, parser:ArgumentParser) -> None:
+        super().setup(parser)
+        parser.add_argument('--owner', help='Owner of the deposits (default: the -k account)')
+        parser.add_argument('--count', metavar='n', type=int,
+                            help='Derive addresses for this many random seeds, including those already in the output')
+        parser.add_argument('--seeds', metavar='path',
+                            help='Derive addresses for the hex seeds in this file, one per line, instead of random ones')
+        parser.add_argument('-o', '--output', metavar='path', required=True,
+                            help='Appended to, seeds already in it are skipped so an interrupted run can be resumed')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Output format (default: from the output file extension, otherwise jsonl)')
+        parser.add_argument('--batch', metavar='n', type=int, default=DEFAULT_DERIVE_BATCH,
+                            help='Addresses derived per Multicall3 eth_call (default: %(default)s)')
+        parser.add_argument('-j', '--concurrency', metavar='n', type=int, default=DEFAULT_DERIVE_CONCURRENCY,
+                            help='Batches in-flight at once (default: %(default)s)')
+
+    def __call__(self) -> int:
+        if (self.count is None) == (self.seeds is None):
+            LOGGER.error('One of --count or --seeds is required')
+            return __LINE__()
+        owner = self.owner or self.key.address
+        d = self.dcim.contract_instance('BTCDeposit', self.web3)
+        multicall = multicall_instance(self.dcim, self.web3)
+        if multicall is None:
+            LOGGER.warning('Multicall3 is not deployed on %s, deriving with one eth_call per address', self.sapphire)
+
+        fmt: FORMAT_T = self.format or ('csv' if self.output.endswith('.csv') else 'jsonl')
+        writer = DerivedWriter(self.output, fmt)
+
+        todo: list[bytes] = []
+        if self.seeds is not None:
+            with open(self.seeds) as handle:
+                todo = [bytes.fromhex(_.strip().removeprefix('0x')) for _ in handle if _.strip()]
+            if any(len(_) != 32 for _ in todo):
+                LOGGER.error('Seeds must be 32 bytes')
+                return __LINE__()
+            todo = [_ for _ in dict.fromkeys(todo) if _.hex() not in writer.seeds]
+            total = writer.count + len(todo)
+        else:
+            assert self.count is not None
+            total = self.count
+        LOGGER.info('%d of %d addresses already derived in %s', writer.count, total, self.output)
+
+        queued = 0
+        def next_batch() -> Optional[list[DeriveSeed]]:
+            nonlocal queued
+            if self.seeds is not None:
+                seeds, todo[:self.batch] = todo[:self.batch], []
+            else:
+                # Failed derivations are replaced by new random seeds
+                seeds = [urandom(32) for _ in range(min(self.batch, total - writer.count - queued))]
+            queued += len(seeds)
+            return [DeriveSeed(owner, _) for _ in seeds] or None
+
+        error = False
+        concurrency = max(1, self.concurrency)
+        with ThreadPoolExecutor(concurrency) as pool:
+            inflight: dict[Future[list[Optional[DerivedAddress]]],int] = {}
+            while True:
+                while not error and len(inflight) < concurrency and (batch := next_batch()) is not None:
+                    inflight[pool.submit(derive_batch, d, multicall, batch)] = len(batch)
+                if not inflight:
+                    break
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    queued -= inflight.pop(future)
+                    try:
+                        rows = future.result()
+                    except Exception as ex:
+                        # Stop deriving, but still write the batches already in-flight
+                        LOGGER.error('Derive batch failed: %s', ex)
+                        error = True
+                        continue
+                    derived = [_ for _ in rows if _ is not None]
+                    writer.write(derived)
+                    if len(derived) < len(rows):
+                        LOGGER.warning('%d of %d addresses in batch failed to derive', len(rows) - len(derived), len(rows))
+                        if not derived:
+                            error = True
+                LOGGER.info('Derived %d/%d addresses', writer.count, total)
+        writer.close()
+        if error or writer.count < total:
+            return __LINE__()
+        return 0
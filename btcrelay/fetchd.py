@@ -1,28 +1,116 @@
 # SPDX-License-Identifier: Apache-2.0
 
-from time import sleep
-from typing import Optional
+import os
+import asyncio
+from typing import Callable, Optional
 from io import TextIOWrapper
 from argparse import ArgumentParser, FileType
 
-from web3 import Web3
 from eth_typing import ChecksumAddress
+from web3.types import TxReceipt
+from web3.contract.contract import Contract
 
 from .cmd import Cmd
-from .apis.bitcoinrpc import BitcoinJsonRpc_getblock_t
+from .contracts import fee_ether
+from .apis.poly import AsyncPolyAPI
 from .bitcoin import bytes2revhex
+from .headerstore import HeaderStore
+from .blockheader import HEADER_T, BlockHeader, submit_headers
+from .validate import validate_headers, bits_to_work, HeaderValidationError, MEDIAN_TIME_SPAN
+from .multicall import multicall_instance
+from .relaystate import RelayStateReader
+from .submitter import PipelinedSubmitter, PendingTx
+from .gasmodel import GasModel, count_retargets
+from .notify import BlockNotifications, notifier_from_spec
+from .metrics import (
+    serve_metrics,
+    dump_metrics,
+    RELAY_HEIGHT,
+    BTC_HEIGHT,
+    LAG_BLOCKS,
+    LAG_SECONDS,
+    FORK_DEPTH,
+    SUBMIT_HEADERS,
+    SUBMIT_GAS,
+    SUBMIT_COST,
+    SUBMIT_REVERTS,
+    INVALID_HEADERS
+)
 from .constants import (
     LOGGER,
     DEFAULT_BTCRELAY_ADDR,
     DEFAULT_SLEEP_TIME,
-    DEFAULT_GAS_PRICE,
-    DEFAULT_BATCH_COUNT
+    DEFAULT_BATCH_COUNT,
+    DEFAULT_DATA_DIR,
+    DEFAULT_REORG_WINDOW,
+    DEFAULT_REST_HEADERS_COUNT,
+    DEFAULT_ASYNC_PIPELINE_DEPTH,
+    DEFAULT_MAX_INFLIGHT,
+    DEFAULT_GAS_TARGET,
+    DEFAULT_SAPPHIRE_BLOCK_TIME,
+    __LINE__
 )
 
+def find_fork_height(relay_hashes:Callable[[list[int]],list[bytes]],
+                     btc_hashes:Callable[[list[int]],list[bytes]],
+                     tip:int, low:int) -> int:
+    """
+    Find the highest height at or below `tip` where the relay and the Bitcoin
+    chain agree. Both are hash chains, so the heights which agree are a prefix
+    ending at the fork point: probe backwards exponentially from the tip, then
+    binary search between the last agreeing and first disagreeing probes.
+
+    `low` is the lowest height the relay knows about. The probes are looked
+    up in one batch on each side, then each binary search step costs one.
+    """
+    probes = []
+    step = 1
+    height = tip
+    while height > low:
+        probes.append(height)
+        height = tip - step
+        step *= 2
+    probes.append(low)
+
+    good = None
+    bad = tip + 1
+    for height, relayHash, btcHash in zip(probes, relay_hashes(probes), btc_hashes(probes)):
+        if relayHash == btcHash:
+            good = height
+            break
+        bad = height
+    if good is None:
+        raise RuntimeError(f'Relay start block at height {low} is not on the Bitcoin chain')
+
+    while (bad - good) > 1:
+        mid = (good + bad) // 2
+        if relay_hashes([mid]) == btc_hashes([mid]):
+            good = mid
+        else:
+            bad = mid
+    return good
+
+
 class CmdFetchd(Cmd):
     address: ChecksumAddress
     deploy_file: Optional[TextIOWrapper]
     batch_count: int
+    use_async: bool
+    header_store: Optional[str]
+    store: HeaderStore
+    reader: RelayStateReader
+    max_inflight: int
+    submitter: PipelinedSubmitter
+    adaptive: bool
+    gas_target: float
+    gas_limit: int
+    calibrated: bool
+    notify: Optional[list[str]]
+    notifications: BlockNotifications
+    metrics_port: Optional[int]
+    quorum: int
+    simulate: bool
+    metrics_file: Optional[str]
 
     @classmethod
     def setup(cls, parser:ArgumentParser) -> None:
@@ -32,69 +120,444 @@ class CmdFetchd(Cmd):
         parser.add_argument('-c', '--batch-count', metavar='n', type=int,
                             default=DEFAULT_BATCH_COUNT,
                             help='Miximum number of blocks to submit per tx')
+        parser.add_argument('-a', '--adaptive', action='store_true',
+                            help='Size batches from measured gas, instead of --batch-count')
+        parser.add_argument('--gas-target', metavar='fraction', type=float,
+                            default=DEFAULT_GAS_TARGET,
+                            help='Fraction of the block gas limit filled by adaptive batches (default: %(default)s)')
+        parser.add_argument('--async', dest='use_async', action='store_true',
+                            help='Fetch the next headers while submitting (asyncio)')
+        parser.add_argument('-n', '--max-inflight', metavar='n', type=int,
+                            default=DEFAULT_MAX_INFLIGHT,
+                            help='Maximum number of submit transactions in-flight')
+        parser.add_argument('--notify', metavar='source', action='append',
+                            help='Wake on new blocks from zmq:tcp://host:port, rpc, ws[:url] or poll[:seconds], '
+                                 'may be repeated. Polls every %d seconds otherwise' % DEFAULT_SLEEP_TIME)
+        parser.add_argument('--simulate', action='store_true',
+                            help="Forecast the gas, cost & time to catch up, without sending transactions")
+        parser.add_argument('--quorum', metavar='n', type=int, default=0,
+                            help='Only submit headers which n Bitcoin providers agree on (see --btc-rpc-url)')
+        parser.add_argument('--metrics-port', metavar='port', type=int,
+                            help='Serve Prometheus metrics over HTTP on this port')
+        parser.add_argument('--metrics-file', metavar='path',
+                            help='Periodically write Prometheus metrics to this file')
+        parser.add_argument('--header-store', metavar='path',
+                            help='Local block header store (default: $BTCRELAY_DATADIR/<chain>.headers)')
         parser.add_argument('address', nargs='?', metavar='0xBTCRelayAddress',
                             help='BTCRelay contract address (env: BTCRELAY_ADDR)',
                             default=DEFAULT_BTCRELAY_ADDR)
 
+    def _chainwork(self, headers:list[BlockHeader]) -> list[BlockHeader]:
+        """
+        Raw headers have no chainwork, it's accumulated from the header below
+        them: the stored one, otherwise fetched once from the node. Left as 0
+        when the provider doesn't know it either.
+        """
+        if not headers or headers[0].height <= 0:
+            return headers
+        prev = self.store.get(headers[0].height - 1)
+        if prev is not None and prev.hash == headers[0].previousblockhash and prev.chainwork:
+            chainwork = prev.chainwork
+        else:
+            chainwork = self.poly.getheader(headers[0].previousblockhash)['chainwork']
+        if not chainwork:
+            return headers
+        for header in headers:
+            chainwork += bits_to_work(header.bits)
+            header.chainwork = chainwork
+        return headers
+
+    def _update_store(self) -> tuple[int,bytes]:
+        """
+        Bring the local header store up to date with the Bitcoin node, only
+        fetching headers it doesn't already have. Returns the tip height & hash
+        """
+        store = self.store
+        btcHeight = self.poly.height()
+        btcTipHash = self.poly.height2hash(btcHeight)
+        if store.hash_at(btcHeight) == btcTipHash:
+            return btcHeight, btcTipHash
+
+        if store.tip_height is None:
+            startHeight = self.reader.start_height()
+        else:
+            # Find the highest stored header which is still on the node's chain
+            startHeight = store.base_height
+            top = min(store.tip_height, btcHeight)
+            while top >= store.base_height:
+                heights = range(max(store.base_height, top - DEFAULT_REORG_WINDOW + 1), top + 1)
+                matched = [h for h, btcHash in zip(heights, self.poly.heights2hashes(heights))
+                           if store.hash_at(h) == btcHash]
+                if matched:
+                    startHeight = max(matched) + 1
+                    break
+                top = heights[0] - 1
+            if store.tip_height is not None and startHeight <= store.tip_height:
+                # Stored headers diverged from the node, so may cached results
+                self.poly.cache.invalidate(startHeight)
+            store.truncate(startHeight)
+
+        while startHeight <= btcHeight:
+            heights = range(startHeight, min(btcHeight, startHeight + DEFAULT_REST_HEADERS_COUNT - 1) + 1)
+            headers = self.poly.getrawheaders(startHeight, len(heights))
+            if store.count and headers[0]['previousblockhash'] != store.hash_at(startHeight - 1):
+                # Node reorganized while fetching, pick it up on the next call
+                break
+            store.put(self._chainwork(headers))
+            startHeight = heights[-1] + 1
+
+        return btcHeight, btcTipHash
+
+    def _heights2hashes(self, heights:list[int]) -> list[bytes]:
+        """Block hashes from the header store, with one RPC batch for the rest"""
+        found = {h: self.store.hash_at(h) for h in heights}
+        missing = [h for h, btcHash in found.items() if btcHash is None]
+        if missing:
+            found.update(zip(missing, self.poly.heights2hashes(missing)))
+        return [found[h] or b'' for h in heights]
+
+    def _fetch_blocks(self, heights:range) -> list[HEADER_T]:
+        blocks = self.store.get_range(heights)
+        if blocks is None:
+            blocks = list(self.poly.getrawheaders(heights[0], len(heights)))
+        for block in blocks:
+            LOGGER.debug('Adding block to sync: %d %s', block['height'], bytes2revhex(block['hash']))
+        return blocks
+
+    def _ancestors(self, height:int) -> list[HEADER_T]:
+        """Stored headers immediately below height, as many as validation uses"""
+        ancestors: list[HEADER_T] = []
+        for h in range(height - 1, height - MEDIAN_TIME_SPAN - 1, -1):
+            block = self.store.get(h)
+            if block is None:
+                break
+            ancestors.insert(0, block)
+        return ancestors
+
+    def _verify(self, blocks:list[HEADER_T]) -> bool:
+        """
+        Validate headers locally, as the relay contract will, then with
+        --quorum check enough providers agree on the last hash (which commits
+        to the rest). Headers which fail are discarded from the store.
+        """
+        try:
+            validate_headers(blocks, self._ancestors(blocks[0]['height']), self.is_testnet)
+        except HeaderValidationError as ex:
+            LOGGER.warning('Invalid header, not submitting: %s', ex)
+            INVALID_HEADERS.inc(chain=self.chain, reason=ex.reason)
+        else:
+            if self.poly.quorum < 2:
+                return True
+            if self.poly.quorum_hash(blocks[-1]['height'], blocks[-1]['hash']):
+                return True
+            LOGGER.warning('No quorum for blocks %d to %d, not submitting',
+                           blocks[0]['height'], blocks[-1]['height'])
+        self.store.truncate(blocks[0]['height'])
+        return False
+
+    def _sync_start(self, relay:Contract) -> Optional[tuple[int,int]]:
+        """
+        Compare the relay with the Bitcoin node, returns the first height which
+        needs to be submitted and the Bitcoin tip height, or None when in sync
+        """
+        relay_name = self.dcim.relay_name()
+
+        state = self.reader.read()
+        contractHeight = state.height
+        contractHash = state.tip_hash
+        btcHeight, btcTipHash = self._update_store()
+
+        LOGGER.debug('%s height %d (%s)',
+                     relay_name, contractHeight, bytes2revhex(contractHash))
+
+        LOGGER.debug('%s height %d (%s)',
+                     self.chain, btcHeight, bytes2revhex(btcTipHash))
+
+        self._update_lag(contractHeight, btcHeight)
+
+        if contractHeight == btcHeight and contractHash == btcTipHash:
+            return None
+
+        # Find the last common block hash and height, hashes within the
+        # window already read from the relay don't need looking up again
+        def relay_hashes(heights:list[int]) -> list[bytes]:
+            missing = [h for h in heights if h not in state.hashes]
+            if missing:
+                state.hashes.update(zip(missing, self.reader.hashes(missing)))
+            return [state.hashes[h] for h in heights]
+
+        startHeight = find_fork_height(
+            relay_hashes,
+            self._heights2hashes,
+            contractHeight,
+            self.reader.start_height()) + 1
+
+        if startHeight <= contractHeight:
+            FORK_DEPTH.observe((contractHeight - startHeight) + 1, chain=self.chain)
+
+        LOGGER.debug('Need to sync %d blocks, %d to %d',
+                     (btcHeight - startHeight) + 1,
+                     startHeight, btcHeight)
+
+        return startHeight, btcHeight
+
+    def _update_lag(self, relayHeight:int, btcHeight:int) -> None:
+        RELAY_HEIGHT.set(relayHeight, chain=self.chain)
+        BTC_HEIGHT.set(btcHeight, chain=self.chain)
+        LAG_BLOCKS.set(max(0, btcHeight - relayHeight), chain=self.chain)
+        relayBlock, btcBlock = self.store.get(relayHeight), self.store.get(btcHeight)
+        if relayBlock is not None and btcBlock is not None:
+            LAG_SECONDS.set(max(0, btcBlock['time'] - relayBlock['time']), chain=self.chain)
+
+    def _batch_heights(self, startHeight:int, btcHeight:int) -> range:
+        if not self.adaptive:
+            return range(startHeight, min(btcHeight, startHeight + self.batch_count - 1) + 1)
+        # Size the batch to fill the target fraction of the block gas limit
+        budget = int(self.gas_limit * self.gas_target)
+        count = self.submitter.gas_model.max_headers(startHeight, (btcHeight - startHeight) + 1, budget)
+        return range(startHeight, startHeight + count)
+
+    def _calibrate(self, relay:Contract, blocks:list[HEADER_T]) -> None:
+        # Estimate one header and the whole batch to learn the marginal gas per header
+        submit = relay.functions.submit
+        height = blocks[0]['height']
+        gas_one = submit(height, submit_headers(blocks[:1])).estimate_gas({'from': self.key.address})
+        gas_many = submit(height, submit_headers(blocks)).estimate_gas({'from': self.key.address})
+        self.submitter.gas_model.calibrate(gas_one, len(blocks), count_retargets(height, len(blocks)), gas_many)
+        self.calibrated = True
+
+    def _log_receipts(self, done:list[tuple[PendingTx,TxReceipt]]) -> None:
+        # Display cost of confirmed submissions
+        for pending, receipt in done:
+            if receipt['status'] != 1:
+                SUBMIT_REVERTS.inc(chain=self.chain)
+                continue
+            effectiveGasPrice = receipt.get('effectiveGasPrice', pending.tx['gasPrice'])
+            receiptCost = fee_ether(receipt['gasUsed'], effectiveGasPrice)
+            SUBMIT_HEADERS.inc(pending.count, chain=self.chain)
+            SUBMIT_GAS.observe(receipt['gasUsed'], chain=self.chain)
+            SUBMIT_COST.inc(float(receiptCost), chain=self.chain)
+            if pending.height is not None:
+                self._update_lag(pending.height, int(BTC_HEIGHT.value(chain=self.chain)))
+            LOGGER.info('Submitted %d blocks, gas %d (cost %s) tx %s',
+                        pending.count, receipt['gasUsed'], receiptCost, receipt['transactionHash'].hex())
+
+    def _submit(self, relay:Contract, blocks:list[HEADER_T]) -> bool:
+        """
+        Submit blocks on-chain once there's an in-flight slot free, returns
+        False if a previous submission failed and the relay must be re-read
+        """
+        self._log_receipts(self.submitter.wait_slot())
+        height = blocks[0]['height']
+        if self.adaptive and not self.calibrated and not self.submitter.inflight and len(blocks) > 1:
+            self._calibrate(relay, blocks)
+        fn = relay.functions.submit(height, submit_headers(blocks))
+        pending = self.submitter.send(fn, len(blocks), count_retargets(height, len(blocks)))
+        if pending is None:
+            return False
+        pending.height = blocks[-1]['height']
+        return True
+
+    def _drain(self) -> None:
+        self._log_receipts(self.submitter.wait_all())
+
+    def _wait(self, sleep_time:int) -> None:
+        """Sleep until a new block is announced, or polling again after sleep_time"""
+        LOGGER.debug('No blocks to sync, waiting up to %d seconds', sleep_time)
+        if self.notifications.wait(sleep_time):
+            LOGGER.debug('Woken by block notification: %s', self.notifications.summary())
+
+    def _block_time(self) -> float:
+        """Average Sapphire block interval over recent blocks"""
+        latest = self.web3.eth.get_block('latest')
+        if latest['number'] < 1:
+            return DEFAULT_SAPPHIRE_BLOCK_TIME
+        older = self.web3.eth.get_block(max(0, latest['number'] - 100))
+        return (latest['timestamp'] - older['timestamp']) / (latest['number'] - older['number'])
+
+    def _simulate(self, relay:Contract) -> int:
+        """
+        Estimate `submit` gas for increasing batch sizes from the relay tip,
+        fit the gas model to them, then forecast the cost & time of catching
+        up with each batch size. Nothing is sent, only `estimate_gas` calls.
+        """
+        start = self._sync_start(relay)
+        if start is None:
+            LOGGER.info('%s is in sync, nothing to simulate', self.dcim.relay_name())
+            return 0
+        startHeight, btcHeight = start
+        pending = (btcHeight - startHeight) + 1
+        gas_limit = self.web3.eth.get_block('latest')['gasLimit']
+        budget = int(gas_limit * self.gas_target)
+        gas_price = self.submitter.gas_price
+
+        # Only batches from the relay tip can be estimated against its current state
+        samples: list[tuple[int,int,int]] = []
+        count = 1
+        while True:
+            blocks = self._fetch_blocks(range(startHeight, startHeight + count))
+            try:
+                gas = relay.functions.submit(startHeight, submit_headers(blocks)).estimate_gas({'from': self.key.address})
+            except Exception as ex:
+                LOGGER.info('Estimate batch:%d failed: %s', count, ex)
+                break
+            retargets = count_retargets(startHeight, count)
+            samples.append((count, retargets, gas))
+            LOGGER.info('Estimate batch:%d gas:%d gas/header:%d', count, gas, gas // count)
+            if count >= pending or gas > budget:
+                break
+            count = min(pending, count * 2)
+        if not samples:
+            LOGGER.error('Unable to estimate submit gas')
+            return __LINE__()
+
+        model = GasModel()
+        model.fit(samples)
+        best_size = model.max_headers(startHeight, pending, budget)
+        sizes = sorted({n for n, _, gas in samples if gas <= budget} | {best_size})
+        block_time = self._block_time()
+        LOGGER.info('Pending %d blocks %d to %d, gas model base:%d per header:%d per retarget:%d',
+                    pending, startHeight, btcHeight, model.base, model.per_header, model.per_retarget)
+        LOGGER.info('Block gas limit:%d budget:%d gasPrice:%d block time:%.02fs in-flight:%d',
+                    gas_limit, budget, gas_price, block_time, self.max_inflight)
+
+        for size in sizes:
+            txs = total_gas = max_gas = 0
+            for height in range(startHeight, btcHeight + 1, size):
+                n = min(size, (btcHeight - height) + 1)
+                gas = model.estimate(n, count_retargets(height, n))
+                txs += 1
+                total_gas += gas
+                max_gas = max(max_gas, gas)
+            # Pipelined txs confirm together, as many as fit in a block
+            per_block = max(1, min(self.max_inflight, gas_limit // max(1, max_gas)))
+            seconds = ((txs + per_block - 1) // per_block) * block_time
+            LOGGER.info('%s batch:%d txs:%d gas:%d cost:%s time:%.02fs',
+                        'Optimal' if size == best_size else 'Simulate',
+                        size, txs, total_gas, fee_ether(total_gas, gas_price), seconds)
+        return 0
+
+    async def _run_async(self, relay:Contract, sleep_time:int) -> None:
+        """
+        Fetch the next batch of headers while the previous batch is being
+        submitted and confirmed. The fetcher only goes back to the relay
+        contract once everything queued has been submitted and confirmed.
+        """
+        queue: asyncio.Queue[list[HEADER_T]] = asyncio.Queue(DEFAULT_ASYNC_PIPELINE_DEPTH)
+
+        async with AsyncPolyAPI(self.chain, self.btc_rpc_url) as apoly:
+            async def fetcher() -> None:
+                while True:
+                    start = await asyncio.to_thread(self._sync_start, relay)
+                    if start is None:
+                        await asyncio.to_thread(self._wait, sleep_time)
+                        continue
+                    startHeight, btcHeight = start
+                    prevHash: Optional[bytes] = None
+                    while startHeight <= btcHeight:
+                        heights = self._batch_heights(startHeight, btcHeight)
+                        blocks = self.store.get_range(heights)
+                        if blocks is None:
+                            headers = await apoly.getrawheaders(heights[0], len(heights))
+                            blocks = list(await asyncio.to_thread(self._chainwork, headers))
+                            self.store.put(blocks)
+                        if prevHash is not None and blocks[0]['previousblockhash'] != prevHash:
+                            LOGGER.info('%s reorganized during sync, restarting from relay', self.chain)
+                            break
+                        for block in blocks:
+                            LOGGER.debug('Adding block to sync: %d %s', block['height'], bytes2revhex(block['hash']))
+                        if not await asyncio.to_thread(self._verify, blocks):
+                            await asyncio.to_thread(self._wait, sleep_time)
+                            break
+                        await queue.put(blocks)
+                        prevHash = blocks[-1]['hash']
+                        startHeight = heights[-1] + 1
+                        if startHeight > btcHeight:
+                            btcHeight = await apoly.height()
+                    await queue.join()
+                    await asyncio.to_thread(self._drain)
+
+            async def submitter() -> None:
+                while True:
+                    blocks = await queue.get()
+                    try:
+                        # After a failure queued batches are dropped, then
+                        # the fetcher re-reads the relay once drained
+                        await asyncio.to_thread(self._submit, relay, blocks)
+                    finally:
+                        queue.task_done()
+
+            await asyncio.gather(fetcher(), submitter())
+
     def __call__(self) -> int:
         sleep_time = 5 if self.chain == 'btc-regtest' else DEFAULT_SLEEP_TIME
+        if self.quorum > len(self.poly.backends):
+            LOGGER.error('Quorum of %d needs at least that many Bitcoin providers, have %d',
+                         self.quorum, len(self.poly.backends))
+            return __LINE__()
+        self.poly.quorum = self.quorum
         relay_name = self.dcim.relay_name()
         relay = self.dcim.contract_instance(relay_name, self.web3)
-        getLatestBlockHeight = relay.functions.getLatestBlockHeight
-        getBlockHash = relay.functions.getBlockHashReversed
-        submit = relay.functions.submit
+        self.reader = RelayStateReader(relay, multicall_instance(self.dcim, self.web3))
+        self.submitter = PipelinedSubmitter(self.web3, self.key.address, self.max_inflight)
+        self.calibrated = False
+        if self.adaptive:
+            self.gas_limit = self.web3.eth.get_block('latest')['gasLimit']
+            LOGGER.debug('Adaptive batches, block gas limit %d target %.2f',
+                         self.gas_limit, self.gas_target)
+        self.store = HeaderStore(self.header_store or os.path.join(DEFAULT_DATA_DIR, f'{self.chain}.headers'))
 
-        while True:
+        if self.simulate:
+            return self._simulate(relay)
+
+        self.notifications = BlockNotifications([notifier_from_spec(_, self.chain, self.poly)
+                                                 for _ in self.notify or []])
+        self.notifications.start()
+        if self.metrics_port is not None:
+            serve_metrics(self.metrics_port)
+        if self.metrics_file:
+            dump_metrics(self.metrics_file)
+
+        if self.use_async:
             try:
-                contractHeight: int = getLatestBlockHeight().call()
-                contractHash: bytes = getBlockHash(contractHeight).call()
-                btcHeight = self.poly.height()
-                btcTipHash = self.poly.height2hash(btcHeight)
+                asyncio.run(self._run_async(relay, sleep_time))
+            except KeyboardInterrupt:
+                pass
+            return 0
 
-                LOGGER.debug('%s height %d (%s)',
-                             relay_name, contractHeight, bytes2revhex(contractHash))
+        # Local view of the next height to submit while submissions are
+        # in-flight, the relay is only re-read once they've all confirmed
+        nextHeight: Optional[int] = None
+        btcHeight = 0
+        prevHash: Optional[bytes] = None
+        while True:
+            try:
+                if nextHeight is None or nextHeight > btcHeight:
+                    self._drain()
+                    start = self._sync_start(relay)
+                    if start is None:
+                        self._wait(sleep_time)
+                        continue
+                    nextHeight, btcHeight = start
+                    prevHash = None
 
-                LOGGER.debug('%s height %d (%s)',
-                             self.chain, btcHeight, bytes2revhex(btcTipHash))
+                # Missing/diverged blocks, from the header store or RPC
+                blocks = self._fetch_blocks(self._batch_heights(nextHeight, btcHeight))
+                if prevHash is not None and blocks[0]['previousblockhash'] != prevHash:
+                    LOGGER.info('%s reorganized during sync, restarting from relay', self.chain)
+                    nextHeight = None
+                    continue
 
-                if contractHeight == btcHeight and contractHash == btcTipHash:
-                    LOGGER.debug('No blocks to sync, sleeping %d seconds',
-                                 sleep_time)
-                    sleep(sleep_time)  # delay a few minutes
+                if not self._verify(blocks):
+                    nextHeight = None
+                    self._wait(sleep_time)
                     continue
 
-                # Work backwards to findcommon block hash and height
-                startHeight = contractHeight
-                while True:
-                    contractHash = getBlockHash(startHeight).call()
-                    btcTipHash = self.poly.height2hash(startHeight)
-                    if contractHash == btcTipHash:
-                        startHeight += 1
-                        break
-                    startHeight -= 1
-
-                LOGGER.debug('Need to sync %d blocks, %d to %d',
-                             (btcHeight - startHeight) + 1,
-                             startHeight, btcHeight)
-
-                # Fetch missing/diverged blocks from RPC
-                blocks: list[BitcoinJsonRpc_getblock_t] = []
-                for i in range(startHeight, btcHeight + 1):
-                    btcHash = self.poly.height2hash(i)
-                    blocks.append(self.poly.getheader(btcHash))
-                    LOGGER.debug('Adding block to sync: %d %s', i, bytes2revhex(btcHash))
-                    if len(blocks) >= self.batch_count:
-                        break
-
-                # Submit blocks on-chain, and display cost
-                txid = submit(blocks[0]['height'], blocks).transact({
-                    'gasPrice': DEFAULT_GAS_PRICE
-                })
-                receipt = self.web3.eth.wait_for_transaction_receipt(txid)
-                effectiveGasPrice = receipt.get('effectiveGasPrice', DEFAULT_GAS_PRICE)
-                receiptCost = Web3.from_wei(receipt['gasUsed'] * effectiveGasPrice, 'ether')
-                LOGGER.info('Submitted %d blocks, gas %d (cost %s) tx %s',
-                            len(blocks), receipt['gasUsed'], receiptCost, receipt['transactionHash'].hex())
+                if not self._submit(relay, blocks):
+                    nextHeight = None
+                    continue
+                prevHash = blocks[-1]['hash']
+                nextHeight = blocks[-1]['height'] + 1
 
             except KeyboardInterrupt:
                 break
@@ -0,0 +1,90 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from .constants import (
+    LOGGER,
+    BTC_RETARGET_PERIOD,
+    DEFAULT_SUBMIT_GAS_BASE,
+    DEFAULT_SUBMIT_GAS_PER_HEADER,
+    DEFAULT_SUBMIT_GAS_PER_RETARGET
+)
+
+# Learning rate for normalized least-mean-squares updates
+GAS_MODEL_RATE = 0.5
+
+
+def count_retargets(start:int, count:int, period:int=BTC_RETARGET_PERIOD) -> int:
+    """Number of difficulty retarget heights in [start, start+count)"""
+    return ((start + count - 1) // period) - ((start - 1) // period)
+
+
+class GasModel:
+    """
+    Linear model of `submit` gas: base + per_header * n + per_retarget * r,
+    where r is the number of retarget headers (which store a new target).
+    Starts from the constants as a prior, and learns from receipts and
+    `estimate_gas` results with normalized least-mean-squares updates.
+    With other priors it models any batch, e.g. `depositDerived` calls in
+    one `aggregate3`, where each deposit counts as a header.
+    """
+    base: float
+    per_header: float
+    per_retarget: float
+    observations: int
+
+    def __init__(self, base:float=DEFAULT_SUBMIT_GAS_BASE, per_header:float=DEFAULT_SUBMIT_GAS_PER_HEADER,
+                 per_retarget:float=DEFAULT_SUBMIT_GAS_PER_RETARGET):
+        self.base = base
+        self.per_header = per_header
+        self.per_retarget = per_retarget
+        self.observations = 0
+
+    def estimate(self, headers:int, retargets:int=0) -> int:
+        return int(self.base + (self.per_header * headers) + (self.per_retarget * retargets))
+
+    def observe(self, headers:int, retargets:int, gas:int) -> None:
+        error = gas - (self.base + (self.per_header * headers) + (self.per_retarget * retargets))
+        step = GAS_MODEL_RATE * error / (1 + (headers * headers) + (retargets * retargets))
+        self.base = max(0.0, self.base + step)
+        self.per_header = max(1.0, self.per_header + (step * headers))
+        self.per_retarget = max(0.0, self.per_retarget + (step * retargets))
+        self.observations += 1
+        LOGGER.debug('Gas model base %d per header %d per retarget %d (observed %d for %d headers, %d retargets)',
+                     self.base, self.per_header, self.per_retarget, gas, headers, retargets)
+
+    def calibrate(self, gas_one:int, headers:int, retargets:int, gas_many:int) -> None:
+        """Solve base & per_header from estimates for 1 header, and many"""
+        if headers < 2:
+            self.observe(1, 0, gas_one)
+            return
+        marginal = (gas_many - gas_one - (self.per_retarget * retargets)) / (headers - 1)
+        if marginal > 0:
+            self.per_header = marginal
+            self.base = max(0.0, gas_one - marginal)
+        self.observations += 2
+
+    def fit(self, samples:list[tuple[int,int,int]]) -> None:
+        """
+        Least squares fit of base & per_header to (headers, retargets, gas)
+        samples, e.g. estimates for several batch sizes
+        """
+        if len({n for n, _, _ in samples}) < 2:
+            for n, r, gas in samples:
+                self.observe(n, r, gas)
+            return
+        # Remove the retarget component, which a few samples can't separate
+        points = [(n, gas - (self.per_retarget * r)) for n, r, gas in samples]
+        mean_n = sum(n for n, _ in points) / len(points)
+        mean_gas = sum(g for _, g in points) / len(points)
+        var = sum((n - mean_n) ** 2 for n, _ in points)
+        cov = sum((n - mean_n) * (g - mean_gas) for n, g in points)
+        self.per_header = max(1.0, cov / var)
+        self.base = max(0.0, mean_gas - (self.per_header * mean_n))
+        self.observations += len(samples)
+
+    def max_headers(self, start:int, available:int, budget:int) -> int:
+        """Largest number of headers from `start` whose submit fits the gas budget"""
+        count = int((budget - self.base) // self.per_header)
+        count = max(1, min(available, count))
+        while count > 1 and self.estimate(count, count_retargets(start, count)) > budget:
+            count -= 1
+        return count
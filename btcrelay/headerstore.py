@@ -0,0 +1,201 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import mmap
+import struct
+from threading import RLock
+from typing import Optional, Iterable, Sequence
+
+from .blockheader import HEADER_STRUCT, HEADER_T, BlockHeader
+from .constants import LOGGER
+
+# Fixed width record: 80 byte header, height, hash, chainwork (big endian), bits
+RECORD_STRUCT = struct.Struct('<80sI32s32sI')
+RECORD_SIZE = RECORD_STRUCT.size
+
+# File header: magic, height of first record, number of records
+FILE_MAGIC = b'BTCRHDR1'
+FILE_STRUCT = struct.Struct('<8sII')
+
+# Grow the file this many records at a time, avoids remapping on every append
+GROW_RECORDS = 2016
+
+
+class HeaderStoreError(RuntimeError):
+    pass
+
+
+def pack_header(block:HEADER_T) -> bytes:
+    """Serialize the 80 byte block header, without the merkle root check"""
+    return HEADER_STRUCT.pack(block['version'],
+                              block['previousblockhash'],
+                              block['merkleroot'],
+                              block['time'],
+                              block['bits'],
+                              block['nonce'])
+
+
+class HeaderStore:
+    """
+    On-disk store of a contiguous chain of block headers, memory-mapped and
+    indexed by height, with an in-memory hash to height index.
+
+    Every stored header links to the one before it, so if the hash at a
+    height matches the node then so does everything stored below it.
+    """
+    path: str
+    base_height: int
+    count: int
+    _index: dict[bytes,int]
+
+    def __init__(self, path:str):
+        self.path = path
+        self._lock = RLock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        exists = os.path.exists(path)
+        self._handle = open(path, 'r+b' if exists else 'w+b')
+        if not exists or os.path.getsize(path) < FILE_STRUCT.size:
+            self._allocate(GROW_RECORDS)
+            self._map()
+            self._write_meta(0, 0)
+        else:
+            self._map()
+        magic, self.base_height, self.count = FILE_STRUCT.unpack_from(self._mm, 0)
+        if magic != FILE_MAGIC:
+            raise HeaderStoreError(f'Not a header store: {path}')
+        if self._capacity() < self.count:
+            raise HeaderStoreError(f'Truncated header store: {path}')
+        self._index = {}
+        for i in range(self.count):
+            offset = FILE_STRUCT.size + (i * RECORD_SIZE) + 84
+            self._index[bytes(self._mm[offset:offset+32])] = self.base_height + i
+        LOGGER.debug('Header store %s has %d headers from height %d',
+                     path, self.count, self.base_height)
+
+    def _allocate(self, records:int) -> None:
+        self._handle.truncate(FILE_STRUCT.size + (records * RECORD_SIZE))
+
+    def _map(self) -> None:
+        self._mm = mmap.mmap(self._handle.fileno(), 0)
+
+    def _capacity(self) -> int:
+        return (len(self._mm) - FILE_STRUCT.size) // RECORD_SIZE
+
+    def _write_meta(self, base_height:int, count:int) -> None:
+        FILE_STRUCT.pack_into(self._mm, 0, FILE_MAGIC, base_height, count)
+
+    def close(self) -> None:
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+            self._handle.close()
+
+    @property
+    def tip_height(self) -> Optional[int]:
+        if not self.count:
+            return None
+        return self.base_height + self.count - 1
+
+    def __contains__(self, height:int) -> bool:
+        return self.base_height <= height < (self.base_height + self.count)
+
+    def _offset(self, height:int) -> int:
+        return FILE_STRUCT.size + ((height - self.base_height) * RECORD_SIZE)
+
+    def hash_at(self, height:int) -> Optional[bytes]:
+        with self._lock:
+            if height not in self:
+                return None
+            offset = self._offset(height) + 84
+            return bytes(self._mm[offset:offset+32])
+
+    def height_of(self, blockhash:bytes) -> Optional[int]:
+        return self._index.get(blockhash)
+
+    @staticmethod
+    def _record(raw:bytes, height:int, blockhash:bytes, chainwork:bytes, bits:int) -> BlockHeader:
+        version, prevhash, merkleroot, time, bits, nonce = HEADER_STRUCT.unpack(raw)
+        return BlockHeader(version, prevhash, merkleroot, time, bits, nonce,
+                           blockhash, height, int.from_bytes(chainwork, 'big'))
+
+    def get(self, height:int) -> Optional[BlockHeader]:
+        with self._lock:
+            if height not in self:
+                return None
+            return self._record(*RECORD_STRUCT.unpack_from(self._mm, self._offset(height)))
+
+    def get_range(self, heights:Iterable[int]) -> Optional[list[HEADER_T]]:
+        """Returns headers for all heights, or None if any are missing"""
+        heights = list(heights)
+        if not heights:
+            return []
+        start, end = heights[0], heights[-1] + 1
+        # Consecutive heights are decoded in bulk from one slice of the file
+        if heights != list(range(start, end)):
+            result: list[HEADER_T] = []
+            for height in heights:
+                header = self.get(height)
+                if header is None:
+                    return None
+                result.append(header)
+            return result
+        with self._lock:
+            if start not in self or (end - 1) not in self:
+                return None
+            records = self._mm[self._offset(start):self._offset(end)]
+        return [self._record(*_) for _ in RECORD_STRUCT.iter_unpack(records)]
+
+    def truncate(self, height:int) -> None:
+        """Discard all headers at or above height"""
+        with self._lock:
+            if self.tip_height is None or height > self.tip_height:
+                return
+            new_count = max(0, height - self.base_height)
+            for h in range(self.base_height + new_count, self.base_height + self.count):
+                self._index.pop(self.hash_at(h) or b'', None)
+            LOGGER.debug('Header store truncated at %d, discarded %d',
+                         height, self.count - new_count)
+            self.count = new_count
+            self._write_meta(self.base_height, self.count)
+
+    def put(self, headers:Sequence[HEADER_T]) -> None:
+        """
+        Store a hash chain of headers, replacing any stored at or above the
+        first header's height. Headers which don't extend the stored chain
+        start a new store from that height.
+        """
+        if not headers:
+            return
+        height = headers[0]['height']
+        for i, block in enumerate(headers):
+            if i and block['previousblockhash'] != headers[i-1]['hash']:
+                raise HeaderStoreError(f"Headers not a hash chain at height {block['height']}")
+            if block['height'] != height + i:
+                raise HeaderStoreError(f"Headers not sequential at height {block['height']}")
+
+        with self._lock:
+            prevhash = self.hash_at(height - 1)
+            if prevhash is None or prevhash != headers[0]['previousblockhash']:
+                if self.count:
+                    LOGGER.debug('Header store restarted at height %d', height)
+                self._index.clear()
+                self.base_height, self.count = height, 0
+            else:
+                self.truncate(height)
+
+            needed = self.count + len(headers)
+            if needed > self._capacity():
+                self._mm.close()
+                self._allocate(needed + GROW_RECORDS)
+                self._map()
+
+            for block in headers:
+                RECORD_STRUCT.pack_into(self._mm, self._offset(block['height']),
+                                        pack_header(block),
+                                        block['height'],
+                                        block['hash'],
+                                        block['chainwork'].to_bytes(32, 'big'),
+                                        block['bits'])
+                self._index[block['hash']] = block['height']
+            self.count = needed
+            self._write_meta(self.base_height, self.count)
@@ -0,0 +1,280 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import math
+from time import monotonic
+from threading import Lock, Thread, Event
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+from web3 import Web3
+from web3.types import Middleware, RPCEndpoint, RPCResponse
+
+from .constants import LOGGER, DEFAULT_METRICS_INTERVAL
+
+LABELS_T = tuple[str,...]
+
+# Seconds, from a keep-alive round trip to a slow batch or confirmation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+GAS_BUCKETS = (50000, 100000, 250000, 500000, 1000000, 2500000, 5000000, 10000000, 15000000)
+DEPTH_BUCKETS = (1, 2, 3, 4, 6, 8, 16, 32, 64, 128)
+
+
+def _escape(value:str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value:float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def endpoint_label(url:str) -> str:
+    """Host and port of a URL, paths may contain API keys so aren't used"""
+    parts = urlsplit(url)
+    return parts.hostname + (f':{parts.port}' if parts.port else '') if parts.hostname else url
+
+
+class Metric:
+    """
+    Named metric with a fixed set of label names, one value per combination
+    of label values. Rendered in the Prometheus text exposition format.
+    """
+    kind: str
+    name: str
+    help: str
+    labelnames: LABELS_T
+
+    def __init__(self, name:str, help:str, labelnames:Sequence[str]=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels:dict[str,str]) -> LABELS_T:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[_]) for _ in self.labelnames)
+
+    def _labels(self, key:LABELS_T, extra:Optional[tuple[str,str]]=None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            lines += list(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+    _values: dict[LABELS_T,float]
+
+    def __init__(self, name:str, help:str, labelnames:Sequence[str]=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount:float=1, /, **labels:str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels:str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f'{self.name}{self._labels(key)} {_format_value(value)}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value:float, /, **labels:str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    buckets: tuple[float,...]
+    _values: dict[LABELS_T,tuple[list[int],float,int]]
+
+    def __init__(self, name:str, help:str, labelnames:Sequence[str]=(),
+                 buckets:Sequence[float]=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}
+
+    def observe(self, value:float, /, **labels:str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels:str) -> Iterator[None]:
+        """Observe the wall-clock duration of the block, even when it raises"""
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket{self._labels(key, ('le', _format_value(bound)))} {cumulative}"
+            yield f'{self.name}_sum{self._labels(key)} {_format_value(total)}'
+            yield f'{self.name}_count{self._labels(key)} {count}'
+
+
+class Registry:
+    _metrics: dict[str,Metric]
+
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric:Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Duplicate metric: {metric.name}')
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(_.render() for _ in metrics) + '\n'
+
+    def dump(self, path:str) -> None:
+        """Write all metrics to a file, atomically replacing the previous dump"""
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as handle:
+            handle.write(self.render())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format:str, *args) -> None:
+        LOGGER.debug('Metrics %s %s', self.address_string(), format % args)
+
+
+def serve_metrics(port:int, addr:str='') -> ThreadingHTTPServer:
+    """Serve `/metrics` over HTTP from a background thread"""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    LOGGER.info('Serving metrics on http://%s:%d/metrics', addr or '0.0.0.0', server.server_address[1])
+    return server
+
+
+def dump_metrics(path:str, interval:float=DEFAULT_METRICS_INTERVAL) -> Event:
+    """Rewrite the metrics file every `interval` seconds, until the returned event is set"""
+    stop = Event()
+    def writer() -> None:
+        while True:
+            try:
+                REGISTRY.dump(path)
+            except OSError as ex:
+                LOGGER.warning('Unable to write metrics to %s: %s', path, ex)
+            if stop.wait(interval):
+                return
+    Thread(target=writer, name='metrics-dump', daemon=True).start()
+    return stop
+
+
+def web3_metrics_middleware(endpoint:str) -> Middleware:
+    """Web3.py middleware recording the latency of Sapphire RPC calls"""
+    def middleware(make_request:Callable[[RPCEndpoint,Any],RPCResponse], w3:Web3) -> Callable[[RPCEndpoint,Any],RPCResponse]:
+        def metered_request(method:RPCEndpoint, params:Any) -> RPCResponse:
+            labels = {'api': 'sapphire', 'endpoint': endpoint_label(endpoint), 'method': str(method)}
+            try:
+                with RPC_SECONDS.time(**labels):
+                    response = make_request(method, params)
+            except Exception:
+                RPC_ERRORS.inc(**labels)
+                raise
+            if 'error' in response:
+                RPC_ERRORS.inc(**labels)
+            return response
+        return metered_request
+    return middleware
+
+
+RPC_SECONDS = Histogram('btcrelay_rpc_seconds', 'RPC request latency',
+                        ('api', 'endpoint', 'method'))
+RPC_ERRORS = Counter('btcrelay_rpc_errors_total', 'RPC requests which failed',
+                     ('api', 'endpoint', 'method'))
+RETRIES = Counter('btcrelay_retries_total', 'Retried operations', ('kind',))
+
+RELAY_HEIGHT = Gauge('btcrelay_relay_height', 'Height of the relay contract tip', ('chain',))
+BTC_HEIGHT = Gauge('btcrelay_btc_height', 'Height of the Bitcoin node tip', ('chain',))
+LAG_BLOCKS = Gauge('btcrelay_lag_blocks', 'Blocks the relay is behind the Bitcoin tip', ('chain',))
+LAG_SECONDS = Gauge('btcrelay_lag_seconds', 'Block time the relay is behind the Bitcoin tip', ('chain',))
+FORK_DEPTH = Histogram('btcrelay_fork_depth_blocks', 'Depth of relay reorganizations',
+                       ('chain',), DEPTH_BUCKETS)
+
+SUBMIT_HEADERS = Counter('btcrelay_submit_headers_total', 'Headers in confirmed submissions', ('chain',))
+SUBMIT_GAS = Histogram('btcrelay_submit_gas', 'Gas used per confirmed submission',
+                       ('chain',), GAS_BUCKETS)
+SUBMIT_COST = Counter('btcrelay_submit_cost_total', 'Native token spent on submissions', ('chain',))
+SUBMIT_REVERTS = Counter('btcrelay_submit_reverts_total', 'Submissions which reverted', ('chain',))
+INVALID_HEADERS = Counter('btcrelay_invalid_headers_total', 'Batches rejected by local header validation',
+                          ('chain', 'reason'))
+QUORUM_DISAGREEMENTS = Counter('btcrelay_quorum_disagreements_total',
+                               'Headers which a quorum of providers did not agree on', ('chain',))
+CONFIRM_SECONDS = Histogram('btcrelay_confirm_seconds', 'Time from first broadcast to receipt')
+
+NOTIFICATIONS = Counter('btcrelay_notifications_total', 'Block notifications received', ('source',))
+NOTIFY_LAG = Histogram('btcrelay_notify_lag_seconds', 'Lag behind the first source to report a block',
+                       ('source',))
+
+CACHE_HITS = Counter('btcrelay_cache_hits_total', 'Bitcoin RPC results served from cache', ('method',))
+CACHE_MISSES = Counter('btcrelay_cache_misses_total', 'Bitcoin RPC results not in cache', ('method',))
+
+THROTTLED = Counter('btcrelay_throttled_total', 'Throttled (HTTP 429) replies', ('endpoint',))
+RATELIMIT_SECONDS = Histogram('btcrelay_ratelimit_wait_seconds', 'Time requests were queued by the rate limiter',
+                              ('endpoint',))
+COALESCED = Counter('btcrelay_coalesced_total', 'Requests served by an identical in-flight request', ('api',))
+
+DEPOSITS = Counter('btcrelay_deposits_total', 'Deposits finished by deposit-watchd', ('status',))
+DEPOSITS_PENDING = Gauge('btcrelay_deposits_pending', 'Deposits tracked by deposit-watchd')
+DEPOSIT_GAS = Histogram('btcrelay_deposit_gas', 'Gas used per deposit, sent alone or in a batch',
+                        ('mode',), GAS_BUCKETS)
+DEPOSIT_GAS_SAVED = Counter('btcrelay_deposit_gas_saved_total', 'Gas saved by batching deposits, against one-by-one')
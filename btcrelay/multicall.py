@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from typing import Any, Optional, Sequence
+
+from web3 import Web3
+from web3.contract.contract import Contract, ContractFunction
+from web3._utils.abi import get_abi_output_types
+
+from .constants import LOGGER
+from .contracts import DeployedContractInfoManager
+
+
+class Multicall:
+    """
+    Batch many read-only contract calls into a single Multicall3 `aggregate3`
+    eth_call. Individual calls are allowed to fail, their result is None.
+    """
+    _w3: Web3
+    _multicall3: Contract
+
+    def __init__(self, w3:Web3, multicall3:Contract):
+        self._w3 = w3
+        self._multicall3 = multicall3
+
+    def _decode(self, fn:ContractFunction, data:bytes) -> Any:
+        output_types = get_abi_output_types(fn.abi)
+        result = self._w3.codec.decode(output_types, data)
+        if len(output_types) == 1:
+            return result[0]
+        return result
+
+    def aggregate3(self, fns:Sequence[ContractFunction]) -> ContractFunction:
+        """
+        `aggregate3` which reverts if any call fails, to be sent as a
+        transaction. Calls are made by Multicall3, not the sender.
+        """
+        return self._multicall3.functions.aggregate3([(fn.address, False, fn._encode_transaction_data()) for fn in fns])
+
+    def call(self, fns:Sequence[ContractFunction]) -> list[Optional[Any]]:
+        if not fns:
+            return []
+        calls = [(fn.address, True, fn._encode_transaction_data()) for fn in fns]
+        LOGGER.debug('Multicall3 aggregate3 of %d calls', len(calls))
+        results: list[tuple[bool,bytes]] = self._multicall3.functions.aggregate3(calls).call()
+        return [self._decode(fn, data) if success else None
+                for fn, (success, data) in zip(fns, results)]
+
+
+def multicall_instance(dcim:DeployedContractInfoManager, w3:Web3) -> Optional[Multicall]:
+    if not dcim.is_deployed('Multicall3'):
+        return None
+    return Multicall(w3, dcim.contract_instance('Multicall3', w3))
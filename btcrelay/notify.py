@@ -0,0 +1,256 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import asyncio
+from time import monotonic
+from threading import Thread, Event, Lock
+from typing import Callable, Optional
+
+from .apis.poly import PolyAPI
+from .apis.bitcoinrpc import BitcoinJsonRpc
+from .apis.mempoolspace import MempoolSpaceAPI
+from .bitcoin import bytes2revhex
+from .metrics import NOTIFICATIONS, NOTIFY_LAG, RETRIES
+from .constants import (
+    LOGGER,
+    BTC_CHAIN_T,
+    DEFAULT_SLEEP_TIME,
+    DEFAULT_NOTIFY_RECONNECT_TIME,
+    DEFAULT_WAITFORNEWBLOCK_TIMEOUT
+)
+
+# Called by sources with their name and the new tip hash (internal byte order)
+NOTIFY_T = Callable[[str,bytes],None]
+
+# How long a hash is remembered for comparing the latency of sources
+NOTIFY_SEEN_TIME = 3600
+
+
+class NotifierError(RuntimeError):
+    pass
+
+
+class BlockNotifier:
+    """
+    Source of new block notifications, runs in its own thread until `stop`
+    is set and calls `notify` whenever it learns of a new tip.
+    """
+    name: str
+
+    def run(self, notify:NOTIFY_T, stop:Event) -> None:
+        raise NotImplementedError
+
+
+class PollNotifier(BlockNotifier):
+    """Polls the Bitcoin node for the tip every `interval` seconds"""
+    name = 'poll'
+    poly: PolyAPI
+    interval: float
+
+    def __init__(self, poly:PolyAPI, interval:float=DEFAULT_SLEEP_TIME):
+        self.poly = poly
+        self.interval = interval
+
+    def run(self, notify:NOTIFY_T, stop:Event) -> None:
+        tip: Optional[bytes] = None
+        while not stop.wait(self.interval):
+            blockhash = self.poly.height2hash(self.poly.height())
+            if tip is not None and blockhash != tip:
+                notify(self.name, blockhash)
+            tip = blockhash
+
+
+class WaitForNewBlockNotifier(BlockNotifier):
+    """Long-polls the `waitfornewblock` RPC, returns as soon as the tip changes"""
+    name = 'waitfornewblock'
+    rpc: BitcoinJsonRpc
+    timeout: int
+
+    def __init__(self, rpc:BitcoinJsonRpc, timeout:int=DEFAULT_WAITFORNEWBLOCK_TIMEOUT):
+        self.rpc = rpc
+        self.timeout = timeout
+
+    def run(self, notify:NOTIFY_T, stop:Event) -> None:
+        tip: Optional[bytes] = None
+        while not stop.is_set():
+            result = self.rpc.waitfornewblock(self.timeout * 1000)
+            if tip is not None and result['hash'] != tip:
+                notify(self.name, result['hash'])
+            tip = result['hash']
+
+
+class ZMQNotifier(BlockNotifier):
+    """
+    Subscribes to bitcoind `-zmqpubhashblock` notifications,
+    requires the optional `pyzmq` package.
+    """
+    name = 'zmq'
+    url: str
+
+    def __init__(self, url:str):
+        self.url = url
+
+    def run(self, notify:NOTIFY_T, stop:Event) -> None:
+        try:
+            import zmq  # type: ignore[import-not-found]
+        except ImportError as ex:
+            raise NotifierError('ZMQ notifications require pyzmq') from ex
+        ctx = zmq.Context.instance()
+        sock = ctx.socket(zmq.SUB)
+        try:
+            sock.setsockopt(zmq.SUBSCRIBE, b'hashblock')
+            sock.connect(self.url)
+            while not stop.is_set():
+                # Poll with a timeout so `stop` is noticed
+                if not sock.poll(DEFAULT_NOTIFY_RECONNECT_TIME * 1000):
+                    continue
+                topic, body, *_ = sock.recv_multipart()
+                if topic == b'hashblock' and len(body) == 32:
+                    notify(self.name, body[::-1])
+        finally:
+            sock.close(linger=0)
+
+
+class WebSocketNotifier(BlockNotifier):
+    """
+    Streams new blocks from a mempool.space compatible websocket endpoint,
+    any server speaking the same `{"action":"want","data":["blocks"]}`
+    protocol can be substituted (e.g. a local stand-in).
+    """
+    name = 'websocket'
+    url: str
+
+    def __init__(self, url:str):
+        self.url = url
+
+    async def _stream(self, notify:NOTIFY_T, stop:Event) -> None:
+        import aiohttp
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(self.url, heartbeat=DEFAULT_WAITFORNEWBLOCK_TIMEOUT) as ws:
+                await ws.send_json({'action': 'want', 'data': ['blocks']})
+                while not stop.is_set():
+                    try:
+                        msg = await ws.receive(timeout=DEFAULT_NOTIFY_RECONNECT_TIME)
+                    except asyncio.TimeoutError:
+                        continue
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        raise ConnectionError(f'Websocket closed: {msg.type!r}')
+                    block = json.loads(msg.data).get('block')
+                    if block is not None:
+                        notify(self.name, bytes.fromhex(block['id'])[::-1])
+
+    def run(self, notify:NOTIFY_T, stop:Event) -> None:
+        asyncio.run(self._stream(notify, stop))
+
+
+class NotifierStats:
+    """
+    Per-source counters, `lag` is how far behind the first source to report
+    the same block a source was, in seconds
+    """
+    __slots__ = ('notifications', 'first', 'lag_total', 'lag_max', 'errors')
+
+    def __init__(self) -> None:
+        self.notifications = 0
+        self.first = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.errors = 0
+
+    @property
+    def lag_mean(self) -> float:
+        return self.lag_total / max(1, self.notifications - self.first)
+
+
+class BlockNotifications:
+    """
+    Runs multiple notification sources, `wait` returns as soon as any of
+    them reports a new tip. Sources which fail are restarted after a delay,
+    callers fall back to polling by passing `wait` a timeout.
+    """
+    sources: list[BlockNotifier]
+    stats: dict[str,NotifierStats]
+    _seen: dict[bytes,float]
+
+    def __init__(self, sources:list[BlockNotifier]):
+        self.sources = sources
+        self.stats = {_.name: NotifierStats() for _ in sources}
+        self._seen = {}
+        self._lock = Lock()
+        self._event = Event()
+        self._stop = Event()
+        self._threads: list[Thread] = []
+
+    def _notify(self, name:str, blockhash:bytes) -> None:
+        now = monotonic()
+        with self._lock:
+            stats = self.stats[name]
+            stats.notifications += 1
+            NOTIFICATIONS.inc(source=name)
+            first = self._seen.get(blockhash)
+            if first is None:
+                self._seen = {k: v for k, v in self._seen.items() if (now - v) < NOTIFY_SEEN_TIME}
+                self._seen[blockhash] = now
+                stats.first += 1
+                LOGGER.debug('New block %s from %s', bytes2revhex(blockhash), name)
+                self._event.set()
+            else:
+                lag = now - first
+                stats.lag_total += lag
+                stats.lag_max = max(stats.lag_max, lag)
+                NOTIFY_LAG.observe(lag, source=name)
+                LOGGER.debug('Block %s from %s, %.3fs behind', bytes2revhex(blockhash), name, lag)
+
+    def _run(self, source:BlockNotifier) -> None:
+        while not self._stop.is_set():
+            try:
+                source.run(self._notify, self._stop)
+            except Exception as ex:
+                self.stats[source.name].errors += 1
+                LOGGER.warning('Block notifications from %s failed: %s', source.name, ex)
+                if isinstance(ex, NotifierError):
+                    return
+                RETRIES.inc(kind='notify')
+                self._stop.wait(DEFAULT_NOTIFY_RECONNECT_TIME)
+
+    def start(self) -> None:
+        for source in self.sources:
+            thread = Thread(target=self._run, args=(source,), name=f'notify-{source.name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._event.set()
+
+    def summary(self) -> str:
+        return ', '.join(f'{name} {s.notifications} ({s.first} first, lag {s.lag_mean:.3f}s mean {s.lag_max:.3f}s max)'
+                         for name, s in self.stats.items())
+
+    def wait(self, timeout:float) -> bool:
+        """Block until a new tip is reported or timeout, True if notified"""
+        notified = self._event.wait(timeout)
+        self._event.clear()
+        return notified
+
+
+def notifier_from_spec(spec:str, chain:BTC_CHAIN_T, poly:PolyAPI) -> BlockNotifier:
+    """
+    Parse a `--notify` source:
+     - `zmq:tcp://host:port` bitcoind -zmqpubhashblock
+     - `rpc` waitfornewblock long-polling on the Bitcoin RPC node
+     - `ws` or `ws:wss://host/path` mempool.space compatible websocket
+     - `poll` or `poll:seconds`
+    """
+    kind, _, arg = spec.partition(':')
+    if kind == 'zmq':
+        if not arg:
+            raise NotifierError('ZMQ notifications need an endpoint, e.g. zmq:tcp://127.0.0.1:28332')
+        return ZMQNotifier(arg)
+    if kind == 'rpc':
+        return WaitForNewBlockNotifier(poly._bitcoinrpc, int(arg or DEFAULT_WAITFORNEWBLOCK_TIMEOUT))
+    if kind == 'ws':
+        return WebSocketNotifier(arg or MempoolSpaceAPI(chain).ws_url())
+    if kind == 'poll':
+        return PollNotifier(poly, float(arg or DEFAULT_SLEEP_TIME))
+    raise NotifierError(f'Unknown block notification source: {spec}')
@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from typing import Optional
+
+from web3.contract.contract import Contract
+
+from .multicall import Multicall
+from .constants import DEFAULT_RELAY_WINDOW
+
+
+class RelayState:
+    height: int
+    hashes: dict[int,bytes]
+
+    def __init__(self, height:int, hashes:dict[int,bytes]):
+        self.height = height
+        self.hashes = hashes
+
+    @property
+    def tip_hash(self) -> bytes:
+        return self.hashes[self.height]
+
+
+class RelayStateReader:
+    """
+    Reads the relay height, tip hash and a window of `getBlockHashReversed`
+    values below the tip. With Multicall3 this is one eth_call per poll: the
+    window is anchored at the previously seen height, and only needs a
+    second call when the relay moved further than the window.
+    """
+    _relay: Contract
+    _multicall: Optional[Multicall]
+    _start_height: Optional[int]
+    _last_height: Optional[int]
+    window: int
+
+    def __init__(self, relay:Contract, multicall:Optional[Multicall], window:int=DEFAULT_RELAY_WINDOW):
+        self._relay = relay
+        self._multicall = multicall
+        self._start_height = None
+        self._last_height = None
+        self.window = window
+
+    def start_height(self) -> int:
+        # Immutable, only needs fetching once
+        if self._start_height is None:
+            self._start_height = int(self._relay.functions.startHeight().call())
+        return self._start_height
+
+    def _window(self, anchor:int) -> range:
+        low = max(self.start_height(), anchor - self.window + 1)
+        return range(low, anchor + self.window + 1)
+
+    def hashes(self, heights:list[int]) -> list[bytes]:
+        """Relay block hashes for many heights, in one eth_call if possible"""
+        getBlockHash = self._relay.functions.getBlockHashReversed
+        if self._multicall is None:
+            return [getBlockHash(_).call() for _ in heights]
+        results = self._multicall.call([getBlockHash(_) for _ in heights])
+        if any(_ is None for _ in results):
+            raise RuntimeError(f'Relay getBlockHashReversed failed for heights {heights}')
+        return results  # type: ignore
+
+    def read(self) -> RelayState:
+        fns = self._relay.functions
+        if self._multicall is None:
+            height = int(fns.getLatestBlockHeight().call())
+            state = RelayState(height, {height: fns.getBlockHashReversed(height).call()})
+        else:
+            anchor = self._last_height if self._last_height is not None else self.start_height()
+            heights = list(self._window(anchor))
+            results = self._multicall.call([fns.getLatestBlockHeight()] +
+                                           [fns.getBlockHashReversed(_) for _ in heights])
+            if results[0] is None:
+                raise RuntimeError('Relay getLatestBlockHeight failed')
+            height = int(results[0])
+            hashes = {h: r for h, r in zip(heights, results[1:]) if r is not None and h <= height}
+            if height not in hashes:
+                # Relay moved beyond the window, re-read around the new height
+                heights = list(self._window(height))
+                heights = [_ for _ in heights if _ <= height]
+                hashes = dict(zip(heights, self.hashes(heights)))
+            state = RelayState(height, hashes)
+        self._last_height = state.height
+        return state
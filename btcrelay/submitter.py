@@ -0,0 +1,197 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from time import time, sleep
+from typing import Optional
+
+from web3 import Web3
+from web3.types import TxParams, TxReceipt, Wei, Nonce
+from hexbytes import HexBytes
+from eth_typing import ChecksumAddress
+from web3.exceptions import TransactionNotFound, Web3Exception
+from web3.contract.contract import ContractFunction
+
+from .constants import (
+    LOGGER,
+    DEFAULT_GAS_PRICE,
+    DEFAULT_SUBMIT_TIMEOUT,
+    DEFAULT_SUBMIT_POLL_TIME,
+    DEFAULT_SUBMIT_GAS_MARGIN
+)
+from .gasmodel import GasModel
+from .metrics import RETRIES, CONFIRM_SECONDS
+
+# Replacement transactions must pay at least 10% more, each attempt pays 25%
+# more so a stuck transaction catches up with rising prices in fewer attempts
+GAS_PRICE_BUMP_PERCENT = 125
+
+
+class PendingTx:
+    tx: TxParams
+    txid: HexBytes
+    txids: list[HexBytes]
+    nonce: int
+    count: int
+    retargets: int
+    time_sent: float
+    time_first: float
+    attempts: int
+    height: Optional[int]
+
+    def __init__(self, tx:TxParams, txid:HexBytes, count:int, retargets:int):
+        self.tx = tx
+        self.txid = txid
+        self.txids = [txid]
+        self.nonce = int(tx['nonce'])
+        self.count = count
+        self.retargets = retargets
+        self.time_sent = self.time_first = time()
+        self.attempts = 1
+        # Relay height once confirmed, when known by the caller
+        self.height = None
+
+
+class PipelinedSubmitter:
+    """
+    Keeps up to `max_inflight` transactions in-flight with locally assigned
+    nonces, rather than waiting for each receipt before sending the next.
+
+    Any transaction which isn't mined within `timeout` seconds is rebroadcast
+    with the same nonce and a higher gas price, replacing it if it was
+    dropped or stuck. When a transaction reverts the later ones will too, so
+    `failed` is set and nothing more is sent until `wait_all` has drained
+    and reset the nonce from the chain.
+    """
+    _w3: Web3
+    _address: ChecksumAddress
+    _nonce: Optional[int]
+    inflight: list[PendingTx]
+    max_inflight: int
+    gas_price: int
+    timeout: float
+    failed: bool
+    gas_model: GasModel
+
+    def __init__(self, w3:Web3, address:ChecksumAddress, max_inflight:int=1,
+                 gas_price:int=DEFAULT_GAS_PRICE, timeout:float=DEFAULT_SUBMIT_TIMEOUT,
+                 gas_model:Optional[GasModel]=None):
+        self._w3 = w3
+        self._address = address
+        self._nonce = None
+        self.inflight = []
+        self.max_inflight = max(1, max_inflight)
+        self.gas_price = gas_price
+        self.timeout = timeout
+        self.failed = False
+        self.gas_model = gas_model if gas_model is not None else GasModel()
+
+    def _next_nonce(self) -> int:
+        if self._nonce is None:
+            self._nonce = self._w3.eth.get_transaction_count(self._address, 'pending')
+        nonce = self._nonce
+        self._nonce += 1
+        return nonce
+
+    def _gas(self, fn:ContractFunction, count:int, retargets:int) -> int:
+        # Later transactions build on earlier in-flight ones, so can't be
+        # estimated against the current chain state
+        if not self.inflight:
+            gas = int(fn.estimate_gas({'from': self._address}))
+            self.gas_model.observe(count, retargets, gas)
+            return gas
+        return int(self.gas_model.estimate(count, retargets) * DEFAULT_SUBMIT_GAS_MARGIN)
+
+    def send(self, fn:ContractFunction, count:int, retargets:int=0) -> Optional[PendingTx]:
+        """Send a transaction for `count` headers, returns None if not sent"""
+        if self.failed:
+            LOGGER.debug('Not sending, waiting for failed submissions to drain')
+            return None
+        params: TxParams = {
+            'from': self._address,
+            'gasPrice': Wei(self.gas_price),
+            'gas': self._gas(fn, count, retargets),
+            'nonce': Nonce(self._next_nonce()),
+        }
+        tx = fn.build_transaction(params)
+        try:
+            txid = self._w3.eth.send_transaction(tx)
+        except Exception:
+            # Nonce wasn't used, re-read it from the chain next time
+            self._nonce = None
+            raise
+        pending = PendingTx(tx, txid, count, retargets)
+        self.inflight.append(pending)
+        LOGGER.debug('Sent %d headers nonce %d tx %s (%d in-flight)',
+                     count, pending.nonce, pending.txid.hex(), len(self.inflight))
+        return pending
+
+    def _rebroadcast(self, pending:PendingTx) -> None:
+        gas_price = (int(pending.tx['gasPrice']) * GAS_PRICE_BUMP_PERCENT) // 100
+        tx: TxParams = {**pending.tx, 'gasPrice': Wei(gas_price)}
+        pending.time_sent = time()
+        pending.attempts += 1
+        RETRIES.inc(kind='rebroadcast')
+        try:
+            txid = self._w3.eth.send_transaction(tx)
+        except (ValueError, Web3Exception, OSError) as ex:
+            # e.g. an earlier attempt was mined in the meantime, or the node timed out
+            LOGGER.warning('Rebroadcast nonce %d failed: %s', pending.nonce, ex)
+            return
+        pending.tx = tx
+        pending.txid = txid
+        pending.txids.append(txid)
+        LOGGER.warning('Rebroadcast nonce %d gasPrice %d attempt %d tx %s',
+                       pending.nonce, gas_price, pending.attempts, txid.hex())
+
+    def _receipt(self, pending:PendingTx) -> Optional[TxReceipt]:
+        # Any of the attempts may be the one which was mined
+        for txid in reversed(pending.txids):
+            try:
+                receipt = self._w3.eth.get_transaction_receipt(txid)
+            except TransactionNotFound:
+                continue
+            pending.txid = txid
+            return receipt
+        return None
+
+    def poll(self) -> list[tuple[PendingTx,TxReceipt]]:
+        """Collect receipts for confirmed transactions, in nonce order"""
+        done: list[tuple[PendingTx,TxReceipt]] = []
+        while self.inflight:
+            pending = self.inflight[0]
+            receipt = self._receipt(pending)
+            if receipt is None:
+                break
+            self.inflight.pop(0)
+            CONFIRM_SECONDS.observe(time() - pending.time_first)
+            if receipt['status'] != 1:
+                LOGGER.error('Submit reverted, nonce %d tx %s',
+                             pending.nonce, pending.txid.hex())
+                self.failed = True
+            else:
+                self.gas_model.observe(pending.count, pending.retargets, receipt['gasUsed'])
+            done.append((pending, receipt))
+        # Every stuck transaction is replaced, later nonces may be stuck on their own gas price
+        now = time()
+        for pending in self.inflight:
+            if (now - pending.time_sent) > self.timeout:
+                self._rebroadcast(pending)
+        return done
+
+    def wait_slot(self) -> list[tuple[PendingTx,TxReceipt]]:
+        """Block until another transaction can be sent"""
+        done = self.poll()
+        while len(self.inflight) >= self.max_inflight:
+            sleep(DEFAULT_SUBMIT_POLL_TIME)
+            done += self.poll()
+        return done
+
+    def wait_all(self) -> list[tuple[PendingTx,TxReceipt]]:
+        """Block until nothing is in-flight, recovering from failures"""
+        done = self.poll()
+        while self.inflight:
+            sleep(DEFAULT_SUBMIT_POLL_TIME)
+            done += self.poll()
+        if self.failed:
+            self.failed = False
+            self._nonce = None
+        return done
@@ -9,7 +9,10 @@ from bitcoinutils.transactions import Transaction  # type: ignore
 from bitcoinutils.keys import P2pkhAddress, P2shAddress  # type: ignore
 
 from .cmd import Cmd
+from .bitcoin import bytes2revhex, hex2revbytes, btc_tx_proof_args, verify_tx_proof
 from .contracts import ContractInfo
+from .multicall import multicall_instance
+from .relaystate import RelayStateReader
 from .apis.mempoolspace import MempoolSpace_Transaction
 from .constants import CONTRACT_NAMES, DEFAULT_GAS_PRICE, LOGGER, CONTRACT_NAME_T, ContractName
 
@@ -17,12 +20,12 @@ from .constants import CONTRACT_NAMES, DEFAULT_GAS_PRICE, LOGGER, CONTRACT_NAME_
 def test_BtTxVerifier(self:'CmdTest', contract_info:dict[CONTRACT_NAME_T,ContractInfo]) -> None:
     TxVerifier = self.dcim.contract_instance('TxVerifier', self.web3, contract_info['TxVerifier']['expected_address'])
     BTCRelay = self.dcim.contract_instance('BTCRelay', self.web3, contract_info['BTCRelay']['expected_address'])
-    height:int = BTCRelay.functions.getLatestBlockHeight().call()
-    relay_hash = BTCRelay.functions.getBlockHash(height).call().hex()
+    state = RelayStateReader(BTCRelay, multicall_instance(self.dcim, self.web3)).read()
+    height = state.height
+    relay_hash = bytes2revhex(state.tip_hash)
     blockhash = self.mempool_space.get_block_hash(height)
     if blockhash != relay_hash:
         raise RuntimeError(f'BTCRelay block hash mismatch, BTCRelay:{relay_hash} Mempool.space:{blockhash}')
-    blockheader = self.mempool_space.get_block_header(blockhash)
 
     transactions = self.mempool_space.block_transactions(blockhash)
 
@@ -67,35 +70,29 @@ def test_BtTxVerifier(self:'CmdTest', contract_info:dict[CONTRACT_NAME_T,Contrac
         print()
         sys.exit(9)
 
+    # Proofs for both from a single merkle tree, checked locally before the calls
+    p2sh_tx_proof, p2pkh_tx_proof = self.poly.txproofs(hex2revbytes(blockhash),
+        [hex2revbytes(p2sh_tx[1]['txid']), hex2revbytes(p2pkh_tx[1]['txid'])], raw=False)
+    p2sh_tx_proof['rawTx'] = p2sh_txo.to_bytes(False)
+    p2pkh_tx_proof['rawTx'] = p2pkh_txo.to_bytes(False)
+    verify_tx_proof(p2sh_tx_proof, hex2revbytes(blockhash))
+    verify_tx_proof(p2pkh_tx_proof, hex2revbytes(blockhash))
+
     # Verify P2SH transaction on-chain
-    p2sh_tx_proof = self.mempool_space.tx_merkleproof(p2sh_tx[1]['txid'])
     result = TxVerifier.functions.verifiedP2SHPayment(
         0,                                           # minConfirmations
-        p2sh_tx_proof['block_height'],               # blockNum
-        [                                            # inclusionProof
-            '0x'+blockheader,                        #   blockHeader
-            '0x'+p2sh_tx[1]['txid'],                 #   txId
-            p2sh_tx_proof['pos'],                    #   txIndex
-            '0x' + ''.join(p2sh_tx_proof['merkle']), #   txMerkleProof
-            '0x' + p2sh_txo.to_bytes(False).hex(),   #   rawTx
-        ],
+        height,                                      # blockNum
+        btc_tx_proof_args(p2sh_tx_proof),            # inclusionProof
         p2sh_tx[2]                                   # txOutIdx
         ).call()
     assert P2shAddress(hash160=result[0].hex()).to_string() == p2sh_tx[1]['vout'][p2sh_tx[2]]['scriptpubkey_address']
     assert result[1] == p2sh_tx[1]['vout'][p2sh_tx[2]]['value']
 
     # Verify P2PKH transaction on-chain
-    p2pkh_tx_proof = self.mempool_space.tx_merkleproof(p2pkh_tx[1]['txid'])
     result = TxVerifier.functions.verifiedP2PKHPayment(
         0,                                            # minConfirmations
-        p2pkh_tx_proof['block_height'],               # blockNum
-        [                                             # inclusionProof
-            '0x'+blockheader,                         #   blockHeader
-            '0x'+p2pkh_tx[1]['txid'],                 #   txId
-            p2pkh_tx_proof['pos'],                    #   txIndex
-            '0x' + ''.join(p2pkh_tx_proof['merkle']), #   txMerkleProof
-            '0x' + p2pkh_txo.to_bytes(False).hex(),   #   rawTx
-        ],
+        height,                                       # blockNum
+        btc_tx_proof_args(p2pkh_tx_proof),            # inclusionProof
         p2pkh_tx[2]                                   # txOutIdx
         ).call()
     assert P2pkhAddress(hash160=result[0].hex()).to_string() == p2pkh_tx[1]['vout'][p2pkh_tx[2]]['scriptpubkey_address']
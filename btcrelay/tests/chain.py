@@ -0,0 +1,35 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from typing import Optional
+
+from ..blockheader import BlockHeader
+from ..validate import bits_to_target, bits_to_work
+
+# Regtest difficulty, so headers can be mined in a couple of attempts
+REGTEST_BITS = 0x207fffff
+
+
+def mine(prev:bytes, time:int, bits:int=REGTEST_BITS, height:int=-1, merkleroot:bytes=bytes(32)) -> BlockHeader:
+    """Header on top of `prev` which meets the proof of work for `bits`"""
+    target = bits_to_target(bits)
+    nonce = 0
+    while True:
+        header = BlockHeader(0x20000000, prev, merkleroot, time, bits, nonce, height=height)
+        if int.from_bytes(header.hash, 'little') <= target:
+            return header
+        nonce += 1
+
+
+def mine_chain(start:int, count:int, prev:Optional[bytes]=None, bits:int=REGTEST_BITS,
+               time:int=1600000000) -> list[BlockHeader]:
+    """Hash chain of `count` headers from height `start`, ten minutes apart"""
+    headers: list[BlockHeader] = []
+    prev = prev if prev is not None else bytes(32)
+    chainwork = 0
+    for height in range(start, start + count):
+        header = mine(prev, time + (height * 600), bits, height)
+        chainwork += bits_to_work(bits)
+        header.chainwork = chainwork
+        headers.append(header)
+        prev = header.hash
+    return headers
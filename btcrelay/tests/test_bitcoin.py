@@ -0,0 +1,154 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pytest
+
+from ..bitcoin import (
+    double_sha256,
+    merkle_build,
+    merkle_branches,
+    merkle_branch_root,
+    parse_txoutproof,
+    verify_tx_proof,
+    MerkleTree,
+    MerkleProofError
+)
+from ..blockheader import HEADER_STRUCT
+
+
+def naive_root(hashes:list[bytes]) -> bytes:
+    level = list(hashes)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [double_sha256(level[i] + level[i+1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def txids(count:int) -> list[bytes]:
+    return [os.urandom(32) for _ in range(count)]
+
+
+def header_for(root:bytes) -> bytes:
+    return HEADER_STRUCT.pack(0x20000000, bytes(32), root, 1600000000, 0x207fffff, 0)
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 8, 13, 100])
+def test_merkle_build(count):
+    hashes = txids(count)
+    assert merkle_build(hashes) == naive_root(hashes)
+    assert MerkleTree(hashes).root == naive_root(hashes)
+
+
+def test_merkle_build_empty():
+    assert merkle_build([]) is None
+    assert MerkleTree([]).root is None
+
+
+@pytest.mark.parametrize('count', [1, 2, 7, 16, 33])
+def test_merkle_branches(count):
+    hashes = txids(count)
+    root, branches = merkle_branches(hashes, range(count))
+    assert root == naive_root(hashes)
+    tree = MerkleTree(hashes)
+    for index, branch in branches.items():
+        assert merkle_branch_root(hashes[index], index, branch) == root
+        assert tree.branch(index) == branch
+
+
+def test_merkle_branches_out_of_range():
+    with pytest.raises(IndexError):
+        merkle_branches(txids(3), [3])
+    with pytest.raises(IndexError):
+        MerkleTree(txids(3)).branch(-1)
+
+
+def test_merkle_tree_proofs():
+    hashes = txids(11)
+    tree = MerkleTree(hashes, header_for(naive_root(hashes)))
+    assert len(tree) == 11
+    assert list(tree.txids()) == hashes
+    for proof, txid in zip(tree.proofs(hashes), hashes):
+        assert proof['txIndex'] == hashes.index(txid)
+        assert proof['txId'] == txid[::-1]
+        verify_tx_proof(proof, double_sha256(tree.header))
+    with pytest.raises(MerkleProofError):
+        tree.index(os.urandom(32))
+
+
+def test_verify_tx_proof_rejects():
+    hashes = txids(6)
+    tree = MerkleTree(hashes, header_for(naive_root(hashes)))
+    proof = tree.proof(hashes[4])
+    with pytest.raises(MerkleProofError):
+        verify_tx_proof({**proof, 'txIndex': 5})
+    with pytest.raises(MerkleProofError):
+        verify_tx_proof(proof, os.urandom(32))
+    with pytest.raises(MerkleProofError):
+        verify_tx_proof({**proof, 'rawTx': b'\x01\x00\x00\x00'})
+
+
+def txoutproof(header:bytes, hashes:list[bytes], matches:set[int]) -> bytes:
+    """Serialized partial merkle tree, as CPartialMerkleTree::TraverseAndBuild"""
+    total = len(hashes)
+    def width(h:int) -> int:
+        return (total + (1 << h) - 1) >> h
+    def node(h:int, pos:int) -> bytes:
+        if h == 0:
+            return hashes[pos]
+        left = node(h - 1, pos * 2)
+        right = node(h - 1, (pos * 2) + 1) if (pos * 2) + 1 < width(h - 1) else left
+        return double_sha256(left + right)
+    bits: list[int] = []
+    out: list[bytes] = []
+    def build(h:int, pos:int) -> None:
+        parent = any(_ in matches for _ in range(pos << h, min((pos + 1) << h, total)))
+        bits.append(int(parent))
+        if h == 0 or not parent:
+            out.append(node(h, pos))
+        else:
+            build(h - 1, pos * 2)
+            if (pos * 2) + 1 < width(h - 1):
+                build(h - 1, (pos * 2) + 1)
+    height = 0
+    while width(height) > 1:
+        height += 1
+    build(height, 0)
+    flags = bytes(sum(bit << j for j, bit in enumerate(bits[i:i+8])) for i in range(0, len(bits), 8))
+    return header + total.to_bytes(4, 'little') + bytes([len(out)]) + b''.join(out) + bytes([len(flags)]) + flags
+
+
+@pytest.mark.parametrize('count,matches', [(1, {0}), (2, {1}), (7, {0, 6}), (13, {3, 4, 12}), (64, set(range(0, 64, 9)))])
+def test_parse_txoutproof(count, matches):
+    hashes = txids(count)
+    header = header_for(naive_root(hashes))
+    proofs = parse_txoutproof(txoutproof(header, hashes, matches).hex())
+    assert [_['txIndex'] for _ in proofs] == sorted(matches)
+    tree = MerkleTree(hashes, header)
+    for proof in proofs:
+        assert proof['txId'] == hashes[proof['txIndex']][::-1]
+        assert proof == tree.proof(hashes[proof['txIndex']])
+        verify_tx_proof(proof, double_sha256(header))
+
+
+def test_parse_txoutproof_duplicate_branch():
+    # [a, b, c, c] has the same root as [a, b, c], CVE-2012-2459
+    hashes = txids(3)
+    hashes.append(hashes[2])
+    header = header_for(naive_root(hashes[:3]))
+    with pytest.raises(MerkleProofError, match='CVE-2012-2459'):
+        parse_txoutproof(txoutproof(header, hashes, {3}))
+
+
+def test_parse_txoutproof_rejects():
+    hashes = txids(5)
+    header = header_for(naive_root(hashes))
+    proof = txoutproof(header, hashes, {2})
+    with pytest.raises(MerkleProofError):
+        parse_txoutproof(txoutproof(header_for(os.urandom(32)), hashes, {2}))
+    with pytest.raises(MerkleProofError):
+        parse_txoutproof(proof[:90])
+    # A flipped bit in one of the hashes
+    with pytest.raises(MerkleProofError):
+        parse_txoutproof(proof[:90] + bytes([proof[90] ^ 1]) + proof[91:])
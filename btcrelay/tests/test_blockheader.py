@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from typing import cast
+
+import pytest
+
+from ..blockheader import BlockHeader, HEADER_SIZE, decode_headers, iter_headers, submit_headers
+from ..apis.bitcoinrpc import BitcoinJsonRpc_getblock_t, parse_getblockheader_t
+from .chain import mine_chain
+
+# Bitcoin mainnet block 1, as returned by `getblockheader`
+BLOCK_1 = {
+    'hash': '00000000839a8e6886ab5951d76f411475428afc90947ee320161bbf18eb6048',
+    'height': 1,
+    'version': 1,
+    'merkleroot': '0e3e2357e806b6cdb1f70b54c3a3a17b6714ee1f0e68bebb44a74b1efd512098',
+    'time': 1231469665,
+    'nonce': 2573394689,
+    'bits': '1d00ffff',
+    'chainwork': '0000000000000000000000000000000000000000000000000000000200020002',
+    'previousblockhash': '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f',
+}
+BLOCK_1_RAW = bytes.fromhex(
+    '010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000'
+    '982051fd1e4ba744bbbe680e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649'
+    'ffff001d01e36299')
+
+
+def test_from_rpc():
+    header = BlockHeader.from_rpc(dict(BLOCK_1))
+    assert header.serialize() == BLOCK_1_RAW
+    assert header.hash[::-1].hex() == BLOCK_1['hash']
+    assert header.height == 1
+    assert header.chainwork == 0x200020002
+    assert header['bits'] == 0x1d00ffff
+
+
+def test_from_bytes_round_trip():
+    header = BlockHeader.from_bytes(BLOCK_1_RAW, 1)
+    assert header.serialize() == BLOCK_1_RAW
+    assert header == BlockHeader.from_rpc(dict(BLOCK_1))
+    assert BlockHeader.from_bytes(header.serialize(), 1).as_tuple() == header.as_tuple()
+
+
+def test_from_dict():
+    parsed = cast(BitcoinJsonRpc_getblock_t, dict(BLOCK_1))
+    parse_getblockheader_t(cast(dict, parsed))
+    header = BlockHeader.from_dict(parsed)
+    assert header.serialize() == BLOCK_1_RAW
+    assert header.chainwork == parsed['chainwork'] == 0x200020002
+    assert submit_headers([header]) == submit_headers([parsed])
+
+
+def test_mapping_access():
+    header = BlockHeader.from_bytes(BLOCK_1_RAW)
+    assert header['nonce'] == 2573394689
+    assert header.get('missing', 5) == 5
+    assert header.height == -1
+    with pytest.raises(KeyError):
+        header['missing']
+
+
+def test_decode_headers():
+    chain = mine_chain(10, 20)
+    raw = b''.join(_.serialize() for _ in chain)
+    decoded = decode_headers(raw, 10)
+    assert decoded == chain
+    assert [_.previousblockhash for _ in decoded[1:]] == [_.hash for _ in decoded[:-1]]
+    assert [_.height for _ in iter_headers(raw)] == [-1] * 20
+    with pytest.raises(ValueError):
+        decode_headers(raw[:HEADER_SIZE + 1])
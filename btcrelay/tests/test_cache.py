@@ -0,0 +1,87 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from ..apis.cache import ResultCache, MISSING
+
+
+def test_get_put():
+    cache = ResultCache(size=10, confirmations=6, ttl=60)
+    assert cache.get('getblock', b'a') is MISSING
+    cache.put('getblock', b'a', None)
+    assert cache.get('getblock', b'a') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction():
+    cache = ResultCache(size=3, confirmations=6, ttl=60)
+    for i in range(3):
+        cache.put('m', i, i)
+    cache.get('m', 0)
+    cache.put('m', 3, 3)
+    assert cache.get('m', 1) is MISSING
+    assert [cache.get('m', _) for _ in (0, 2, 3)] == [0, 2, 3]
+
+
+def test_ttl_expires():
+    cache = ResultCache(size=10, confirmations=6, ttl=-1)
+    cache.tip(100)
+    cache.put('m', 'near', 1, 99)
+    cache.put('m', 'deep', 2, 90)
+    assert cache.get('m', 'near') is MISSING
+    # Deep enough to be immutable, doesn't expire
+    assert cache.get('m', 'deep') == 2
+
+
+def test_tip_change_drops_near_tip():
+    cache = ResultCache(size=10, confirmations=6, ttl=60)
+    cache.tip(100)
+    cache.put('m', 'near', 1, 98)
+    cache.put('m', 'unknown', 2)
+    cache.put('m', 'deep', 3, 80)
+    cache.tip(101)
+    assert cache.get('m', 'near') is MISSING
+    assert cache.get('m', 'unknown') is MISSING
+    assert cache.get('m', 'deep') == 3
+
+
+def test_reorg_by_hash():
+    cache = ResultCache(size=10, confirmations=6, ttl=60)
+    cache.tip(100)
+    cache.put('height2hash', 90, b'a', 90)
+    cache.put('m', 'deep', 1, 91)
+    cache.put('m', 'deeper', 2, 80)
+    cache.block(90, b'a')
+    assert cache.get('m', 'deep') == 1
+    cache.block(90, b'b')
+    assert cache.get('height2hash', 90) is MISSING
+    assert cache.get('m', 'deep') is MISSING
+    assert cache.get('m', 'deeper') == 2
+    assert cache.height_of(b'b') == 90
+
+
+def test_invalidate():
+    cache = ResultCache(size=10, confirmations=6, ttl=60)
+    cache.tip(100)
+    cache.put('m', 'a', 1, 50)
+    cache.put('m', 'b', 2, 60)
+    cache.invalidate(55)
+    assert cache.get('m', 'a') == 1
+    assert cache.get('m', 'b') is MISSING
+
+
+def test_shelf(tmp_path):
+    path = str(tmp_path / 'cache')
+    cache = ResultCache(size=10, confirmations=6, ttl=60, path=path)
+    cache.tip(100)
+    cache.put('m', 'deep', b'immutable', 10)
+    cache.put('m', 'near', b'mutable', 99)
+    cache.close()
+    cache = ResultCache(size=10, confirmations=6, ttl=60, path=path)
+    assert cache.get('m', 'deep') == b'immutable'
+    assert cache.get('m', 'near') is MISSING
+    cache.close()
+
+
+def test_disabled():
+    cache = ResultCache(size=0)
+    cache.put('m', 'a', 1)
+    assert cache.get('m', 'a') is MISSING
@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from ..bitcoin import double_sha256, merkle_build, MerkleTree
+from ..blockheader import HEADER_STRUCT
+from ..depositwatchd import DepositWatcher, DepositJournal, PendingDeposit
+
+TXIDS = [bytes([i]) * 32 for i in range(4)]
+HEADER = HEADER_STRUCT.pack(0x20000000, bytes(32), merkle_build(TXIDS), 1600000000, 0x207fffff, 0)
+BLOCKHASH = double_sha256(HEADER)
+TREE = MerkleTree(TXIDS, HEADER)
+
+
+class Unavailable(RuntimeError):
+    pass
+
+
+def unavailable(*args:Any) -> Any:
+    raise Unavailable('timed out')
+
+
+def watcher(tmp_path, txproofs:Any=None, submitter:Any=None,
+            multicall:Any=None, batch_size:int=1) -> DepositWatcher:
+    poly: Any = SimpleNamespace(txproofs=txproofs or (lambda blockhash, txids: TREE.proofs(txids)))
+    reader: Any = SimpleNamespace(read=lambda: SimpleNamespace(height=200, hashes={100: BLOCKHASH}))
+    deposit: Any = SimpleNamespace(functions=SimpleNamespace(depositDerived=lambda *args: args))
+    if submitter is None:
+        submitter = SimpleNamespace(failed=False)
+    return DepositWatcher(poly, deposit, multicall, reader, submitter,
+                          DepositJournal(str(tmp_path / 'journal')), batch_size)
+
+
+def locate(w:DepositWatcher) -> list[PendingDeposit]:
+    deposits = []
+    for txid in TXIDS:
+        deposit = PendingDeposit('0x' + '11' * 20, txid, txid, 0)
+        deposit.keypairId = txid
+        deposit.pubkeyhash = bytes(20)
+        deposit.minConfirmations = 1
+        w.tracked.add(txid)
+        w._locate(deposit, 100, BLOCKHASH)
+        deposits.append(deposit)
+    return deposits
+
+
+def test_proofs_fail(tmp_path):
+    w = watcher(tmp_path, txproofs=unavailable)
+    deposits = locate(w)
+    with pytest.raises(Unavailable):
+        w.submit()
+    assert w.located[BLOCKHASH] == deposits
+    assert w.pending() == len(deposits)
+
+
+def test_send_fails(tmp_path):
+    w = watcher(tmp_path, submitter=SimpleNamespace(failed=False, wait_slot=unavailable))
+    deposits = locate(w)
+    with pytest.raises(Unavailable):
+        w.submit()
+    assert w.located[BLOCKHASH] == deposits
+    assert not w.inflight
+
+
+def test_simulation_fails(tmp_path):
+    multicall = SimpleNamespace(call=unavailable, aggregate3=lambda fns: fns)
+    w = watcher(tmp_path, submitter=SimpleNamespace(failed=False), multicall=multicall, batch_size=4)
+    deposits = locate(w)
+    with pytest.raises(Unavailable):
+        w.submit()
+    assert w.located[BLOCKHASH] == deposits
+    assert not w.inflight
+
+
+def test_batch_send_fails(tmp_path):
+    slots: list[Any] = [[]]
+    def wait_slot():
+        return slots.pop() if slots else unavailable()
+    submitter = SimpleNamespace(failed=False, wait_slot=wait_slot, send=lambda fn, count: object())
+    multicall = SimpleNamespace(call=lambda fns: [True] * len(fns), aggregate3=lambda fns: fns)
+    w = watcher(tmp_path, submitter=submitter, multicall=multicall, batch_size=2)
+    deposits = locate(w)
+    w.single_gas = 1.0
+    with pytest.raises(Unavailable):
+        w.submit()
+    # The first batch was sent, the second goes back to being located
+    assert [_ for sent in w.inflight.values() for _ in sent] == deposits[:2]
+    assert w.located[BLOCKHASH] == deposits[2:]
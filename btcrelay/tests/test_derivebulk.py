@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import csv
+import json
+import stat
+from typing import Any
+
+import pytest
+
+from ..bitcoin import double_sha256
+from ..derivebulk import DerivedAddress, DerivedWriter, DeriveSeed, derive_batch, verify_sample
+
+OWNER = '0x' + '11' * 20
+
+
+def row(i:int) -> DerivedAddress:
+    return {'owner': OWNER, 'seed': f'{i:064x}', 'keypairId': f'{i:064x}', 'epoch': 1, 'address': f'addr{i}'}
+
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+def test_truncates_partial_record(tmp_path, fmt):
+    path = str(tmp_path / f'out.{fmt}')
+    writer = DerivedWriter(path, fmt)
+    writer.write([row(1), row(2)])
+    writer.close()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    # A crash part way through the next record
+    with open(path, 'a') as handle:
+        handle.write('{"owner": "0x11' if fmt == 'jsonl' else f'{OWNER},{3:064x}')
+
+    writer = DerivedWriter(path, fmt)
+    assert writer.seeds == {row(1)['seed'], row(2)['seed']}
+    writer.write([row(3)])
+    writer.close()
+    with open(path, newline='') as handle:
+        rows = list(csv.DictReader(handle)) if fmt == 'csv' else [json.loads(_) for _ in handle]
+    assert [_['seed'] for _ in rows] == [row(_)['seed'] for _ in (1, 2, 3)]
+
+
+class Call:
+    def __init__(self, result):
+        self.result = result
+
+    def call(self):
+        return self.result
+
+
+class FakeDeposit:
+    """
+    BTCDeposit whose createDerived* rotate the epoch on first use, like an
+    expired deriving key inside one simulated Multicall3 eth_call
+    """
+    def __init__(self):
+        self.epoch = 7
+        self.functions = self
+        self.created: list[int] = []
+
+    def _derive(self, owner, epoch, seed):
+        secret = double_sha256(epoch.to_bytes(32, 'big') + seed + owner.encode())
+        return secret[:20], secret
+
+    def derive(self, owner, seed):
+        return Call((*self._derive(owner, self.epoch, seed), self.epoch))
+
+    def createDerived(self, owner, epoch, seed):
+        self.created.append(epoch)
+        result = (*self._derive(owner, epoch, seed), 3)
+        self.epoch = 8
+        return Call(result)
+
+    def createDerivedWithoutEpoch(self, owner, seed):
+        raise AssertionError('createDerivedWithoutEpoch rotates the epoch mid-batch')
+
+
+def test_derive_batch_pins_epoch():
+    d: Any = FakeDeposit()
+    batch = [DeriveSeed(OWNER, bytes([i]) * 32) for i in range(5)]
+    rows = [_ for _ in derive_batch(d, None, batch) if _ is not None]
+    assert [_['epoch'] for _ in rows] == [7] * 5
+    assert set(d.created) == {7}
+    for seed, result in zip(batch, rows):
+        assert result['keypairId'] == d._derive(OWNER, 7, seed.seed)[1].hex()
+
+
+def test_verify_sample_mismatch():
+    d: Any = FakeDeposit()
+    batch = [DeriveSeed(OWNER, bytes(32))]
+    pubkey, keypairId = d._derive(OWNER, 8, bytes(32))
+    with pytest.raises(RuntimeError):
+        verify_sample(d, batch, [(pubkey, keypairId, 7, 3)])
+    verify_sample(d, batch, [None])
@@ -0,0 +1,43 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from ..fetchd import find_fork_height
+
+
+def chains(low:int, tip:int, fork:int):
+    """Relay & Bitcoin hash lookups which agree up to and including `fork`"""
+    calls = []
+    def relay(heights):
+        calls.append(len(heights))
+        assert all(low <= h <= tip for h in heights)
+        return [h.to_bytes(32, 'little') for h in heights]
+    def btc(heights):
+        return [h.to_bytes(32, 'little') if h <= fork else b'\xff' * 32 for h in heights]
+    return relay, btc, calls
+
+
+@pytest.mark.parametrize('fork', [100, 101, 150, 998, 999, 1000])
+def test_find_fork_height(fork):
+    relay, btc, _ = chains(100, 1000, fork)
+    assert find_fork_height(relay, btc, 1000, 100) == fork
+
+
+def test_find_fork_height_lookups():
+    relay, btc, calls = chains(0, 1 << 20, 12345)
+    assert find_fork_height(relay, btc, 1 << 20, 0) == 12345
+    # One batch of probes, then a binary search between two of them
+    assert calls[0] <= 22
+    assert len(calls) <= 1 + 21
+
+
+def test_find_fork_height_in_sync():
+    relay, btc, calls = chains(10, 20, 20)
+    assert find_fork_height(relay, btc, 20, 10) == 20
+    assert len(calls) == 1
+
+
+def test_find_fork_height_not_on_chain():
+    relay, btc, _ = chains(100, 200, 50)
+    with pytest.raises(RuntimeError):
+        find_fork_height(relay, btc, 200, 100)
@@ -0,0 +1,54 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from ..gasmodel import GasModel, count_retargets
+
+
+@pytest.mark.parametrize('start,count,expected', [
+    (1, 2015, 0),
+    (1, 2016, 1),
+    (2016, 1, 1),
+    (2015, 2, 1),
+    (2017, 2015, 0),
+    (0, 1, 1),
+    (1, 4032, 2),
+    (4000, 5000, 3),
+])
+def test_count_retargets(start, count, expected):
+    assert count_retargets(start, count) == expected
+    assert count_retargets(start, count) == sum(1 for h in range(start, start + count) if h % 2016 == 0)
+
+
+def test_fit():
+    model = GasModel(0, 1, 25000)
+    samples = [(n, count_retargets(1000, n), 50000 + (30000 * n) + (25000 * count_retargets(1000, n)))
+               for n in (1, 10, 50, 100, 1100)]
+    model.fit(samples)
+    assert model.base == pytest.approx(50000, rel=1e-6)
+    assert model.per_header == pytest.approx(30000, rel=1e-6)
+    assert model.estimate(20) == pytest.approx(50000 + (30000 * 20), abs=1)
+    assert model.observations == len(samples)
+
+
+def test_fit_single_size_observes():
+    model = GasModel()
+    before = model.estimate(10)
+    model.fit([(10, 0, before + 10000)])
+    assert before < model.estimate(10) <= before + 10000
+
+
+def test_observe_converges():
+    model = GasModel()
+    for _ in range(200):
+        for n in (1, 5, 20):
+            model.observe(n, 0, 40000 + (20000 * n))
+    assert model.estimate(10) == pytest.approx(40000 + (20000 * 10), rel=0.01)
+
+
+def test_max_headers():
+    model = GasModel(100000, 50000, 0)
+    assert model.max_headers(1, 1000, 100000 + (50000 * 10)) == 10
+    assert model.max_headers(1, 5, 10 ** 9) == 5
+    # Always at least one, even over budget
+    assert model.max_headers(1, 5, 1) == 1
@@ -0,0 +1,110 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pytest
+
+from ..headerstore import HeaderStore, HeaderStoreError, FILE_STRUCT, GROW_RECORDS
+from .chain import mine_chain
+
+
+def test_put_get(tmp_path):
+    headers = mine_chain(100, 10)
+    store = HeaderStore(str(tmp_path / 'headers'))
+    store.put(headers)
+    assert store.base_height == 100
+    assert store.tip_height == 109
+    for header in headers:
+        stored = store.get(header.height)
+        assert stored is not None
+        assert stored.serialize() == header.serialize()
+        assert stored.hash == header.hash
+        assert stored.chainwork == header.chainwork
+        assert store.height_of(header.hash) == header.height
+    assert store.get(99) is None and store.get(110) is None
+    assert [_['hash'] for _ in store.get_range(range(102, 106)) or []] == [_.hash for _ in headers[2:6]]
+    assert store.get_range(range(105, 111)) is None
+    store.close()
+
+
+def test_truncate(tmp_path):
+    headers = mine_chain(0, 10)
+    store = HeaderStore(str(tmp_path / 'headers'))
+    store.put(headers)
+    store.truncate(6)
+    assert store.tip_height == 5
+    assert 6 not in store
+    assert store.height_of(headers[6].hash) is None
+    assert store.height_of(headers[5].hash) == 5
+    # Truncating above the tip does nothing
+    store.truncate(20)
+    assert store.tip_height == 5
+    store.truncate(0)
+    assert store.tip_height is None
+    store.close()
+
+
+def test_reopen(tmp_path):
+    path = str(tmp_path / 'headers')
+    headers = mine_chain(50, 8)
+    store = HeaderStore(path)
+    store.put(headers)
+    store.truncate(55)
+    store.close()
+
+    store = HeaderStore(path)
+    assert (store.base_height, store.tip_height) == (50, 54)
+    assert store.hash_at(54) == headers[4].hash
+    assert store.height_of(headers[0].hash) == 50
+    assert store.height_of(headers[5].hash) is None
+    store.close()
+
+
+def test_put_replaces_fork(tmp_path):
+    headers = mine_chain(0, 10)
+    fork = mine_chain(6, 6, prev=headers[5].hash, time=1700000000)
+    store = HeaderStore(str(tmp_path / 'headers'))
+    store.put(headers)
+    store.put(fork)
+    assert store.tip_height == 11
+    assert store.hash_at(5) == headers[5].hash
+    assert store.hash_at(6) == fork[0].hash
+    assert store.height_of(headers[7].hash) is None
+    store.close()
+
+
+def test_put_unlinked_restarts(tmp_path):
+    store = HeaderStore(str(tmp_path / 'headers'))
+    store.put(mine_chain(0, 5))
+    other = mine_chain(100, 3, prev=b'\x01' * 32)
+    store.put(other)
+    assert (store.base_height, store.tip_height) == (100, 102)
+    store.close()
+
+
+def test_put_not_chain(tmp_path):
+    headers = mine_chain(0, 4)
+    store = HeaderStore(str(tmp_path / 'headers'))
+    with pytest.raises(HeaderStoreError):
+        store.put([headers[0], headers[2]])
+    store.close()
+
+
+def test_grows(tmp_path):
+    path = str(tmp_path / 'headers')
+    store = HeaderStore(path)
+    headers = mine_chain(0, GROW_RECORDS + 5)
+    store.put(headers)
+    store.close()
+    store = HeaderStore(path)
+    assert store.count == GROW_RECORDS + 5
+    assert store.hash_at(GROW_RECORDS + 4) == headers[-1].hash
+    store.close()
+
+
+def test_not_a_store(tmp_path):
+    path = str(tmp_path / 'headers')
+    with open(path, 'wb') as handle:
+        handle.write(os.urandom(FILE_STRUCT.size * 4))
+    with pytest.raises(HeaderStoreError):
+        HeaderStore(path)
@@ -0,0 +1,17 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from ..apis import jsonrpc
+
+
+def test_only_read_only_methods_coalesced(monkeypatch):
+    coalesced = []
+    def run(key, fn):
+        coalesced.append(key[1])
+        return fn()
+    monkeypatch.setattr(jsonrpc.COALESCER, 'run', run)
+    monkeypatch.setattr(jsonrpc, '_post', lambda url, request, pool=None: {'result': request['method'], 'id': request['id']})
+    url = 'http://127.0.0.1:18443'
+    assert jsonrpc.jsonrpc(url, 'getblockcount') == 'getblockcount'
+    assert jsonrpc.jsonrpc(url, 'generatetoaddress', [1, 'addr']) == 'generatetoaddress'
+    assert jsonrpc.jsonrpc(url, 'sendrawtransaction', ['00']) == 'sendrawtransaction'
+    assert coalesced == ['getblockcount']
@@ -0,0 +1,34 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from ..bitcoin import double_sha256
+from ..apis.poly import PolyAPI, PolyAPIError, PolyBackend
+
+HASH = double_sha256(b'header')
+
+
+class HeaderBackend(PolyBackend):
+    """Single header lookups only, like mempool.space"""
+    supports = frozenset(['getheader'])
+
+    def __init__(self):
+        super().__init__('headers', 1.0)
+        self.requests: list[bytes] = []
+
+    def getheader(self, blockhash):
+        self.requests.append(blockhash)
+        return {'hash': blockhash, 'height': 100}
+
+
+def test_getheader_single_backend():
+    poly = PolyAPI('btc-regtest', 'http://127.0.0.1:18443')
+    backend = HeaderBackend()
+    poly.backends = [backend]
+    assert poly.getheader(HASH)['height'] == 100
+    # Served from the cache the second time
+    assert poly.getheaders([HASH])[0]['height'] == 100
+    assert backend.requests == [HASH]
+    # Bulk lookups still need a backend which supports them
+    with pytest.raises(PolyAPIError):
+        poly.getheaders([double_sha256(b'one'), double_sha256(b'two')])
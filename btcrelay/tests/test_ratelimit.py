@@ -0,0 +1,135 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from threading import Event, Thread
+
+import pytest
+
+from ..apis import ratelimit
+from ..apis.ratelimit import (
+    TokenBucket,
+    Coalescer,
+    parse_rate_limit,
+    retry_after,
+    backoff_delay,
+    is_throttled,
+    send_throttled,
+    MIN_RATE
+)
+
+
+class Clock:
+    """Stands in for `monotonic` and `time.sleep`, sleeping advances it"""
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds:float) -> None:
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'monotonic', clock)
+    monkeypatch.setattr(ratelimit.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_burst_then_rate(clock):
+    bucket = TokenBucket('test', rate=10, burst=2)
+    assert [bucket.reserve() for _ in range(4)] == pytest.approx([0, 0, 0.1, 0.2])
+    clock.now += 10
+    assert [bucket.reserve() for _ in range(2)] == [0, 0]
+    assert bucket.reserve() > 0
+
+
+def test_throttled_pauses_and_halves(clock):
+    bucket = TokenBucket('test', rate=8, burst=8)
+    bucket.throttled(5)
+    assert bucket.current == 4
+    assert bucket.reserve() == pytest.approx(5 + 0.25)
+    # Replies to requests sent before the pause only extend it
+    bucket.throttled(1)
+    assert bucket.current == 4
+    for _ in range(100):
+        bucket.throttled(0)
+        clock.now += 1
+    assert bucket.current == MIN_RATE
+
+
+def test_recovers(clock):
+    bucket = TokenBucket('test', rate=20, burst=20)
+    bucket.throttled(0)
+    assert bucket.current == 10
+    for _ in range(30):
+        clock.now += 1
+        bucket.succeeded()
+    assert bucket.current == 20
+
+
+def test_unlimited_learns_rate(clock):
+    bucket = TokenBucket('test')
+    for _ in range(12):
+        assert bucket.reserve() == 0
+    bucket.throttled(2)
+    assert bucket.rate == 12
+    assert bucket.current == 6
+    assert bucket.reserve() == pytest.approx(2 + (1 / 6))
+
+
+def test_send_throttled(clock):
+    replies = [(429, {'Retry-After': '3'}, b''), (503, {'Retry-After': '1'}, b''), (200, {}, b'ok')]
+    bucket = TokenBucket('test', rate=100, burst=100)
+    assert send_throttled(bucket, lambda: replies.pop(0)) == (200, {}, b'ok')
+    assert clock.slept >= 4
+    # Gives up after `retries`, returning the throttled reply
+    assert send_throttled(bucket, lambda: (429, {'Retry-After': '0'}, b''), retries=2)[0] == 429
+
+
+def test_helpers():
+    assert parse_rate_limit('mempool.space=5/10') == ('mempool.space', 5.0, 10.0)
+    assert parse_rate_limit('example.com=0.5') == ('example.com', 0.5, None)
+    with pytest.raises(ValueError):
+        parse_rate_limit('example.com')
+    assert retry_after({'Retry-After': '7'}) == 7
+    assert retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}) == 0
+    assert retry_after({}) is None
+    assert is_throttled(429) and is_throttled(503, {'Retry-After': '1'})
+    assert not is_throttled(503) and not is_throttled(200)
+    assert backoff_delay(0, {'Retry-After': '1000'}, cap=30) == 30
+    assert all(0 <= backoff_delay(n, base=1, cap=8) <= min(8, 2 ** n) for n in range(10))
+
+
+def test_coalescer(monkeypatch):
+    coalescer = Coalescer('test')
+    started, waiting, release = Event(), Event(), Event()
+    # The waiter counts itself as coalesced just before it waits
+    class Counter:
+        def inc(self, **labels):
+            waiting.set()
+    monkeypatch.setattr(ratelimit, 'COALESCED', Counter())
+    calls = []
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'result': [1]}
+    results = []
+    owner = Thread(target=lambda: results.append(coalescer.run('key', fn)))
+    owner.start()
+    started.wait(5)
+    waiter = Thread(target=lambda: results.append(coalescer.run('key', fn)))
+    waiter.start()
+    waiting.wait(5)
+    release.set()
+    owner.join()
+    waiter.join()
+    assert len(calls) == 1
+    assert results == [{'result': [1]}, {'result': [1]}]
+    # Waiters get their own copy
+    assert results[0] is not results[1]
+    assert coalescer.run('key', lambda: 2) == 2
@@ -0,0 +1,80 @@
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from ..blockheader import BlockHeader
+from ..validate import validate_headers, bits_to_target, bits_to_work, HeaderValidationError, MEDIAN_TIME_SPAN
+from .chain import mine, mine_chain, REGTEST_BITS
+
+# Target 128x lower than regtest's, still cheap to mine
+HARDER_BITS = 0x2000ffff
+
+
+def reason(headers, ancestors, is_testnet=False):
+    with pytest.raises(HeaderValidationError) as ex:
+        validate_headers(headers, ancestors, is_testnet)
+    return ex.value.reason
+
+
+def test_bits_to_target():
+    assert bits_to_target(0x1d00ffff) == 0xffff << 208
+    assert bits_to_target(0x207fffff) == 0x7fffff << 232
+    assert bits_to_work(0x1d00ffff) == 0x100010001
+
+
+def test_valid():
+    chain = mine_chain(2000, 40)
+    validate_headers(chain[MEDIAN_TIME_SPAN:], chain[:MEDIAN_TIME_SPAN])
+    # Without ancestors the checks which need them are skipped
+    validate_headers(chain, [])
+
+
+def test_pow_not_met():
+    prev = mine_chain(10, 1)[0]
+    target = bits_to_target(REGTEST_BITS)
+    nonce = 0
+    while True:
+        header = BlockHeader(0x20000000, prev.hash, bytes(32), prev.time + 600, REGTEST_BITS, nonce, height=11)
+        if int.from_bytes(header.hash, 'little') > target:
+            break
+        nonce += 1
+    assert reason([header], [prev]) == 'POW_NOT_MET'
+
+
+def test_bad_hash_and_linkage():
+    chain = mine_chain(10, 3)
+    forged = BlockHeader(chain[1].version, chain[1].previousblockhash, chain[1].merkleroot, chain[1].time,
+                         chain[1].bits, chain[1].nonce, b'\x00' * 32, chain[1].height)
+    assert reason([forged], chain[:1]) == 'BAD_HASH'
+    assert reason([chain[2]], chain[:1]) == 'NOT_IN_SEQUENCE'
+    other = mine(b'\x01' * 32, chain[1].time, height=11)
+    assert reason([other], chain[:1]) == 'NOT_HASH_CHAIN'
+
+
+def test_retarget():
+    ancestors = mine_chain(2005, 11, bits=HARDER_BITS)
+    # 128x easier at a retarget height, the contract only allows 4x
+    easier = mine(ancestors[-1].hash, ancestors[-1].time + 600, REGTEST_BITS, 2016)
+    assert reason([easier], ancestors) == 'INVALID_RETARGET'
+    # Testnets allow minimum difficulty blocks
+    validate_headers([easier], ancestors, is_testnet=True)
+    # Within 4x is fine at a retarget height
+    same = mine(ancestors[-1].hash, ancestors[-1].time + 600, HARDER_BITS, 2016)
+    validate_headers([same], ancestors)
+
+
+def test_wrong_target():
+    ancestors = mine_chain(100, 11, bits=HARDER_BITS)
+    changed = mine(ancestors[-1].hash, ancestors[-1].time + 600, REGTEST_BITS, 111)
+    assert reason([changed], ancestors) == 'WRONG_TARGET'
+
+
+def test_median_time_past():
+    ancestors = mine_chain(100, MEDIAN_TIME_SPAN)
+    median = sorted(_.time for _ in ancestors)[MEDIAN_TIME_SPAN // 2]
+    old = mine(ancestors[-1].hash, median, height=111)
+    assert reason([old], ancestors) == 'TIME_TOO_OLD'
+    ok = mine(ancestors[-1].hash, median + 1, height=111)
+    validate_headers([ok], ancestors)
+    # Fewer ancestors than the median span, the check is skipped
+    validate_headers([old], ancestors[-5:])
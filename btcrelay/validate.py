@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from hashlib import sha256
+from typing import Optional, Sequence
+
+from .blockheader import HEADER_STRUCT, HEADER_T
+from .constants import BTC_RETARGET_PERIOD
+
+# Number of previous blocks whose median time a block must exceed
+MEDIAN_TIME_SPAN = 11
+
+
+class HeaderValidationError(ValueError):
+    """
+    A header which the relay contract would reject (or Bitcoin consensus
+    would), `reason` uses the same strings as the contract's reverts
+    """
+    height: int
+    reason: str
+
+    def __init__(self, height:int, reason:str, detail:str=''):
+        super().__init__(f'{reason} at height {height}' + (f': {detail}' if detail else ''))
+        self.height = height
+        self.reason = reason
+
+
+def bits_to_target(bits:int) -> int:
+    """Mirrors `nBitsToTarget` in AbstractRelay.sol"""
+    exp = bits >> 24
+    c = bits & 0xffffff
+    if exp < 3:
+        return c >> (8 * (3 - exp))
+    return c << (8 * (exp - 3))
+
+
+def bits_to_work(bits:int) -> int:
+    """Expected hashes to mine a block at `bits`, as `GetBlockProof` adds to chainwork"""
+    return (1 << 256) // (bits_to_target(bits) + 1)
+
+
+def validate_headers(headers:Sequence[HEADER_T],
+                     ancestors:Sequence[HEADER_T],
+                     is_testnet:bool=False) -> None:
+    """
+    Check a batch of headers the way `submit` will, before paying for it:
+    hashes, prev-hash linkage, proof of work against `bits` and the retarget
+    rule from `AbstractBTCRelay._checkRetarget`, plus median-time-past.
+
+    `ancestors` are the consecutive headers immediately before the batch,
+    oldest first. The last one anchors the linkage & target checks, and up
+    to 11 are used for median-time-past. Checks which need an ancestor that
+    isn't available are skipped.
+
+    Raises `HeaderValidationError` for the first invalid header.
+    """
+    pack = HEADER_STRUCT.pack
+    times = [_['time'] for _ in ancestors[-MEDIAN_TIME_SPAN:]]
+    prev = ancestors[-1] if ancestors else None
+    prevHash = prev['hash'] if prev is not None else None
+    prevTarget: Optional[int] = bits_to_target(prev['bits']) if prev is not None else None
+    prevHeight = prev['height'] if prev is not None else None
+
+    for block in headers:
+        height = block['height']
+        if prevHeight is not None and height != prevHeight + 1:
+            raise HeaderValidationError(height, 'NOT_IN_SEQUENCE', f'follows height {prevHeight}')
+
+        raw = pack(block['version'], block['previousblockhash'], block['merkleroot'],
+                   block['time'], block['bits'], block['nonce'])
+        blockHash = sha256(sha256(raw).digest()).digest()
+        if blockHash != block['hash']:
+            raise HeaderValidationError(height, 'BAD_HASH', 'fields do not hash to the block hash')
+
+        if prevHash is not None and block['previousblockhash'] != prevHash:
+            raise HeaderValidationError(height, 'NOT_HASH_CHAIN')
+
+        target = bits_to_target(block['bits'])
+        if int.from_bytes(blockHash, 'little') > target:
+            raise HeaderValidationError(height, 'POW_NOT_MET')
+
+        # Testnets allow minimum difficulty blocks, so the contract doesn't enforce these
+        if prevTarget is not None and not is_testnet:
+            if height % BTC_RETARGET_PERIOD == 0:
+                if target < (prevTarget >> 2) or target > (prevTarget << 2):
+                    raise HeaderValidationError(height, 'INVALID_RETARGET')
+            elif target != prevTarget:
+                raise HeaderValidationError(height, 'WRONG_TARGET')
+
+        if len(times) == MEDIAN_TIME_SPAN:
+            median = sorted(times)[MEDIAN_TIME_SPAN // 2]
+            if block['time'] <= median:
+                raise HeaderValidationError(height, 'TIME_TOO_OLD', f'{block["time"]} <= median {median}')
+            del times[0]
+        times.append(block['time'])
+
+        prevHash = blockHash
+        prevTarget = target
+        prevHeight = height